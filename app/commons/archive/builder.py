@@ -0,0 +1,323 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+import minio
+
+from app.commons.archive.checksums import MANIFEST_ALGORITHMS
+from app.commons.archive.checksums import ChecksumManifest
+from app.commons.archive.checksums import HashingWriter
+from app.commons.archive.compression_policy import CompressionPolicy
+from app.commons.archive.parallel import ParallelZipWriter
+from app.commons.archive.parallel import get_compression_executor
+from app.commons.archive.tar_writer import TarWriter
+from app.commons.archive.zip_writer import ZipWriter
+from app.commons.object_fetcher import FetchStats
+from app.commons.object_fetcher import is_retryable
+
+_TAR_COMPRESSION = {'tar': '', 'tar.gz': 'gz', 'tar.zst': 'zst'}
+
+_END = object()
+_SKIP = object()
+
+
+class _ObjectStream:
+    """Body of one object, filled by a reader thread and drained by the archive writer."""
+
+    def __init__(self, arcname: str, read_ahead: int):
+        self.arcname = arcname
+        self.queue = queue.Queue(maxsize=max(read_ahead, 1))
+
+
+def _release(response):
+    response.close()
+    response.release_conn()
+
+
+class ArchiveBuilder:
+    """Build an archive on disk directly from minio objects.
+
+    Reader threads open the objects and pull their bodies into small bounded queues while the calling thread
+    compresses the previous ones into the open archive, so transfer and compression overlap and no object is
+    staged on disk. Objects are written in the order they were given. The archive is written to a `.part` file
+    and only renamed to its final path when the builder is closed without error. With compression_workers > 1
+    deflate runs in a process pool instead of the calling thread. A CompressionPolicy, when given, picks the
+    compression method of every entry from its name, size and first chunk. archive_format 'tar', 'tar.gz' or
+    'tar.zst' writes a tar instead, compressed as a whole, in which case the policy and compression workers are
+    not used. With checksums the md5 and sha256 of every entry are computed as its bytes go by and written to
+    MANIFEST.sha256 and MANIFEST.md5 at the end of the archive, and the sha256 of the whole archive is available
+    as `sha256` once it is closed. byte_budget caps the bytes buffered between the readers and the writer, it
+    shrinks the number of objects read ahead when workers * read_ahead chunks would not fit. progress, when
+    given, is called with the size of every chunk once it is written to the archive. Opening an object and a read
+    failing midway are retried up to retries times, the read resumes from the bytes already written.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        minio_client,
+        workers: int = 4,
+        read_ahead: int = 4,
+        chunk_size: int = 1024 * 1024,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+        compression_workers: int = 0,
+        policy: Optional[CompressionPolicy] = None,
+        archive_format: str = 'zip',
+        tar_options: Optional[dict] = None,
+        checksums: bool = False,
+        byte_budget: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        logger=None,
+    ):
+        self.path = path
+        self.part_path = path + '.part'
+        self.minio_client = minio_client
+        self.workers = max(workers, 1)
+        self.read_ahead = read_ahead
+        self.chunk_size = chunk_size
+        # every pending object buffers up to read_ahead chunks, at least one object is always read
+        self.window = self.workers + self.read_ahead
+        if byte_budget is not None:
+            self.window = min(self.window, max(byte_budget // (max(read_ahead, 1) * chunk_size), 1))
+        self.retries = max(retries, 0)
+        self.retry_backoff = retry_backoff
+        self.policy = policy
+        self.progress = progress
+        self.logger = logger
+        self._cancelled = threading.Event()
+        self.manifest = ChecksumManifest() if checksums else None
+        self.sha256 = None
+        if archive_format != 'zip' and archive_format not in _TAR_COMPRESSION:
+            raise ValueError('Unsupported archive format %s' % archive_format)
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(self.part_path, 'wb')
+        sink = HashingWriter(self._file) if checksums else self._file
+        self._sink = sink
+        if archive_format != 'zip':
+            self.policy = None
+            self.writer = TarWriter(sink, _TAR_COMPRESSION[archive_format], **(tar_options or {}))
+        elif compression_workers > 1:
+            executor = get_compression_executor(compression_workers)
+            self.writer = ParallelZipWriter(sink, executor, chunk_size=chunk_size)
+        else:
+            self.writer = ZipWriter(sink)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _compress_type(self, arcname: str, size: Optional[int], sample: bytes) -> Optional[int]:
+        if self.policy is None:
+            return None
+        compress_type, _ = self.policy.decide(arcname, size, sample)
+        return compress_type
+
+    def add_bytes(self, arcname: str, data: bytes):
+        if self.manifest is not None:
+            self.manifest.add(arcname).update(data)
+        self._write_bytes(arcname, data)
+
+    def _write_bytes(self, arcname: str, data: bytes):
+        compress_type = self._compress_type(arcname, len(data), data)
+        self.writer.write_entry(arcname, [data], size=len(data), compress_type=compress_type)
+
+    def add_objects(self, objects: Iterable[Tuple[str, str, str]]) -> FetchStats:
+        """add (arcname, bucket, object_name) objects, missing objects are skipped."""
+        stats = FetchStats()
+        start = time.time()
+        pending = []
+        objects = iter(objects)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                exhausted = False
+                while True:
+                    # keep a limited window of readers ahead of the writer
+                    while not exhausted and len(pending) < self.window:
+                        obj = next(objects, None)
+                        if obj is None:
+                            exhausted = True
+                            break
+                        stream = _ObjectStream(obj[0], self.read_ahead)
+                        executor.submit(self._read_object, obj[1], obj[2], stream, stats)
+                        pending.append(stream)
+                    if not pending:
+                        break
+                    stats.add(self._write_stream(pending.pop(0)))
+            except BaseException:
+                self._cancelled.set()
+                raise
+        stats.elapsed = time.time() - start
+        return stats
+
+    def _write_stream(self, stream: _ObjectStream):
+        item = stream.queue.get()
+        if item is _SKIP:
+            return None
+        if isinstance(item, BaseException):
+            raise item
+        size = item
+        # the first chunk is used to probe compressibility before the header is written
+        item = stream.queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        sample = item if isinstance(item, bytes) else b''
+        compress_type = self._compress_type(stream.arcname, size, sample)
+        self.writer.start_entry(stream.arcname, size=size, compress_type=compress_type)
+        checksum = self.manifest.add(stream.arcname) if self.manifest is not None else None
+        written = 0
+        while True:
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            self.writer.write(item)
+            if checksum is not None:
+                checksum.update(item)
+            written += len(item)
+            if self.progress is not None:
+                self.progress(len(item))
+            item = stream.queue.get()
+        self.writer.finish_entry()
+        return written
+
+    def _put(self, stream: _ObjectStream, item) -> bool:
+        while not self._cancelled.is_set():
+            try:
+                stream.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _open(self, bucket: str, object_name: str, stats: FetchStats, offset: int = 0, etag: Optional[str] = None):
+        headers = {'If-Match': etag} if etag else None
+        attempt = 0
+        while True:
+            try:
+                return self.minio_client.client.get_object(bucket, object_name, offset=offset, request_headers=headers)
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                self._retry(bucket, object_name, attempt, e, stats)
+
+    def _retry(self, bucket: str, object_name: str, attempt: int, error: Exception, stats: FetchStats):
+        stats.add_retry()
+        if self.logger:
+            self.logger.warning(f'Retry {attempt}/{self.retries} for {bucket}/{object_name}: {error}')
+        time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+
+    def _open_or_report(self, bucket: str, object_name: str, stream: _ObjectStream, stats: FetchStats):
+        """open the object, or hand the writer a skip for a missing object or the error, and return None."""
+        try:
+            return self._open(bucket, object_name, stats)
+        except minio.error.S3Error as e:
+            if e.code == 'NoSuchKey':
+                if self.logger:
+                    self.logger.info('File not found, skipping: ' + str(e))
+                self._put(stream, _SKIP)
+            else:
+                self._put(stream, e)
+        except Exception as e:
+            self._put(stream, e)
+        return None
+
+    def _read_object(self, bucket: str, object_name: str, stream: _ObjectStream, stats: FetchStats):
+        if self._cancelled.is_set():
+            return
+        response = self._open_or_report(bucket, object_name, stream, stats)
+        if response is None:
+            return
+        content_length = response.headers.get('Content-Length')
+        if not self._put(stream, int(content_length) if content_length else None):
+            _release(response)
+            return
+        self._pump(bucket, object_name, stream, stats, response)
+
+    def _pump(self, bucket: str, object_name: str, stream: _ObjectStream, stats: FetchStats, response):
+        """pass the body on to the writer, a read failing midway is resumed from the bytes already passed on.
+
+        The resumed request is conditional on the etag of the first one, so a changed object fails the entry
+        instead of splicing two versions together.
+        """
+        etag = response.headers.get('ETag')
+        offset = 0
+        attempt = 0
+        try:
+            while True:
+                try:
+                    for chunk in response.stream(self.chunk_size):
+                        if not self._put(stream, chunk):
+                            return
+                        offset += len(chunk)
+                    self._put(stream, _END)
+                    return
+                except Exception as e:
+                    if attempt >= self.retries or not is_retryable(e):
+                        self._put(stream, e)
+                        return
+                    attempt += 1
+                    self._retry(bucket, object_name, attempt, e, stats)
+                _release(response)
+                response = None
+                try:
+                    response = self._open(bucket, object_name, stats, offset, etag)
+                except Exception as e:
+                    self._put(stream, e)
+                    return
+        finally:
+            if response is not None:
+                _release(response)
+
+    def close(self):
+        if self.manifest is not None:
+            for algorithm in MANIFEST_ALGORITHMS:
+                self._write_bytes(self.manifest.file_name(algorithm), self.manifest.render(algorithm))
+        self.writer.close()
+        if isinstance(self._sink, HashingWriter):
+            self.sha256 = self._sink.hexdigest()
+        self._file.close()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        self._cancelled.set()
+        if isinstance(self.writer, ParallelZipWriter):
+            self.writer.abort()
+        self._file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
@@ -0,0 +1,75 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import hashlib
+from typing import List
+
+MANIFEST_ALGORITHMS = ('sha256', 'md5')
+
+
+class HashingWriter:
+    """File object wrapper hashing everything written through it."""
+
+    def __init__(self, fileobj, algorithm: str = 'sha256'):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(algorithm)
+
+    def write(self, data: bytes):
+        self.hash.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+
+class EntryChecksum:
+    """md5 and sha256 of one archive entry, updated as its chunks are written."""
+
+    def __init__(self, arcname: str):
+        self.arcname = arcname
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def update(self, data: bytes):
+        self.md5.update(data)
+        self.sha256.update(data)
+
+
+class ChecksumManifest:
+    """Checksums of all entries, rendered in the format of md5sum/sha256sum so `sha256sum -c` can check them."""
+
+    def __init__(self):
+        self.entries: List[EntryChecksum] = []
+
+    def add(self, arcname: str) -> EntryChecksum:
+        entry = EntryChecksum(arcname)
+        self.entries.append(entry)
+        return entry
+
+    def render(self, algorithm: str) -> bytes:
+        lines = [f'{getattr(entry, algorithm).hexdigest()}  {entry.arcname}\n' for entry in self.entries]
+        return ''.join(lines).encode('utf-8')
+
+    @staticmethod
+    def file_name(algorithm: str) -> str:
+        return 'MANIFEST.' + algorithm
@@ -0,0 +1,97 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import zlib
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from app.commons.archive.zip_writer import ZIP_DEFLATED
+from app.commons.archive.zip_writer import ZIP_STORED
+from app.config import ConfigClass
+
+
+class CompressionStats:
+    """Count of the decisions taken for one archive, reported in the job status for tuning."""
+
+    def __init__(self):
+        self.methods = {'stored': {'files': 0, 'bytes': 0}, 'deflated': {'files': 0, 'bytes': 0}}
+        self.reasons = {}
+
+    def add(self, compress_type: int, reason: str, size: Optional[int]):
+        method = self.methods['stored' if compress_type == ZIP_STORED else 'deflated']
+        method['files'] += 1
+        method['bytes'] += size or 0
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.methods, 'reasons': dict(self.reasons)}
+
+
+class CompressionPolicy:
+    """Choose between ZIP_STORED and ZIP_DEFLATED for each archive entry.
+
+    Entries are stored when their extension is a known compressed format, when they are smaller than
+    store_below_size, or when deflating the first probe_size bytes does not shrink them under probe_store_ratio.
+    Everything else is deflated.
+    """
+
+    def __init__(
+        self,
+        stored_extensions: Iterable[str] = (),
+        store_below_size: int = 0,
+        probe_size: int = 4096,
+        probe_store_ratio: float = 0.9,
+    ):
+        self.stored_extensions = tuple(ext.strip().lower() for ext in stored_extensions if ext.strip())
+        self.store_below_size = store_below_size
+        self.probe_size = probe_size
+        self.probe_store_ratio = probe_store_ratio
+        self.stats = CompressionStats()
+
+    def decide(self, arcname: str, size: Optional[int], sample: bytes = b'') -> Tuple[int, str]:
+        """return (compress_type, reason) for one entry and record it."""
+        compress_type, reason = self._decide(arcname, size, sample)
+        self.stats.add(compress_type, reason, size)
+        return compress_type, reason
+
+    def _decide(self, arcname: str, size: Optional[int], sample: bytes) -> Tuple[int, str]:
+        if self.stored_extensions and arcname.lower().endswith(self.stored_extensions):
+            return ZIP_STORED, 'extension'
+        if size is not None and size < self.store_below_size:
+            return ZIP_STORED, 'size'
+        sample = sample[: self.probe_size]
+        if self.probe_size > 0 and sample:
+            ratio = len(zlib.compress(sample, 1)) / len(sample)
+            if ratio >= self.probe_store_ratio:
+                return ZIP_STORED, 'probe'
+            return ZIP_DEFLATED, 'probe'
+        return ZIP_DEFLATED, 'default'
+
+
+def get_compression_policy() -> CompressionPolicy:
+    return CompressionPolicy(
+        stored_extensions=ConfigClass.ZIP_STORED_EXTENSIONS.split(','),
+        store_below_size=ConfigClass.ZIP_STORE_BELOW_SIZE,
+        probe_size=ConfigClass.ZIP_PROBE_SIZE,
+        probe_store_ratio=ConfigClass.ZIP_PROBE_STORE_RATIO,
+    )
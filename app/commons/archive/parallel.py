@@ -0,0 +1,201 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import multiprocessing
+import os
+import zlib
+from collections import deque
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from app.commons.archive.zip_writer import ZIP_DEFLATED
+from app.commons.archive.zip_writer import ZipWriter
+
+# deflate back references reach 32 KiB, priming every chunk with the tail of
+# the previous one keeps the ratio close to a single stream (same as pigz)
+_DEFLATE_WINDOW = 32 * 1024
+# an empty final block, closes a stream made of sync flushed chunks
+_DEFLATE_FINAL_BLOCK = zlib.compressobj(6, zlib.DEFLATED, -15).flush()
+
+_executors: Dict[int, Executor] = {}
+
+
+def deflate_chunk(data: bytes, level: int, zdict: bytes = b'') -> bytes:
+    """deflate one chunk into a byte aligned, non final piece of a raw deflate stream.
+
+    Runs in the worker processes, so it must stay importable without the app configuration.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def get_compression_executor(workers: int) -> Executor:
+    """return the process pool shared by all archives of this process."""
+    executor = _executors.get(workers)
+    if executor is None:
+        # spawn instead of fork, the service process is multi threaded
+        context = multiprocessing.get_context('spawn')
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _executors[workers] = executor
+    return executor
+
+
+class ParallelZipWriter:
+    """ZipWriter front end that deflates members in a process pool.
+
+    Deflated members are cut in chunks of chunk_size which are compressed independently and stitched back into
+    one deflate stream, so a single large member uses several cores as well as many small ones. The calling thread
+    keeps the role of the single writer: operations are queued in order and written once their chunk is compressed,
+    with at most window operations pending.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        executor: Executor,
+        compresslevel: int = 6,
+        chunk_size: int = 1024 * 1024,
+        window: Optional[int] = None,
+    ):
+        self.writer = ZipWriter(fileobj, ZIP_DEFLATED, compresslevel)
+        self.executor = executor
+        self.compresslevel = compresslevel
+        self.chunk_size = chunk_size
+        self.window = window or (os.cpu_count() or 1) * 2
+        self._ops = deque()
+        self._buffer = bytearray()
+        self._tail = b''
+        self._deflated = False
+
+    @property
+    def entries(self):
+        return self.writer.entries
+
+    def start_entry(
+        self,
+        arcname: str,
+        size: Optional[int] = None,
+        compress_type: Optional[int] = None,
+        date_time: Optional[Tuple[int, ...]] = None,
+    ):
+        compress_type = self.writer.compress_type if compress_type is None else compress_type
+        self._deflated = compress_type == ZIP_DEFLATED
+        self._tail = b''
+        self._ops.append(('start', (arcname, size, compress_type, date_time)))
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        if not self._deflated:
+            self._ops.append(('raw', bytes(data)))
+            self._drain(self.window)
+            return
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            chunk = bytes(self._buffer[: self.chunk_size])
+            del self._buffer[: self.chunk_size]
+            self._submit(chunk)
+
+    def _submit(self, chunk: bytes):
+        future = self.executor.submit(deflate_chunk, chunk, self.compresslevel, self._tail)
+        self._tail = chunk[-_DEFLATE_WINDOW:]
+        self._ops.append(('deflated', (future, chunk)))
+        self._drain(self.window)
+
+    def finish_entry(self):
+        if self._deflated and self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer = bytearray()
+            self._submit(chunk)
+        self._ops.append(('finish', self._deflated))
+        self._drain(self.window)
+
+    def write_entry(self, arcname: str, chunks: Iterable[bytes], size: Optional[int] = None, **kwargs):
+        self.start_entry(arcname, size=size, **kwargs)
+        for chunk in chunks:
+            self.write(chunk)
+        self.finish_entry()
+
+    def _drain(self, keep: int):
+        while len(self._ops) > keep:
+            op, value = self._ops.popleft()
+            if op == 'start':
+                arcname, size, compress_type, date_time = value
+                self.writer.start_entry(
+                    arcname,
+                    size=size,
+                    compress_type=compress_type,
+                    date_time=date_time,
+                    precompressed=compress_type == ZIP_DEFLATED,
+                )
+            elif op == 'raw':
+                self.writer.write(value)
+            elif op == 'deflated':
+                future, chunk = value
+                self.writer.write_compressed(future.result(), chunk)
+            else:
+                if value:
+                    self.writer.write_compressed(_DEFLATE_FINAL_BLOCK, b'')
+                self.writer.finish_entry()
+
+    def close(self):
+        self._drain(0)
+        self.writer.close()
+
+    def abort(self):
+        for op, value in self._ops:
+            if op == 'deflated':
+                value[0].cancel()
+        self._ops.clear()
+
+
+def make_zip_archive(
+    base_name: str,
+    root_dir: str,
+    workers: int = 0,
+    chunk_size: int = 1024 * 1024,
+) -> str:
+    """zip every file under root_dir like shutil.make_archive, deflating in a process pool when workers > 1."""
+    archive_name = base_name + '.zip'
+    with open(archive_name, 'wb') as fileobj:
+        if workers > 1:
+            writer = ParallelZipWriter(fileobj, get_compression_executor(workers), chunk_size=chunk_size)
+        else:
+            writer = ZipWriter(fileobj)
+        for folder, dirnames, filenames in os.walk(root_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(folder, filename)
+                arcname = os.path.relpath(path, root_dir)
+                with open(path, 'rb') as source:
+                    writer.write_entry(
+                        arcname,
+                        iter(lambda: source.read(chunk_size), b''),
+                        size=os.path.getsize(path),
+                    )
+        writer.close()
+    return archive_name
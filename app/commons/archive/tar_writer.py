@@ -0,0 +1,165 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import gzip
+import tarfile
+import tempfile
+import time
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+TAR_FORMATS = ('tar', 'tar.gz', 'tar.zst')
+
+_BLOCK_SIZE = tarfile.BLOCKSIZE
+# members of unknown size are buffered in memory up to this size before spilling to disk
+_SPOOL_MAX_SIZE = 64 * 1024 * 1024
+
+
+def is_format_available(archive_format: str) -> bool:
+    """tar.zst needs the zstandard package, which is a dependency of the service but may be missing locally."""
+    return archive_format != 'tar.zst' or zstandard is not None
+
+
+class _TarEntry:
+    def __init__(self, arcname: str, size: Optional[int], mtime: float):
+        self.arcname = arcname
+        self.size = size
+        self.mtime = mtime
+        self.file_size = 0
+
+
+class TarWriter:
+    """Streaming tar writer with the same entry interface as ZipWriter.
+
+    Headers use the pax format so long names and members over 8 GiB are fine. A member's size has to be in its
+    header, members started without a size are spooled until finish_entry. compression can be '', 'gz' or 'zst',
+    the compressed stream is written to fileobj as the members are added.
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        compression: str = '',
+        compresslevel: int = 6,
+        zstd_level: int = 3,
+        zstd_threads: int = -1,
+    ):
+        self._target = fileobj
+        if compression == 'gz':
+            self.fileobj = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=compresslevel)
+        elif compression == 'zst':
+            if zstandard is None:
+                raise RuntimeError('zstandard is required for tar.zst archives')
+            compressor = zstandard.ZstdCompressor(level=zstd_level, threads=zstd_threads)
+            self.fileobj = compressor.stream_writer(fileobj, closefd=False)
+        elif not compression:
+            self.fileobj = fileobj
+        else:
+            raise NotImplementedError('Unsupported tar compression %s' % compression)
+        self.compression = compression
+        self.entries = []
+        self._current = None
+        self._spool = None
+        self._closed = False
+
+    def start_entry(
+        self,
+        arcname: str,
+        size: Optional[int] = None,
+        date_time: Optional[Tuple[int, ...]] = None,
+        **kwargs,
+    ) -> _TarEntry:
+        """start a member, compression options meant for zip entries are ignored."""
+        if self._closed:
+            raise ValueError('Attempt to write to a closed archive')
+        if self._current is not None:
+            raise ValueError('Previous entry %s was not finished' % self._current.arcname)
+        mtime = time.mktime(tuple(date_time) + (0, 0, -1)) if date_time else time.time()
+        entry = _TarEntry(arcname.lstrip('/'), size, mtime)
+        if size is None:
+            self._spool = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        else:
+            self._write_header(entry, size)
+        self._current = entry
+        return entry
+
+    def _write_header(self, entry: _TarEntry, size: int):
+        info = tarfile.TarInfo(entry.arcname)
+        info.size = size
+        info.mtime = int(entry.mtime)
+        info.mode = 0o644
+        self.fileobj.write(info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape'))
+
+    def write(self, data: bytes):
+        entry = self._current
+        if entry is None:
+            raise ValueError('No entry started')
+        if not data:
+            return
+        entry.file_size += len(data)
+        if self._spool is not None:
+            self._spool.write(data)
+            return
+        if entry.file_size > entry.size:
+            raise ValueError('Entry %s is larger than its declared size' % entry.arcname)
+        self.fileobj.write(data)
+
+    def finish_entry(self) -> _TarEntry:
+        entry = self._current
+        if entry is None:
+            raise ValueError('No entry started')
+        if self._spool is not None:
+            self._write_header(entry, entry.file_size)
+            self._spool.seek(0)
+            for chunk in iter(lambda: self._spool.read(1024 * 1024), b''):
+                self.fileobj.write(chunk)
+            self._spool.close()
+            self._spool = None
+        elif entry.file_size != entry.size:
+            raise ValueError('Entry %s is smaller than its declared size' % entry.arcname)
+        remainder = entry.file_size % _BLOCK_SIZE
+        if remainder:
+            self.fileobj.write(b'\0' * (_BLOCK_SIZE - remainder))
+        self.entries.append(entry)
+        self._current = None
+        return entry
+
+    def write_entry(self, arcname: str, chunks: Iterable[bytes], size: Optional[int] = None, **kwargs) -> _TarEntry:
+        self.start_entry(arcname, size=size, **kwargs)
+        for chunk in chunks:
+            self.write(chunk)
+        return self.finish_entry()
+
+    def close(self):
+        """write the end of archive marker and flush the compressor."""
+        if self._closed:
+            return
+        if self._current is not None:
+            raise ValueError('Entry %s was not finished' % self._current.arcname)
+        self.fileobj.write(b'\0' * (_BLOCK_SIZE * 2))
+        if self.fileobj is not self._target:
+            self.fileobj.close()
+        self._closed = True
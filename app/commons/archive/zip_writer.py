@@ -0,0 +1,348 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import struct
+import time
+import zipfile
+import zlib
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+ZIP_STORED = zipfile.ZIP_STORED
+ZIP_DEFLATED = zipfile.ZIP_DEFLATED
+
+# same conservative limit zipfile uses before switching to zip64 records
+ZIP64_LIMIT = zipfile.ZIP64_LIMIT
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# deflate can grow incompressible data slightly, keep headroom when
+# deciding from the declared size whether an entry needs zip64
+_ZIP64_SIZE_HEADROOM = 1 << 24
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_VERSION_DEFAULT = 20
+_VERSION_ZIP64 = 45
+_CREATE_SYSTEM_UNIX = 3
+_FILE_EXTERNAL_ATTR = (0o100644 & 0xFFFF) << 16
+
+_LOCAL_FILE_HEADER = struct.Struct('<4sHHHHHLLLHH')
+_DATA_DESCRIPTOR = struct.Struct('<4sLLL')
+_DATA_DESCRIPTOR_64 = struct.Struct('<4sLQQ')
+_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHLLH')
+_END_OF_CENTRAL_DIRECTORY_64 = struct.Struct('<4sQHHLLQQQQ')
+_END_OF_CENTRAL_DIRECTORY_64_LOCATOR = struct.Struct('<4sLQL')
+
+
+class ZipEntry:
+    """Bookkeeping for one member already written to the archive."""
+
+    def __init__(self, arcname: str, compress_type: int, header_offset: int, date_time: Tuple[int, ...], zip64: bool):
+        self.arcname = arcname
+        self.compress_type = compress_type
+        self.header_offset = header_offset
+        self.date_time = date_time
+        self.zip64 = zip64
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+
+
+class ZipWriter:
+    """Append-only ZIP/Zip64 writer.
+
+    Unlike zipfile.ZipFile it never seeks: every member is followed by a data descriptor, so the output can be a
+    socket-like sink as well as a regular file. Members are written incrementally with start_entry/write/finish_entry
+    and the central directory is emitted by close().
+    """
+
+    def __init__(self, fileobj, compress_type: int = ZIP_DEFLATED, compresslevel: int = 6):
+        self.fileobj = fileobj
+        self.compress_type = compress_type
+        self.compresslevel = compresslevel
+        self.entries = []
+        self.offset = 0
+        self._current = None
+        self._compressor = None
+        self._closed = False
+
+    def _write(self, data: bytes):
+        if data:
+            self.fileobj.write(data)
+            self.offset += len(data)
+
+    def start_entry(
+        self,
+        arcname: str,
+        size: Optional[int] = None,
+        compress_type: Optional[int] = None,
+        date_time: Optional[Tuple[int, ...]] = None,
+        precompressed: bool = False,
+    ) -> ZipEntry:
+        """write the local header of a new member, size is only used to pick between zip32 and zip64.
+
+        With precompressed the data has to be given through write_compressed as a raw deflate stream.
+        """
+        if self._closed:
+            raise ValueError('Attempt to write to a closed archive')
+        if self._current is not None:
+            raise ValueError('Previous entry %s was not finished' % self._current.arcname)
+
+        compress_type = self.compress_type if compress_type is None else compress_type
+        if compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            raise NotImplementedError('Unsupported compression method %s' % compress_type)
+        date_time = date_time or time.localtime(time.time())[:6]
+        zip64 = size is None or size + _ZIP64_SIZE_HEADROOM > ZIP64_LIMIT
+        entry = ZipEntry(arcname.lstrip('/'), compress_type, self.offset, date_time, zip64)
+
+        name = entry.arcname.encode('utf-8')
+        extra = b''
+        placeholder_size = 0
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            placeholder_size = 0xFFFFFFFF
+        dos_time, dos_date = _dos_date_time(date_time)
+        self._write(
+            _LOCAL_FILE_HEADER.pack(
+                b'PK\x03\x04',
+                _VERSION_ZIP64 if zip64 else _VERSION_DEFAULT,
+                _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+                compress_type,
+                dos_time,
+                dos_date,
+                0,
+                placeholder_size,
+                placeholder_size,
+                len(name),
+                len(extra),
+            )
+        )
+        self._write(name)
+        self._write(extra)
+
+        if compress_type == ZIP_DEFLATED and not precompressed:
+            self._compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        self._current = entry
+        return entry
+
+    def write(self, data: bytes):
+        """append raw (uncompressed) member data to the current entry."""
+        entry = self._current
+        if entry is None:
+            raise ValueError('No entry started')
+        if not data:
+            return
+        entry.crc = zlib.crc32(data, entry.crc)
+        entry.file_size += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        entry.compress_size += len(data)
+        self._write(data)
+
+    def write_compressed(self, data: bytes, raw: bytes):
+        """append data already deflated by the caller, raw is the matching uncompressed data for the crc."""
+        entry = self._current
+        if entry is None:
+            raise ValueError('No entry started')
+        if self._compressor is not None:
+            raise ValueError('Entry %s was not started as precompressed' % entry.arcname)
+        entry.crc = zlib.crc32(raw, entry.crc)
+        entry.file_size += len(raw)
+        entry.compress_size += len(data)
+        self._write(data)
+
+    def finish_entry(self) -> ZipEntry:
+        """flush the compressor and write the data descriptor of the current entry."""
+        entry = self._current
+        if entry is None:
+            raise ValueError('No entry started')
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            entry.compress_size += len(tail)
+            self._write(tail)
+            self._compressor = None
+
+        if not entry.zip64 and (entry.file_size > ZIP64_LIMIT or entry.compress_size > ZIP64_LIMIT):
+            raise zipfile.LargeZipFile('Entry %s is larger than its declared size allows' % entry.arcname)
+        if entry.zip64:
+            descriptor = _DATA_DESCRIPTOR_64.pack(b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size)
+        else:
+            descriptor = _DATA_DESCRIPTOR.pack(b'PK\x07\x08', entry.crc, entry.compress_size, entry.file_size)
+        self._write(descriptor)
+
+        self.entries.append(entry)
+        self._current = None
+        return entry
+
+    def write_entry(
+        self,
+        arcname: str,
+        chunks: Iterable[bytes],
+        size: Optional[int] = None,
+        compress_type: Optional[int] = None,
+        date_time: Optional[Tuple[int, ...]] = None,
+    ) -> ZipEntry:
+        """write a whole member from an iterable of byte chunks."""
+        self.start_entry(arcname, size=size, compress_type=compress_type, date_time=date_time)
+        for chunk in chunks:
+            self.write(chunk)
+        return self.finish_entry()
+
+    def close(self):
+        """write the central directory, the archive is not usable before this is called."""
+        if self._closed:
+            return
+        if self._current is not None:
+            raise ValueError('Entry %s was not finished' % self._current.arcname)
+
+        cd_offset = self.offset
+        for entry in self.entries:
+            self._write_central_directory_record(entry)
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+
+        if count >= ZIP_MAX_ENTRIES or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+            eocd64_offset = self.offset
+            self._write(
+                _END_OF_CENTRAL_DIRECTORY_64.pack(
+                    b'PK\x06\x06',
+                    _END_OF_CENTRAL_DIRECTORY_64.size - 12,
+                    (_CREATE_SYSTEM_UNIX << 8) | _VERSION_ZIP64,
+                    _VERSION_ZIP64,
+                    0,
+                    0,
+                    count,
+                    count,
+                    cd_size,
+                    cd_offset,
+                )
+            )
+            self._write(_END_OF_CENTRAL_DIRECTORY_64_LOCATOR.pack(b'PK\x06\x07', 0, eocd64_offset, 1))
+        self._write(
+            _END_OF_CENTRAL_DIRECTORY.pack(
+                b'PK\x05\x06',
+                0,
+                0,
+                min(count, ZIP_MAX_ENTRIES),
+                min(count, ZIP_MAX_ENTRIES),
+                min(cd_size, 0xFFFFFFFF),
+                min(cd_offset, 0xFFFFFFFF),
+                0,
+            )
+        )
+        self._closed = True
+
+    def _write_central_directory_record(self, entry: ZipEntry):
+        extra_fields = []
+        file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+        if file_size > ZIP64_LIMIT:
+            extra_fields.append(file_size)
+            file_size = 0xFFFFFFFF
+        if compress_size > ZIP64_LIMIT:
+            extra_fields.append(compress_size)
+            compress_size = 0xFFFFFFFF
+        if header_offset > ZIP64_LIMIT:
+            extra_fields.append(header_offset)
+            header_offset = 0xFFFFFFFF
+        extra = b''
+        if extra_fields:
+            extra = struct.pack('<HH' + 'Q' * len(extra_fields), 1, 8 * len(extra_fields), *extra_fields)
+        version = _VERSION_ZIP64 if extra_fields or entry.zip64 else _VERSION_DEFAULT
+
+        name = entry.arcname.encode('utf-8')
+        dos_time, dos_date = _dos_date_time(entry.date_time)
+        self._write(
+            _CENTRAL_DIRECTORY.pack(
+                b'PK\x01\x02',
+                (_CREATE_SYSTEM_UNIX << 8) | version,
+                version,
+                _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8,
+                entry.compress_type,
+                dos_time,
+                dos_date,
+                entry.crc,
+                compress_size,
+                file_size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                _FILE_EXTERNAL_ATTR,
+                header_offset,
+            )
+        )
+        self._write(name)
+        self._write(extra)
+
+
+class _BufferSink:
+    """File-like object collecting written bytes until they are drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data: bytes):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def stream_zip(
+    entries: Iterable[Tuple[str, Optional[int], Iterable[bytes]]],
+    chunk_size: int = 64 * 1024,
+    compress_type: int = ZIP_DEFLATED,
+) -> Iterator[bytes]:
+    """Yield a ZIP archive built from (arcname, size, chunks) tuples without staging anything on disk.
+
+    Output is coalesced into pieces of roughly chunk_size bytes so that small deflate outputs do not each become a
+    separate write to the client.
+    """
+    sink = _BufferSink()
+    writer = ZipWriter(sink, compress_type=compress_type)
+    for arcname, size, chunks in entries:
+        writer.start_entry(arcname, size=size)
+        for chunk in chunks:
+            writer.write(chunk)
+            if sink.size >= chunk_size:
+                yield sink.drain()
+        writer.finish_entry()
+        if sink.size >= chunk_size:
+            yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _dos_date_time(date_time: Tuple[int, ...]) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = date_time[:6]
+    # dos dates cannot represent anything before 1980
+    year = max(year, 1980)
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | (second // 2)
+    return dos_time, dos_date
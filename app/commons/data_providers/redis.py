@@ -18,32 +18,62 @@
 # permissions and limitations under the Licence.
 # 
 
+import os
+import threading
 from enum import Enum
+from fnmatch import fnmatchcase
+from typing import Dict
+from typing import List
+from typing import Optional
 
 from redis import StrictRedis
+from redis.exceptions import WatchError
 
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
 from app.config import ConfigClass
 
 _logger = SrvLoggerFactory('SrvRedisSingleton').get_logger()
 
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis_client() -> StrictRedis:
+    """process wide client, every SrvRedisSingleton shares its connection pool.
+
+    redis-py resets the pool in a forked process, so a client created before the fork is safe to use after it.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = StrictRedis(
+                host=ConfigClass.REDIS_HOST,
+                port=ConfigClass.REDIS_PORT,
+                db=ConfigClass.REDIS_DB,
+                password=ConfigClass.REDIS_PASSWORD,
+                max_connections=ConfigClass.REDIS_MAX_CONNECTIONS,
+                socket_timeout=ConfigClass.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=ConfigClass.REDIS_CONNECT_TIMEOUT,
+                health_check_interval=ConfigClass.REDIS_HEALTH_CHECK_INTERVAL,
+            )
+            _logger.info(f'redis pool of process {os.getpid()}: up to {ConfigClass.REDIS_MAX_CONNECTIONS} connections')
+        return _client
 
-class SrvRedisSingleton:
 
-    __instance = {}
+def close_redis_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.connection_pool.disconnect()
+            _client = None
 
+
+class SrvRedisSingleton:
     def __init__(self):
-        self.host = ConfigClass.REDIS_HOST
-        self.port = ConfigClass.REDIS_PORT
-        self.db = ConfigClass.REDIS_DB
-        self.pwd = ConfigClass.REDIS_PASSWORD
         self.connect()
 
     def connect(self):
-        if self.__instance:
-            pass
-        else:
-            self.__instance = StrictRedis(host=self.host, port=self.port, db=self.db, password=self.pwd)
+        self.__instance = get_redis_client()
 
     def get_by_key(self, key: str):
         return self.__instance.get(key)
@@ -52,11 +82,68 @@ class SrvRedisSingleton:
         self.__instance.set(key, content)
         _logger.debug('redis set by key: ' + key + ':  ' + content)
 
+    def set_with_expire(self, key: str, content: str, expire: Optional[int], only_if_absent: bool = False) -> bool:
+        return bool(self.__instance.set(key, content, ex=expire, nx=only_if_absent))
+
+    def mget_by_keys(self, keys: list):
+        return self.__instance.mget(keys) if keys else []
+
+    def mset_with_expire(self, mapping: dict, expire: int):
+        pipeline = self.__instance.pipeline(transaction=False)
+        for key, content in mapping.items():
+            pipeline.set(key, content, ex=expire)
+        pipeline.execute()
+
+    def set_with_indexes(self, key: str, content: str, indexes: List[str], channel: Optional[str] = None):
+        """set the key and add it to the index sets in one transaction, then publish it on the channel."""
+        pipeline = self.__instance.pipeline()
+        pipeline.set(key, content)
+        for index in indexes:
+            pipeline.sadd(index, key)
+        if channel:
+            pipeline.publish(channel, content)
+        pipeline.execute()
+
+    def mget_by_indexes(self, indexes: List[str], pattern: Optional[str] = None) -> list:
+        """values of the keys in all the index sets, and matching the glob pattern if one is given."""
+        keys = self.__instance.sinter(indexes)
+        if pattern:
+            keys = [key for key in keys if fnmatchcase(key.decode(), pattern)]
+        return [value for value in self.__instance.mget(keys) if value is not None] if keys else []
+
+    def keys_by_indexes(self, indexes: List[str], pattern: Optional[str] = None) -> List[str]:
+        keys = [key.decode() for key in self.__instance.sinter(indexes)]
+        return [key for key in keys if fnmatchcase(key, pattern)] if pattern else keys
+
+    def index_keys(self, keys: Dict[str, List[str]]):
+        """add existing keys to their index sets in a single round trip."""
+        if not keys:
+            return
+        pipeline = self.__instance.pipeline(transaction=False)
+        for key, indexes in keys.items():
+            for index in indexes:
+                pipeline.sadd(index, key)
+        pipeline.execute()
+
+    def delete_with_indexes(self, keys: Dict[str, List[str]]):
+        """delete the keys and remove them from their index sets in a single round trip."""
+        if not keys:
+            return
+        pipeline = self.__instance.pipeline(transaction=False)
+        for key, indexes in keys.items():
+            pipeline.delete(key)
+            for index in indexes:
+                pipeline.srem(index, key)
+        pipeline.execute()
+
+    def scan_keys(self, pattern: str) -> List[bytes]:
+        """keys matching the pattern, iterated with SCAN so redis is not blocked like KEYS would."""
+        return list(self.__instance.scan_iter(match=pattern, count=1000))
+
     def mget_by_prefix(self, prefix: str):
         _logger.debug(prefix)
-        query = '{}:*'.format(prefix)
-        keys = self.__instance.keys(query)
-        return self.__instance.mget(keys)
+        keys = self.scan_keys('{}:*'.format(prefix))
+        return self.__instance.mget(keys) if keys else []
 
     def check_by_key(self, key: str):
         return self.__instance.exists(key)
@@ -64,17 +151,56 @@ class SrvRedisSingleton:
     def delete_by_key(self, key: str):
         return self.__instance.delete(key)
 
+    def delete_by_keys(self, keys: list):
+        return self.__instance.delete(*keys) if keys else 0
+
     def mdelete_by_prefix(self, prefix: str):
         _logger.debug(prefix)
-        query = '{}:*'.format(prefix)
-        keys = self.__instance.keys(query)
-        for key in keys:
-            self.__instance.delete(key)
+        keys = self.scan_keys('{}:*'.format(prefix))
+        if keys:
+            self.__instance.delete(*keys)
 
     def get_by_pattern(self, key: str, pattern: str):
-        query_string = '{}:*{}*'.format(key, pattern)
-        keys = self.__instance.keys(query_string)
-        return self.__instance.mget(keys)
+        keys = self.scan_keys('{}:*{}*'.format(key, pattern))
+        return self.__instance.mget(keys) if keys else []
+
+    def add_to_set(self, key: str, *members):
+        return self.__instance.sadd(key, *members)
+
+    def remove_from_set(self, key: str, *members):
+        return self.__instance.srem(key, *members)
+
+    def get_set_members(self, key: str) -> set:
+        return self.__instance.smembers(key)
+
+    def add_to_sorted_set(self, key: str, mapping: Dict[str, float], only_existing: bool = False):
+        return self.__instance.zadd(key, mapping, xx=only_existing)
+
+    def remove_from_sorted_set(self, key: str, *members):
+        return self.__instance.zrem(key, *members)
+
+    def get_sorted_set_size(self, key: str) -> int:
+        return self.__instance.zcard(key)
+
+    def claim_from_sorted_set(self, key: str, max_score: float, score: float) -> Optional[str]:
+        """move the lowest member scored up to max_score to score and return it, None if there is none.
+
+        The set is watched between the read and the update, so two clients never claim the same member.
+        """
+        with self.__instance.pipeline() as pipeline:
+            while True:
+                try:
+                    pipeline.watch(key)
+                    members = pipeline.zrangebyscore(key, '-inf', max_score, start=0, num=1)
+                    if not members:
+                        pipeline.unwatch()
+                        return None
+                    pipeline.multi()
+                    pipeline.zadd(key, {members[0]: score}, xx=True)
+                    pipeline.execute()
+                    return members[0].decode()
+                except WatchError:
+                    continue
 
     def publish(self, channel, data):
         res = self.__instance.publish(channel, data)
@@ -19,22 +19,29 @@
 # 
 
 import json
-import os
-import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Set
 
-import httpx
 import minio
 
-from app.commons.locks import recursive_lock
-from app.commons.locks import unlock_resource
+from app.commons.archive.builder import ArchiveBuilder
+from app.commons.archive.compression_policy import CompressionPolicy
+from app.commons.archive.compression_policy import get_compression_policy
+from app.commons.archive.tar_writer import is_format_available
+from app.commons.locks import LockLease
+from app.commons.locks import LockManager
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.object_fetcher import ObjectFetcher
+from app.commons.progress import ProgressTracker
+from app.commons.segmented_download import get_segmented_downloader
 from app.commons.service_connection.minio_client import Minio_Client_
+from app.commons.service_connection.upstream import get_upstream_client
 from app.config import ConfigClass
 from app.models.base_models import EAPIResponseCode
 from app.models.models_data_download import EDataDownloadStatus
@@ -43,11 +50,16 @@ from app.resources.error_handler import APIException
 
 # from app.resources.helpers import get_geid
 from app.resources.helpers import get_files_recursive
+from app.resources.helpers import get_nodes_by_geids
 from app.resources.helpers import set_status
 
 # from common import GEIDClient
 
 
+class JobStopped(Exception):
+    """the zip job was stopped before it finished."""
+
+
 class DownloadClient:
     def __init__(
         self,
@@ -59,12 +71,16 @@ class DownloadClient:
         session_id: str,
         download_type: str = 'project',
         file_geids_to_include: Optional[Set[str]] = None,
+        archive_format: str = 'zip',
     ):
         self.job_id = 'data-download-' + str(int(time.time()))
         self.job_status = EDataDownloadStatus.INIT
         self.files = files
         self.file_nodes = []
         self.files_to_zip = []
+        # the nodes the read locks are taken from, every node of the listed trees
+        # or only the selected ones when a folder lock covers its subtree
+        self.lock_nodes = []
         self.operator = operator
         self.project_code = project_code
         self.tmp_folder = ConfigClass.MINIO_TMP_PATH + project_code + '_' + str(time.time())
@@ -74,18 +90,70 @@ class DownloadClient:
         self.download_type = download_type
         self.file_geids_to_include = file_geids_to_include
         self.geid = geid
+        self.archive_format = archive_format
+        self.archive_sha256 = None
+        # bytes transferred by the running zip_worker
+        self.progress = None
+        # set when the running zip_worker has to stop, checked before each file
+        self.stop_event: Optional[threading.Event] = None
         self.contains_folder = True if self.download_type == 'full_dataset' else False
         self.logger = SrvLoggerFactory('api_data_download').get_logger()
 
+        if not is_format_available(self.archive_format):
+            error_msg = f'[Invalid archive format] {self.archive_format} is not supported by this service'
+            self.logger.error(error_msg)
+            raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=error_msg)
+
+        nodes = get_nodes_by_geids([file['geid'] for file in files])
         for file in files:
-            self.add_files_to_list(file['geid'])
+            self.add_files_to_list(file['geid'], nodes.get(file['geid']))
 
         if len(self.files_to_zip) < 1 and self.download_type != 'full_dataset':
             error_msg = '[Invalid file amount] must greater than 0'
             self.logger.error(error_msg)
             raise APIException(status_code=EAPIResponseCode.bad_request.value, error_msg=error_msg)
 
-    def set_status(self, status, payload):
+    # the state a queued zip_worker runs from, so the worker does not list the nodes again
+    _JOB_FIELDS = (
+        'job_id',
+        'files',
+        'file_nodes',
+        'files_to_zip',
+        'lock_nodes',
+        'operator',
+        'project_code',
+        'tmp_folder',
+        'result_file_name',
+        'auth_token',
+        'session_id',
+        'download_type',
+        'file_geids_to_include',
+        'geid',
+        'archive_format',
+        'contains_folder',
+    )
+
+    def to_job_spec(self) -> Dict[str, Any]:
+        spec = {field: getattr(self, field) for field in self._JOB_FIELDS}
+        if self.file_geids_to_include is not None:
+            spec['file_geids_to_include'] = sorted(self.file_geids_to_include)
+        return spec
+
+    @classmethod
+    def from_job_spec(cls, spec: Dict[str, Any]) -> 'DownloadClient':
+        """rebuild the client a job was enqueued with, without the lookups of __init__."""
+        client = cls.__new__(cls)
+        for field in cls._JOB_FIELDS:
+            setattr(client, field, spec[field])
+        if client.file_geids_to_include is not None:
+            client.file_geids_to_include = set(client.file_geids_to_include)
+        client.job_status = EDataDownloadStatus.INIT
+        client.archive_sha256 = None
+        client.progress = None
+        client.logger = SrvLoggerFactory('api_data_download').get_logger()
+        return client
+
+    def set_status(self, status, payload, progress=0):
         geid = self.files_to_zip[0]['geid'] if len(self.files_to_zip) > 0 else self.geid
         return set_status(
             self.session_id,
@@ -97,22 +165,28 @@ class DownloadClient:
             self.operator,
             geid,
             payload=payload,
+            progress=progress,
         )
 
-    def add_files_to_list(self, geid: str):
-        url = ConfigClass.NEO4J_SERVICE + f'nodes/geid/{geid}'
+    def add_files_to_list(self, geid: str, nodes: Optional[list] = None):
+        """add the file, or the files below the folder, with that geid. nodes are the already fetched nodes."""
         try:
-            with httpx.Client() as client:
-                res = client.get(url)
-            response = res.json()[0]
+            if nodes is None:
+                nodes = get_nodes_by_geids([geid])[geid]
+            response = nodes[0]
+            self.lock_nodes.append(response)
             if 'Folder' in response['labels']:
                 # Folder in file list
                 self.logger.info(f'Getting folder from geid: {geid}')
-                file_list = get_files_recursive(geid)
+                tree = get_files_recursive(geid, include_folders=True)
+                # nothing below an archived folder is locked
+                if not response.get('archived', False) and not ConfigClass.LOCK_HIERARCHICAL:
+                    self.lock_nodes.extend(tree)
+                file_list = [node for node in tree if 'File' in node['labels']]
                 if len(file_list) > 0:
                     self.contains_folder = True
             else:
-                file_list = res.json()
+                file_list = nodes
             if self.file_geids_to_include is not None:
                 file_list = [file for file in file_list if file['global_entity_id'] in self.file_geids_to_include]
             for file in file_list:
@@ -127,6 +201,7 @@ class DownloadClient:
                         'operator': self.operator,
                         'parent_folder': file['global_entity_id'],
                         'dataset_code': file.get('dataset_code', ''),
+                        'file_size': file.get('file_size'),
                     }
                 )
         except Exception as e:
@@ -138,90 +213,232 @@ class DownloadClient:
         _, bucket, obj_path = tuple(minio_path.split('/', 2))
         return bucket, obj_path
 
+    @property
+    def direct_download(self) -> bool:
+        """a single file is served straight from minio, nothing has to be staged."""
+        return ConfigClass.DIRECT_SINGLE_FILE_DOWNLOAD and len(self.files_to_zip) == 1 and not self.contains_folder
+
     def generate_hash_code(self):
         if len(self.files_to_zip) > 1 or self.contains_folder:
-            self.result_file_name = self.tmp_folder + '.zip'
+            self.result_file_name = self.tmp_folder + '.' + self.archive_format
         else:
             location = self.files_to_zip[0]['location']
             self.result_file_name = self.tmp_folder + '/' + self.parse_minio_location(location)[1]
 
         geid = self.files_to_zip[0]['geid'] if len(self.files_to_zip) > 0 else self.geid
-        return generate_token(
-            {
-                'geid': geid,
-                'full_path': self.result_file_name,
-                'issuer': 'SERVICE DATA DOWNLOAD',
-                'operator': self.operator,
-                'session_id': self.session_id,
-                'job_id': self.job_id,
-                'project_code': self.project_code,
-                'iat': int(time.time()),
-                'exp': int(time.time()) + (ConfigClass.DOWNLOAD_TOKEN_EXPIRE_AT * 60),
-            }
-        )
+        payload = {
+            'geid': geid,
+            'full_path': self.result_file_name,
+            'issuer': 'SERVICE DATA DOWNLOAD',
+            'operator': self.operator,
+            'session_id': self.session_id,
+            'job_id': self.job_id,
+            'project_code': self.project_code,
+            'iat': int(time.time()),
+            'exp': int(time.time()) + (ConfigClass.DOWNLOAD_TOKEN_EXPIRE_AT * 60),
+        }
+        if self.direct_download:
+            payload['minio_location'] = self.files_to_zip[0]['location']
+        return generate_token(payload)
 
-    def add_schemas(self, dataset_geid):
-        """Saves schema json files to folder that will zipped."""
+    def check_direct_access(self):
+        """stat the single file as the user.
+
+        A direct download is streamed with the service credentials, so minio has to enforce the user's own policy
+        here, before the token is handed out.
+        """
+        bucket, obj_path = self.parse_minio_location(self.files_to_zip[0]['location'])
         try:
-            if not os.path.isdir(self.tmp_folder):
-                os.mkdir(self.tmp_folder)
-                os.mkdir(self.tmp_folder + '/data')
+            mc = Minio_Client_(self.auth_token['at'], self.auth_token['rt'])
+            mc.client.stat_object(bucket, obj_path)
+        except minio.error.S3Error as e:
+            self.logger.error(f'Error checking access to {bucket}/{obj_path}: {str(e)}')
+            if e.code in ('NoSuchKey', 'NoSuchBucket'):
+                status_code = EAPIResponseCode.not_found
+            else:
+                status_code = EAPIResponseCode.forbidden
+            raise APIException(status_code=status_code.value, error_msg=f'Error getting file from minio: {str(e)}')
+
+    def direct_download_ready(self, hash_code):
+        """mark a direct download as ready, there is no background job for it."""
+        if self.download_type == 'dataset_files':
+            filenames = ['/'.join(i['location'].split('/')[7:]) for i in self.files_to_zip]
+            self.update_activity_log(self.geid, filenames, 'DATASET_FILEDOWNLOAD_SUCCEED')
+        return self.set_status(EDataDownloadStatus.READY_FOR_DOWNLOADING.name, payload={'hash_code': hash_code})
 
+    def add_schemas(self, dataset_geid, archive: ArchiveBuilder):
+        """Adds schema json files to the archive."""
+        client = get_upstream_client('dataset')
+        try:
             payload = {
                 'dataset_geid': dataset_geid,
                 'standard': 'default',
                 'is_draft': False,
             }
-            with httpx.Client() as client:
-                response = client.post(ConfigClass.DATASET_SERVICE + 'schema/list', json=payload)
+            response = client.post(ConfigClass.DATASET_SERVICE + 'schema/list', json=payload, retry=True)
             for schema in response.json()['result']:
-                with open(self.tmp_folder + '/default_' + schema['name'], 'w') as w:
-                    w.write(json.dumps(schema['content'], indent=4, ensure_ascii=False))
+                content = json.dumps(schema['content'], indent=4, ensure_ascii=False)
+                archive.add_bytes('default_' + schema['name'], content.encode('utf-8'))
 
             payload = {
                 'dataset_geid': dataset_geid,
                 'standard': 'open_minds',
                 'is_draft': False,
             }
-            with httpx.Client() as client:
-                response = client.post(ConfigClass.DATASET_SERVICE + 'schema/list', json=payload)
+            response = client.post(ConfigClass.DATASET_SERVICE + 'schema/list', json=payload, retry=True)
             for schema in response.json()['result']:
-                with open(self.tmp_folder + '/openMINDS_' + schema['name'], 'w') as w:
-                    w.write(json.dumps(schema['content'], indent=4, ensure_ascii=False))
+                content = json.dumps(schema['content'], indent=4, ensure_ascii=False)
+                archive.add_bytes('openMINDS_' + schema['name'], content.encode('utf-8'))
         except Exception as e:
             self.logger.error(f'Fail to create schemas: {str(e)}')
             raise
 
-    def download_files_to_tmp_folder(self, minio_client, file):
+    def check_stopped(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise JobStopped(f'Job {self.job_id} was stopped')
+
+    def download_files_to_tmp_folder(self, minio_client, file) -> Optional[int]:
+        """download one object to the tmp folder, return the bytes written or None if it was skipped."""
+        self.check_stopped()
         # minio location is minio://http://<end_point>/bucket/user/object_path
         bucket, file_path = self.parse_minio_location(file['location'])
+        local_path = self.tmp_folder + '/' + file_path
+        # ObjectFetcher already retries the whole object, ranges are not retried on their own
+        downloader = get_segmented_downloader(minio_client.client, self.logger, retries=0)
+        counter = self.progress.counter() if self.progress else None
         try:
-            minio_client.client.fget_object(bucket, file_path, self.tmp_folder + '/' + file_path)
+            return downloader.download(
+                bucket, file_path, local_path, size=file.get('file_size'), progress=counter.add if counter else None
+            )
         except minio.error.S3Error as e:
+            # the bytes of a failed attempt are counted again by the next one
+            if counter:
+                counter.rollback()
             # release_locks(locked)
             if e.code == 'NoSuchKey':
                 self.logger.info('File not found, skipping: ' + str(e))
+                return None
             else:
                 raise e
+        except Exception:
+            if counter:
+                counter.rollback()
+            raise
 
-    def zip_worker(self, hash_code):
-
-        locked_node = []
+    def stat_size(self, minio_client, obj) -> int:
+        """size of the object, kept in the entry so it is not stat'ed again by the download."""
+        bucket, file_path = self.parse_minio_location(obj['location'])
         try:
-            # add the file lock
-            locked_node, err = recursive_lock(self.project_code, self.files)
-            if err:
-                raise err
-            mc = Minio_Client_(self.auth_token['at'], self.auth_token['rt'])
-            # download all file to tmp folder
+            obj['file_size'] = int(minio_client.client.stat_object(bucket, file_path).size)
+        except minio.error.S3Error as e:
+            self.logger.info(f'Fail to stat {bucket}/{file_path}: {str(e)}')
+            return 0
+        return obj['file_size']
+
+    def total_bytes(self, minio_client) -> int:
+        """size of all files_to_zip, objects without a known size are stat'ed concurrently."""
+        unknown = [obj for obj in self.files_to_zip if obj.get('file_size') is None]
+        total = sum(int(obj['file_size']) for obj in self.files_to_zip if obj.get('file_size') is not None)
+        if not unknown:
+            return total
+        workers = max(min(ConfigClass.DOWNLOAD_FETCH_WORKERS, len(unknown)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return total + sum(executor.map(lambda obj: self.stat_size(minio_client, obj), unknown))
+
+    def report_progress(self, hash_code: str, snapshot: Dict[str, Any]):
+        payload = {'hash_code': hash_code, **snapshot}
+        self.set_status(EDataDownloadStatus.ZIPPING.name, payload=payload, progress=snapshot['percent'])
+
+    def fetch_files_to_tmp_folder(self, minio_client):
+        """download all files_to_zip concurrently, bounded by worker count and in-flight bytes."""
+        fetcher = ObjectFetcher(
+            lambda obj: self.download_files_to_tmp_folder(minio_client, obj),
+            workers=ConfigClass.DOWNLOAD_FETCH_WORKERS,
+            byte_budget=ConfigClass.DOWNLOAD_FETCH_BYTE_BUDGET,
+            retries=ConfigClass.DOWNLOAD_FETCH_RETRIES,
+            retry_backoff=ConfigClass.DOWNLOAD_FETCH_RETRY_BACKOFF,
+            logger=self.logger,
+        )
+        stats = fetcher.run(self.files_to_zip)
+        self.logger.info(
+            f'Job {self.job_id} fetched {stats.files} files ({stats.bytes} bytes, {stats.skipped} skipped, '
+            f'{stats.retries} retries) in {stats.elapsed:.2f}s, {stats.throughput / 1024 ** 2:.2f} MiB/s'
+        )
+        return stats
+
+    def build_archive(self, minio_client, policy: Optional[CompressionPolicy] = None):
+        """stream all files_to_zip from minio into the result archive without staging them."""
+
+        def objects():
             for obj in self.files_to_zip:
-                self.download_files_to_tmp_folder(mc, obj)
+                self.check_stopped()
+                bucket, file_path = self.parse_minio_location(obj['location'])
+                yield file_path, bucket, file_path
 
+        with ArchiveBuilder(
+            self.tmp_folder + '.' + self.archive_format,
+            minio_client,
+            workers=ConfigClass.DOWNLOAD_FETCH_WORKERS,
+            read_ahead=ConfigClass.ARCHIVE_READ_AHEAD_CHUNKS,
+            chunk_size=ConfigClass.ZIP_STREAM_CHUNK_SIZE,
+            retries=ConfigClass.DOWNLOAD_FETCH_RETRIES,
+            retry_backoff=ConfigClass.DOWNLOAD_FETCH_RETRY_BACKOFF,
+            compression_workers=ConfigClass.ZIP_COMPRESSION_WORKERS,
+            policy=policy,
+            archive_format=self.archive_format,
+            tar_options={
+                'compresslevel': ConfigClass.TAR_GZ_LEVEL,
+                'zstd_level': ConfigClass.ZSTD_LEVEL,
+                'zstd_threads': ConfigClass.ZSTD_THREADS,
+            },
+            checksums=ConfigClass.ARCHIVE_CHECKSUMS,
+            byte_budget=ConfigClass.DOWNLOAD_FETCH_BYTE_BUDGET,
+            progress=self.progress.add if self.progress else None,
+            logger=self.logger,
+        ) as archive:
+            stats = archive.add_objects(objects())
             if self.download_type == 'full_dataset':
-                self.add_schemas(self.geid)
+                self.add_schemas(self.geid, archive)
+        self.archive_sha256 = archive.sha256
+
+        self.logger.info(
+            f'Job {self.job_id} archived {stats.files} files ({stats.bytes} bytes, {stats.skipped} skipped, '
+            f'{stats.retries} retries) in {stats.elapsed:.2f}s, {stats.throughput / 1024 ** 2:.2f} MiB/s'
+        )
+        return stats
+
+    def zip_worker(self, hash_code, stop_event: Optional[threading.Event] = None):
+        """build the result of the job and set its status. A job stopped by stop_event sets no status."""
 
+        lease = LockLease(self.job_id, ConfigClass.LOCK_LEASE_TTL, ConfigClass.LOCK_HEARTBEAT_INTERVAL)
+        locks = LockManager(
+            self.project_code, self.lock_nodes, ConfigClass.LOCK_CONCURRENCY, lease, ConfigClass.LOCK_HIERARCHICAL
+        )
+        self.stop_event = stop_event
+        try:
+            # add the file lock, the lease frees them if this process dies before the finally
+            lease.start()
+            locks.acquire()
+            mc = Minio_Client_(self.auth_token['at'], self.auth_token['rt'])
+            self.progress = ProgressTracker(
+                self.total_bytes(mc),
+                lambda snapshot: self.report_progress(hash_code, snapshot),
+                ConfigClass.PROGRESS_UPDATE_INTERVAL,
+                self.logger,
+            )
+            payload = {'hash_code': hash_code}
             if len(self.files_to_zip) > 1 or self.contains_folder:
-                shutil.make_archive(self.tmp_folder, 'zip', self.tmp_folder)
+                if self.archive_format == 'zip':
+                    policy = get_compression_policy()
+                    self.build_archive(mc, policy)
+                    payload['compression'] = policy.stats.to_dict()
+                else:
+                    self.build_archive(mc)
+                if self.archive_sha256:
+                    payload['sha256'] = self.archive_sha256
+            else:
+                # single file is downloaded as it is
+                self.fetch_files_to_tmp_folder(mc)
 
             if self.download_type == 'dataset_files':
                 # Dataset file download
@@ -232,14 +449,17 @@ class DownloadClient:
                     filenames,
                     'DATASET_FILEDOWNLOAD_SUCCEED',
                 )
-            self.set_status(EDataDownloadStatus.READY_FOR_DOWNLOADING.name, payload={'hash_code': hash_code})
+            self.check_stopped()
+            self.set_status(EDataDownloadStatus.READY_FOR_DOWNLOADING.name, payload=payload, progress=100)
+        except JobStopped as e:
+            self.logger.warning(str(e))
         except Exception as e:
             payload = {'error_msg': str(e)}
             self.set_status(EDataDownloadStatus.CANCELLED.name, payload=payload)
         finally:
             self.logger.info('Start to unlock the nodes')
-            for resource_key, operation in locked_node:
-                unlock_resource(resource_key, operation)
+            locks.release()
+            lease.stop()
 
     def update_activity_log(self, dataset_geid, source_entry, event_type):
         url = ConfigClass.QUEUE_SERVICE + 'broker/pub'
@@ -257,8 +477,7 @@ class DownloadClient:
             'routing_key': '',
             'exchange': {'name': 'DATASET_ACTS', 'type': 'fanout'},
         }
-        with httpx.Client() as client:
-            res = client.post(url, json=post_json)
+        res = get_upstream_client('queue').post(url, json=post_json)
         if res.status_code != 200:
             error_msg = 'update_activity_log {}: {}'.format(res.status_code, res.text)
             self.logger.error(error_msg)
@@ -0,0 +1,195 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict
+from typing import Optional
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.download_manager import DownloadClient
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.config import ConfigClass
+from app.models.models_data_download import EDataDownloadStatus
+
+_logger = SrvLoggerFactory('job_queue').get_logger()
+
+# job ids scored by the time they are due, now for a queued job and the lease end for a claimed one
+QUEUE_KEY = 'download_job:queue'
+
+
+def job_key(job_id: str) -> str:
+    return f'download_job:{job_id}'
+
+
+def owner_key(job_id: str) -> str:
+    return f'download_job:{job_id}:owner'
+
+
+def enqueue_download_job(client: DownloadClient, hash_code: str) -> str:
+    """queue the zip_worker of the client for the job workers, return the id of the queued job."""
+    job_id = f'{client.job_id}-{uuid.uuid4().hex[:8]}'
+    record = {'spec': client.to_job_spec(), 'hash_code': hash_code, 'attempts': 0, 'queued_at': time.time()}
+    redis = SrvRedisSingleton()
+    # the record holds the tokens of the user, it is not logged like set_by_key would and it expires
+    redis.set_with_expire(job_key(job_id), json.dumps(record), ConfigClass.JOB_MAX_AGE)
+    redis.add_to_sorted_set(QUEUE_KEY, {job_id: time.time()})
+    _logger.info(f'Queued job {job_id} of {client.project_code}')
+    return job_id
+
+
+class JobWorker:
+    """Run the queued zip jobs, concurrency of them at a time.
+
+    A job is claimed by moving its score ttl seconds ahead, and the heartbeat moves it again every interval
+    seconds while the job runs. When the worker dies the score is not moved anymore, the job becomes due again
+    and the next worker polling the queue takes it over from the start. A job claimed more than max_attempts
+    times is cancelled instead of run again, so a job killing its workers does not go round forever. The
+    record of a job expires max_age seconds after it was queued. A worker finding that its job was taken over
+    stops it before the next file, and leaves the status and the completion of the job to the new owner.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 2,
+        ttl: int = 60,
+        interval: int = 20,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        max_age: int = 86400,
+    ):
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.concurrency = max(concurrency, 1)
+        self.ttl = ttl
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+        # stop event of each running job
+        self._running: Dict[str, threading.Event] = {}
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        self._redis = SrvRedisSingleton()
+
+    def claim(self) -> Optional[str]:
+        now = time.time()
+        job_id = self._redis.claim_from_sorted_set(QUEUE_KEY, now, now + self.ttl)
+        if job_id is None:
+            return None
+        self._redis.set_with_expire(owner_key(job_id), self.worker_id, self.ttl)
+        with self._running_lock:
+            self._running[job_id] = threading.Event()
+        return job_id
+
+    def renew(self):
+        with self._running_lock:
+            running = list(self._running.items())
+        for job_id, stop_event in running:
+            try:
+                owner = self._redis.get_by_key(owner_key(job_id))
+                if owner is not None and owner.decode() != self.worker_id:
+                    _logger.warning(f'Job {job_id} was taken over by {owner.decode()}, stopping it')
+                    stop_event.set()
+                    continue
+                self._redis.add_to_sorted_set(QUEUE_KEY, {job_id: time.time() + self.ttl}, only_existing=True)
+                self._redis.set_with_expire(owner_key(job_id), self.worker_id, self.ttl)
+            except Exception as e:
+                _logger.error(f'Fail to renew job {job_id}: {str(e)}')
+
+    def complete(self, job_id: str):
+        self._redis.remove_from_sorted_set(QUEUE_KEY, job_id)
+        self._redis.delete_by_keys([job_key(job_id), owner_key(job_id)])
+
+    def process(self, job_id: str):
+        """run a claimed job. When redis fails the job is left to expire and run again."""
+        with self._running_lock:
+            stop_event = self._running.get(job_id, threading.Event())
+        try:
+            record = self._redis.get_by_key(job_key(job_id))
+            if record is None:
+                # completed by the worker it was taken over from, or expired
+                self._redis.remove_from_sorted_set(QUEUE_KEY, job_id)
+                return
+            record = json.loads(record)
+            record['attempts'] += 1
+            # the record keeps the expiry it was queued with
+            age = time.time() - record.get('queued_at', time.time())
+            self._redis.set_with_expire(job_key(job_id), json.dumps(record), max(int(self.max_age - age), 1))
+            client = DownloadClient.from_job_spec(record['spec'])
+            if record['attempts'] > self.max_attempts:
+                error_msg = f'Job {job_id} was given up after {self.max_attempts} attempts'
+                _logger.error(error_msg)
+                client.set_status(EDataDownloadStatus.CANCELLED.name, payload={'error_msg': error_msg})
+            else:
+                _logger.info(f'Worker {self.worker_id} runs job {job_id}, attempt {record["attempts"]}')
+                # zip_worker sets the CANCELLED status itself when the job fails
+                client.zip_worker(record['hash_code'], stop_event=stop_event)
+            if stop_event.is_set():
+                _logger.warning(f'Job {job_id} was stopped, it is left to the worker that took it over')
+                return
+            self.complete(job_id)
+        except Exception as e:
+            _logger.error(f'Fail to run job {job_id}: {str(e)}')
+        finally:
+            with self._running_lock:
+                self._running.pop(job_id, None)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job_id = self.claim()
+            except Exception as e:
+                _logger.error(f'Fail to claim a job: {str(e)}')
+                job_id = None
+            if job_id is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.process(job_id)
+
+    def _beat(self):
+        while not self._done.wait(self.interval):
+            self.renew()
+
+    def run(self):
+        """run jobs until stop() is called, then wait for the running ones to finish."""
+        _logger.info(f'Worker {self.worker_id} started with {self.concurrency} slots')
+        self._stop.clear()
+        self._done.clear()
+        heartbeat = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        threads = [
+            threading.Thread(target=self._work, name=f'job-worker-{slot}', daemon=True)
+            for slot in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._done.set()
+        heartbeat.join()
+        _logger.info(f'Worker {self.worker_id} stopped')
+
+    def stop(self):
+        self._stop.set()
@@ -18,19 +18,40 @@
 # permissions and limitations under the Licence.
 # 
 
-import httpx
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures import wait
+from itertools import islice
+from typing import List
+from typing import Optional
+from typing import Tuple
 
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.service_connection.upstream import get_upstream_client
 from app.config import ConfigClass
 from app.resources.helpers import get_children_nodes
 from app.resources.helpers import get_resource_bygeid
 
+_logger = SrvLoggerFactory('locks').get_logger()
+
+# lock of the folders above a node locked in hierarchical mode
+INTENT_READ = 'intent_read'
+
+# ids of the leases with locks recorded
+LEASES_KEY = 'lock_lease:all'
+
 
 def lock_resource(resource_key: str, operation: str) -> dict:
     # operation can be either read or write
     url = ConfigClass.DATA_OPS_UT_V2 + 'resource/lock/'
     post_json = {'resource_key': resource_key, 'operation': operation}
-    with httpx.Client() as client:
-        response = client.post(url, json=post_json)
+    response = get_upstream_client('data_ops').post(url, json=post_json)
     if response.status_code != 200:
         raise Exception('resource %s already in used' % resource_key)
 
@@ -41,14 +62,54 @@ def unlock_resource(resource_key: str, operation: str) -> dict:
     # operation can be either read or write
     url = ConfigClass.DATA_OPS_UT_V2 + 'resource/lock/'
     post_json = {'resource_key': resource_key, 'operation': operation}
-    with httpx.Client() as client:
-        response = client.request(url=url, method='DELETE', json=post_json)
+    # read locks are counted, a retried release could drop the lock of another job
+    response = get_upstream_client('data_ops').request('DELETE', url, json=post_json, retry=False)
     if response.status_code != 200:
         raise Exception('Error when unlock resource %s' % resource_key)
 
     return response.json()
 
 
+def lock_key(code: str, ff_object: dict) -> Optional[str]:
+    """the read lock key of the node, None for the name folder which is never locked."""
+    # conner case here, we DONT lock the name folder
+    # for the copy we will lock the both source and target
+    if ff_object.get('display_path') == ff_object.get('uploader'):
+        return None
+    bucket_prefix = ''
+    if ConfigClass.GREEN_ZONE_LABEL in ff_object.get('labels'):
+        bucket_prefix = 'gr-'
+    elif ConfigClass.CORE_ZONE_LABEL in ff_object.get('labels'):
+        bucket_prefix = 'core-'
+    return '{}/{}'.format(bucket_prefix + code, ff_object.get('display_path'))
+
+
+def subtree_lock_key(code: str, ff_object: dict) -> Optional[str]:
+    """the lock key of a file, or of the prefix of everything below a folder."""
+    key = lock_key(code, ff_object)
+    if key and 'Folder' in ff_object.get('labels'):
+        key += '/'
+    return key
+
+
+def intent_lock_keys(code: str, ff_object: dict) -> List[str]:
+    """prefix keys of the folders above the node, the name folder excluded."""
+    folders = (ff_object.get('display_path') or '').split('/')[:-1]
+    # the zone labels pick the bucket of the ancestors too
+    labels = [label for label in ff_object.get('labels') if label != 'File'] + ['Folder']
+    keys = []
+    for depth in range(1, len(folders) + 1):
+        ancestor = {**ff_object, 'labels': labels, 'display_path': '/'.join(folders[:depth])}
+        key = subtree_lock_key(code, ancestor)
+        if key:
+            keys.append(key)
+    return keys
+
+
+def _unique(keys, operation: str) -> List[Tuple[str, str]]:
+    return [(key, operation) for key in dict.fromkeys(keys) if key]
+
+
 def recursive_lock(code: str, ff_geids: list, new_name: str = None) -> (list, Exception):
     """the function will recursively lock the node tree."""
 
@@ -64,28 +125,8 @@ def recursive_lock(code: str, ff_geids: list, new_name: str = None) -> (list, Ex
             # we will skip the deleted nodes
             if ff_object.get('archived', False):
                 continue
-            # conner case here, we DONT lock the name folder
-            # for the copy we will lock the both source and target
-            if ff_object.get('display_path') != ff_object.get('uploader'):
-                bucket_prefix = ''
-                if ConfigClass.GREEN_ZONE_LABEL in ff_object.get('labels'):
-                    bucket_prefix = 'gr-'
-                elif ConfigClass.CORE_ZONE_LABEL in ff_object.get('labels'):
-                    bucket_prefix = 'core-'
-                bucket = bucket_prefix + code
-                minio_obj_path = ff_object.get('display_path')
-                # note here the dataset and project are using same class
-                # two file have different attribte so here I just use `location``
-                # if not minio_obj_path:
-                #     if "File" in ff_object.get('labels'):
-                #         minio_path = ff_object.get('location').split("//")[-1]
-                #         _, bucket, minio_obj_path = tuple(minio_path.split("/", 2))
-                #     else:
-                #         bucket = ff_object.get('dataset_code')
-                #         minio_obj_path = "%s/%s"%(ff_object.get('folder_relative_path'),
-                #             ff_object.get('name'))
-
-                source_key = '{}/{}'.format(bucket, minio_obj_path)
+            source_key = lock_key(code, ff_object)
+            if source_key:
                 lock_resource(source_key, 'read')
                 locked_node.append((source_key, 'read'))
 
@@ -107,3 +148,232 @@ def recursive_lock(code: str, ff_geids: list, new_name: str = None) -> (list, Ex
         err = e
 
     return locked_node, err
+
+
+class LockLease:
+    """Record of the locks a job holds, kept alive by a heartbeat thread while the job runs.
+
+    The heartbeat key expires ttl seconds after the last renewal. Once it is gone, because the process running
+    the job died, sweep_expired_leases releases the locks still recorded. Every lock is recorded right after it
+    is taken and forgotten right after it is released, so the sweeper never releases a lock twice.
+    """
+
+    def __init__(self, job_id: str, ttl: int = 30, interval: int = 10):
+        self.lease_id = f'{job_id}-{uuid.uuid4().hex[:8]}'
+        self.ttl = ttl
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._redis = SrvRedisSingleton()
+
+    @property
+    def heartbeat_key(self) -> str:
+        return f'lock_lease:{self.lease_id}'
+
+    @property
+    def locks_key(self) -> str:
+        return f'lock_lease:{self.lease_id}:locks'
+
+    def renew(self):
+        try:
+            self._redis.set_with_expire(self.heartbeat_key, str(time.time()), self.ttl)
+        except Exception as e:
+            _logger.error(f'Fail to renew lock lease {self.lease_id}: {str(e)}')
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            self.renew()
+
+    def start(self):
+        """register the lease and start the heartbeat, before any lock is taken."""
+        self._redis.set_with_expire(self.heartbeat_key, str(time.time()), self.ttl)
+        self._redis.add_to_set(LEASES_KEY, self.lease_id)
+        self._thread = threading.Thread(target=self._beat, name=f'lease-{self.lease_id}', daemon=True)
+        self._thread.start()
+
+    def add(self, key: str, operation: str):
+        try:
+            self._redis.add_to_set(self.locks_key, json.dumps([key, operation]))
+        except Exception as e:
+            _logger.error(f'Fail to record lock {key} in lease {self.lease_id}: {str(e)}')
+
+    def remove(self, key: str, operation: str):
+        try:
+            self._redis.remove_from_set(self.locks_key, json.dumps([key, operation]))
+        except Exception as e:
+            _logger.error(f'Fail to forget lock {key} in lease {self.lease_id}: {str(e)}')
+
+    def stop(self):
+        """stop the heartbeat, locks that could not be released are left to the sweeper."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self._redis.delete_by_key(self.heartbeat_key)
+            if not self._redis.get_set_members(self.locks_key):
+                self._redis.remove_from_set(LEASES_KEY, self.lease_id)
+        except Exception as e:
+            _logger.error(f'Fail to close lock lease {self.lease_id}: {str(e)}')
+
+
+def sweep_expired_leases(ttl: int = 30) -> int:
+    """release the locks of the leases whose heartbeat expired, return the number of locks released.
+
+    A lease is claimed for ttl seconds before it is swept, so concurrent sweepers of other workers skip it.
+    The locks are forgotten whether their release succeeds or not, a lock data ops does not know anymore must
+    not be retried forever.
+    """
+    redis = SrvRedisSingleton()
+    released = 0
+    for lease_id in redis.get_set_members(LEASES_KEY):
+        lease_id = lease_id.decode() if isinstance(lease_id, bytes) else lease_id
+        if redis.check_by_key(f'lock_lease:{lease_id}'):
+            continue
+        if not redis.set_with_expire(f'lock_lease:{lease_id}:sweep', str(time.time()), ttl, only_if_absent=True):
+            continue
+        locks_key = f'lock_lease:{lease_id}:locks'
+        for member in redis.get_set_members(locks_key):
+            key, operation = json.loads(member)
+            try:
+                unlock_resource(key, operation)
+                released += 1
+            except Exception as e:
+                _logger.error(f'Fail to release {key} of expired lease {lease_id}: {str(e)}')
+            redis.remove_from_set(locks_key, member)
+        redis.delete_by_keys([locks_key, f'lock_lease:{lease_id}:sweep'])
+        redis.remove_from_set(LEASES_KEY, lease_id)
+        _logger.info(f'Swept expired lock lease {lease_id}')
+    return released
+
+
+class LeaseSweeper:
+    """Thread running sweep_expired_leases every interval seconds."""
+
+    def __init__(self, interval: int = 15, ttl: int = 30):
+        self.interval = interval
+        self.ttl = ttl
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                sweep_expired_leases(self.ttl)
+            except Exception as e:
+                _logger.error(f'Fail to sweep lock leases: {str(e)}')
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='lease-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_sweeper = None
+
+
+def start_lease_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = LeaseSweeper(ConfigClass.LOCK_SWEEP_INTERVAL, ConfigClass.LOCK_LEASE_TTL)
+        _sweeper.start()
+
+
+def stop_lease_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.stop()
+        _sweeper = None
+
+
+class LockManager:
+    """Read locks of an already listed node tree, taken and released `concurrency` at a time.
+
+    The nodes are the snapshot DownloadClient built, so the tree is not walked again. When a lock fails the
+    locks still pending are not requested and only the ones taken are released again. With a lease every lock
+    is recorded in it while it is held.
+
+    In hierarchical mode the nodes are only the selected ones. A folder is locked once on its prefix
+    (bucket/display_path/), which covers its whole subtree, and the folders above every selected node get an
+    intent_read lock, taken before the others. This needs a data ops that checks prefix and intent locks.
+    """
+
+    def __init__(
+        self,
+        code: str,
+        nodes: List[dict],
+        concurrency: int = 16,
+        lease: Optional[LockLease] = None,
+        hierarchical: bool = False,
+    ):
+        nodes = [node for node in nodes if not node.get('archived', False)]
+        if hierarchical:
+            intents = (key for node in nodes for key in intent_lock_keys(code, node))
+            keys = (subtree_lock_key(code, node) for node in nodes)
+            self.phases = [_unique(intents, INTENT_READ), _unique(keys, 'read')]
+        else:
+            self.phases = [_unique((lock_key(code, node) for node in nodes), 'read')]
+        self.concurrency = max(concurrency, 1)
+        self.lease = lease
+        self.locked: List[Tuple[str, str]] = []
+
+    @property
+    def keys(self) -> List[Tuple[str, str]]:
+        return [lock for phase in self.phases for lock in phase]
+
+    def _lock(self, key: str, operation: str):
+        lock_resource(key, operation)
+        if self.lease is not None:
+            self.lease.add(key, operation)
+
+    def _unlock(self, key: str, operation: str):
+        unlock_resource(key, operation)
+        if self.lease is not None:
+            self.lease.remove(key, operation)
+
+    def acquire(self):
+        """lock every key, raise the first error after releasing the locks taken."""
+        for phase in self.phases:
+            error = self._acquire(phase)
+            if error is not None:
+                self.release()
+                raise error
+
+    def _acquire(self, phase: List[Tuple[str, str]]) -> Optional[Exception]:
+        error = None
+        locks = iter(phase)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # at most `concurrency` requests in flight, none is sent after a failure
+            pending = {executor.submit(self._lock, *lock): lock for lock in islice(locks, self.concurrency)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    lock = pending.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    self.locked.append(lock)
+                    next_lock = next(locks, None) if error is None else None
+                    if next_lock is not None:
+                        pending[executor.submit(self._lock, *next_lock)] = next_lock
+        return error
+
+    def release(self):
+        """unlock the keys locked, failures are logged so every lock gets its release attempt."""
+        locked, self.locked = self.locked, []
+        if not locked:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(locked))) as executor:
+            futures = {executor.submit(self._unlock, key, operation): key for key, operation in locked}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    _logger.error(f'Fail to unlock {futures[future]}: {str(e)}')
@@ -0,0 +1,210 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from redis.exceptions import RedisError
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.config import ConfigClass
+
+_logger = SrvLoggerFactory('metadata_cache').get_logger()
+
+_CACHE_PREFIX = 'neo4j_cache'
+
+# what is cached per geid: the node list of GET nodes/geid/{geid}, the v1 `own`
+# children of a folder and the v2 relations/query listing of a folder
+NODE = 'node'
+CHILDREN = 'children'
+FOLDER = 'folder'
+KINDS = (NODE, CHILDREN, FOLDER)
+
+
+class CacheStats:
+    """Hit and miss counters of one process."""
+
+    def __init__(self):
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, amount: int = 1):
+        if amount:
+            with self._lock:
+                setattr(self, name, getattr(self, name) + amount)
+
+    def to_dict(self) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_ratio': round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0,
+        }
+
+
+class MetadataCache:
+    """Cache of neo4j lookups keyed by kind and geid.
+
+    An in-process LRU of local_size entries answers repeated lookups without any round trip, behind it redis
+    shares the entries between the workers for ttl seconds. Local entries live local_ttl seconds, so an
+    invalidation in one process reaches the others within local_ttl. Redis errors are logged and count as
+    misses, the lookups never fail because of the cache.
+    """
+
+    def __init__(self, ttl: int = 300, local_ttl: int = 30, local_size: int = 4096, enabled: bool = True):
+        self.ttl = ttl
+        self.local_ttl = min(local_ttl, ttl)
+        self.local_size = max(local_size, 0)
+        self.enabled = enabled
+        self.stats = CacheStats()
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(kind: str, geid: str) -> str:
+        return f'{_CACHE_PREFIX}:{kind}:{geid}'
+
+    def _get_local(self, key: str):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return entry[1]
+
+    def _set_local(self, key: str, value):
+        if not self.local_size:
+            return
+        evicted = 0
+        with self._lock:
+            self._local[key] = (time.time() + self.local_ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+                evicted += 1
+        self.stats.add('evictions', evicted)
+
+    def get_many(self, kind: str, geids: Iterable[str]) -> Dict[str, Any]:
+        """cached values of the geids, the ones not cached are left out."""
+        if not self.enabled:
+            return {}
+        found = {}
+        remote = []
+        for geid in dict.fromkeys(geids):
+            value = self._get_local(self._key(kind, geid))
+            if value is None:
+                remote.append(geid)
+            else:
+                found[geid] = value
+        self.stats.add('local_hits', len(found))
+
+        if remote:
+            keys = [self._key(kind, geid) for geid in remote]
+            try:
+                cached = SrvRedisSingleton().mget_by_keys(keys)
+            except RedisError as e:
+                _logger.warning(f'Metadata cache read failed: {str(e)}')
+                cached = [None] * len(keys)
+            hits = 0
+            for geid, key, raw in zip(remote, keys, cached):
+                if raw is None:
+                    continue
+                value = json.loads(raw)
+                self._set_local(key, value)
+                found[geid] = value
+                hits += 1
+            self.stats.add('redis_hits', hits)
+            self.stats.add('misses', len(remote) - hits)
+        return found
+
+    def get(self, kind: str, geid: str):
+        return self.get_many(kind, [geid]).get(geid)
+
+    def set_many(self, kind: str, values: Dict[str, Any]):
+        if not self.enabled or not values:
+            return
+        mapping = {}
+        for geid, value in values.items():
+            key = self._key(kind, geid)
+            self._set_local(key, value)
+            mapping[key] = json.dumps(value)
+        try:
+            SrvRedisSingleton().mset_with_expire(mapping, self.ttl)
+        except RedisError as e:
+            _logger.warning(f'Metadata cache write failed: {str(e)}')
+
+    def set(self, kind: str, geid: str, value):
+        self.set_many(kind, {geid: value})
+
+    def invalidate(self, geids: Iterable[str]) -> List[str]:
+        """drop everything cached for the geids, call it when their nodes or folder contents change."""
+        geids = list(dict.fromkeys(geids))
+        keys = [self._key(kind, geid) for geid in geids for kind in KINDS]
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        try:
+            SrvRedisSingleton().delete_by_keys(keys)
+        except RedisError as e:
+            _logger.warning(f'Metadata cache invalidation failed: {str(e)}')
+        self.stats.add('invalidations', len(geids))
+        return geids
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+
+_metadata_cache: Optional[MetadataCache] = None
+
+
+def get_metadata_cache() -> MetadataCache:
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = MetadataCache(
+            ttl=ConfigClass.METADATA_CACHE_TTL,
+            local_ttl=ConfigClass.METADATA_CACHE_LOCAL_TTL,
+            local_size=ConfigClass.METADATA_CACHE_LOCAL_SIZE,
+            enabled=ConfigClass.METADATA_CACHE_ENABLED,
+        )
+    return _metadata_cache
+
+
+def reset_metadata_cache():
+    """forget the process cache, the next get_metadata_cache reads the config again."""
+    global _metadata_cache
+    _metadata_cache = None
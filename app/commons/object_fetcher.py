@@ -0,0 +1,162 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+import minio
+
+# s3 error codes worth another attempt, everything else
+# (NoSuchKey, AccessDenied, ...) will fail the same way again
+RETRYABLE_S3_CODES = {'InternalError', 'ServiceUnavailable', 'SlowDown', 'RequestTimeout'}
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, minio.error.S3Error):
+        return error.code in RETRYABLE_S3_CODES
+    return True
+
+
+class ByteBudget:
+    """Counting semaphore measured in bytes, bounds the amount of data in flight."""
+
+    def __init__(self, limit: int):
+        self.limit = max(limit, 1)
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount: int) -> int:
+        """block until amount bytes are available, objects bigger than the budget run alone."""
+        amount = min(max(amount, 1), self.limit)
+        with self._condition:
+            while self.in_use + amount > self.limit:
+                self._condition.wait()
+            self.in_use += amount
+        return amount
+
+    def release(self, amount: int):
+        with self._condition:
+            self.in_use -= amount
+            self._condition.notify_all()
+
+
+class FetchStats:
+    """Aggregated result of one fetch job."""
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.retries = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, fetched: Optional[int]):
+        with self._lock:
+            if fetched is None:
+                self.skipped += 1
+            else:
+                self.files += 1
+                self.bytes += fetched
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    @property
+    def throughput(self) -> float:
+        """bytes per second."""
+        return self.bytes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'files': self.files,
+            'skipped': self.skipped,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'elapsed': round(self.elapsed, 3),
+            'throughput': round(self.throughput),
+        }
+
+
+class ObjectFetcher:
+    """Run a per-object fetch function over many objects with bounded concurrency.
+
+    fetch(obj) returns the number of bytes transferred, or None when the object was skipped. The first error that
+    survives its retries cancels the objects which have not started yet and is raised from run().
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Dict[str, Any]], Optional[int]],
+        workers: int,
+        byte_budget: int,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+        logger=None,
+    ):
+        self.fetch = fetch
+        self.workers = max(workers, 1)
+        self.budget = ByteBudget(byte_budget)
+        self.retries = max(retries, 0)
+        self.retry_backoff = retry_backoff
+        self.logger = logger
+
+    def _fetch_one(self, obj: Dict[str, Any], stats: FetchStats):
+        reserved = self.budget.acquire(obj.get('file_size') or 0)
+        try:
+            attempt = 0
+            while True:
+                try:
+                    fetched = self.fetch(obj)
+                    break
+                except Exception as e:
+                    if attempt >= self.retries or not is_retryable(e):
+                        raise
+                    attempt += 1
+                    stats.add_retry()
+                    if self.logger:
+                        self.logger.warning(f'Retry {attempt}/{self.retries} for {obj.get("location")}: {e}')
+                    time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+        finally:
+            self.budget.release(reserved)
+        stats.add(fetched)
+
+    def run(self, objects: Iterable[Dict[str, Any]]) -> FetchStats:
+        stats = FetchStats()
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._fetch_one, obj, stats) for obj in objects]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        stats.elapsed = time.time() - start
+        return stats
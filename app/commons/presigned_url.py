@@ -0,0 +1,172 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import hashlib
+import json
+import time
+from datetime import datetime
+from datetime import timedelta
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import jwt
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.config import ConfigClass
+
+_CACHE_PREFIX = 'presigned_url'
+
+
+def split_object_path(object_path: str) -> Tuple[str, str]:
+    """split `<bucket>/<object name>`, a minio location is accepted as well."""
+    if '://' in object_path:
+        # minio location is minio://http://<end_point>/bucket/user/object_path
+        object_path = object_path.split('//')[-1].split('/', 1)[-1]
+    bucket, _, object_name = object_path.lstrip('/').partition('/')
+    if not bucket or not object_name:
+        raise ValueError(f'Invalid object path {object_path}')
+    return bucket, object_name
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def _token_claims(token: str) -> dict:
+    """claims of the user's token, not verified here."""
+    try:
+        return jwt.decode(token.replace('Bearer ', ''), verify=False)
+    except jwt.InvalidTokenError:
+        return {}
+
+
+class PresignedUrlIssuer:
+    """Issue presigned GET urls for one user, cached in redis.
+
+    The urls are signed with the user's own minio credentials so minio still enforces their policy when the url
+    is used, and a url stops working when those sts credentials expire, so `expires_at` is capped at their
+    expiry. Cache entries are keyed by the user and the object path, and expire `margin` seconds before the url
+    does so a cached url is never handed out close to its expiry.
+
+    The token's claims are not verified by this service, so a token is only mapped to its user once the user's
+    minio client was created with it, which exchanges the token at keycloak. After that the minio client is only
+    created when something is not cached, also for the user's refreshed tokens.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        client_factory: Callable,
+        expire: int = 3600,
+        margin: int = 300,
+    ):
+        self.token = token
+        self.client_factory = client_factory
+        self.expire = expire
+        self.margin = min(margin, expire)
+        self.redis = SrvRedisSingleton()
+        self._client = None
+        self._identity = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    @property
+    def identity(self) -> str:
+        """the user the token belongs to, the subject of the token."""
+        if self._identity is None:
+            token_key = f'{_CACHE_PREFIX}:token:{_digest(self.token)}'
+            identity = self.redis.mget_by_keys([token_key])[0]
+            if identity:
+                self._identity = identity.decode('utf-8') if isinstance(identity, bytes) else identity
+            else:
+                claims = _token_claims(self.token)
+                identity = claims.get('sub') or _digest(self.token)
+                # creating the user's minio client exchanges the token at keycloak, it is trusted after that
+                _ = self.client
+                ttl = int(claims['exp'] - time.time()) if claims.get('exp') else self.expire
+                if ttl > 0:
+                    self.redis.mset_with_expire({token_key: identity}, ttl)
+                self._identity = identity
+        return self._identity
+
+    def cache_key(self, object_path: str) -> str:
+        digest = _digest(self.identity + '\n' + object_path)
+        return f'{_CACHE_PREFIX}:{digest}'
+
+    def _presign(self, object_path: str) -> dict:
+        bucket, object_name = split_object_path(object_path)
+        url = self.client.client.presigned_get_object(bucket, object_name, expires=timedelta(seconds=self.expire))
+        expires_in = self.expire
+        credentials_expiration = self.client.credentials_expiration()
+        if credentials_expiration is not None:
+            expires_in = min(expires_in, int((credentials_expiration - datetime.utcnow()).total_seconds()))
+        expires_at = int(time.time()) + expires_in
+        return {'object_path': object_path, 'url': url, 'expires_at': expires_at}
+
+    def stat(self, object_path: str):
+        """check the user can read the object, raises minio's S3Error otherwise."""
+        bucket, object_name = split_object_path(object_path)
+        return self.client.client.stat_object(bucket, object_name)
+
+    def get_urls(self, object_paths: List[str], check: bool = False) -> Dict[str, dict]:
+        """return {object_path: {'object_path', 'url', 'expires_at'}}, presigning only what is not cached.
+
+        With check the objects that are not cached are stat'ed first, so missing objects and denied access are
+        reported now instead of when the url is used.
+        """
+        object_paths = list(dict.fromkeys(object_paths))
+        keys = [self.cache_key(path) for path in object_paths]
+        urls = {}
+        missing = {}
+        for path, key, cached in zip(object_paths, keys, self.redis.mget_by_keys(keys)):
+            if cached:
+                urls[path] = json.loads(cached)
+            else:
+                missing[key] = path
+
+        if missing:
+            fresh = {}
+            for key, path in missing.items():
+                if check:
+                    self.stat(path)
+                urls[path] = self._presign(path)
+                fresh[key] = json.dumps(urls[path])
+            ttl = min(urls[path]['expires_at'] for path in missing.values()) - int(time.time()) - self.margin
+            if ttl > 0:
+                self.redis.mset_with_expire(fresh, ttl)
+        return {path: urls[path] for path in object_paths}
+
+    def get_url(self, object_path: str, check: bool = True) -> dict:
+        return self.get_urls([object_path], check=check)[object_path]
+
+
+def get_presigned_url_issuer(token: str, client_factory: Callable) -> PresignedUrlIssuer:
+    return PresignedUrlIssuer(
+        token,
+        client_factory,
+        expire=ConfigClass.PRESIGNED_URL_EXPIRE,
+        margin=ConfigClass.PRESIGNED_URL_CACHE_MARGIN,
+    )
@@ -0,0 +1,95 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+
+class ProgressTracker:
+    """Bytes of a job done against its total, reported at most once every interval seconds.
+
+    add() is called from the reader and writer threads with every chunk. report receives the snapshot from the
+    thread whose chunk crossed the interval, the throughput is averaged since the start of the job and the eta
+    is the time left at that throughput, None until something was transferred.
+    """
+
+    def __init__(self, total: int, report: Callable[[Dict[str, Any]], None], interval: float = 0.5, logger=None):
+        self.total = max(total, 0)
+        self.done = 0
+        self.report = report
+        self.interval = interval
+        self.logger = logger
+        self.start = time.time()
+        self._last_report = self.start
+        self._lock = threading.Lock()
+
+    def add(self, amount: int):
+        now = time.time()
+        with self._lock:
+            self.done += amount
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            snapshot = self.snapshot(now)
+        try:
+            self.report(snapshot)
+        except Exception as e:
+            # a lost progress update must not fail the job
+            if self.logger:
+                self.logger.warning(f'Fail to report progress: {str(e)}')
+
+    def counter(self) -> 'ObjectProgress':
+        return ObjectProgress(self)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        elapsed = (now or time.time()) - self.start
+        done = min(max(self.done, 0), self.total) if self.total else max(self.done, 0)
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        eta = round((self.total - done) / throughput) if throughput > 0 and self.total else None
+        return {
+            'percent': round(100.0 * done / self.total, 1) if self.total else 0.0,
+            'bytes_done': done,
+            'bytes_total': self.total,
+            'throughput': round(throughput),
+            'eta': eta,
+        }
+
+
+class ObjectProgress:
+    """Bytes of one object, taken back from the job when the object is transferred again."""
+
+    def __init__(self, tracker: ProgressTracker):
+        self.tracker = tracker
+        self.done = 0
+        self._lock = threading.Lock()
+
+    def add(self, amount: int):
+        with self._lock:
+            self.done += amount
+        self.tracker.add(amount)
+
+    def rollback(self):
+        with self._lock:
+            amount, self.done = self.done, 0
+        if amount:
+            self.tracker.add(-amount)
@@ -0,0 +1,245 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from app.commons.object_fetcher import is_retryable
+from app.config import ConfigClass
+
+
+class ObjectChangedError(Exception):
+    """The object was replaced while its segments were being downloaded."""
+
+
+class DownloadCancelled(Exception):
+    """Another range of the same download failed."""
+
+
+def split_ranges(size: int, part_size: int) -> List[Tuple[int, int]]:
+    """(offset, length) pairs covering size bytes."""
+    part_size = max(part_size, 1)
+    return [(offset, min(part_size, size - offset)) for offset in range(0, size, part_size)]
+
+
+class SegmentedDownloader:
+    """Download one minio object over several connections.
+
+    Objects from `threshold` bytes up are split into byte ranges of part_size that are fetched concurrently and
+    written in place with os.pwrite into a file preallocated to the object size. Every range is requested with
+    If-Match on the object's ETag, and the ETag is compared again once all parts are in, so a file replaced
+    during the download fails instead of producing a mix of both versions. Smaller objects, or any object when
+    workers is 1, go through fget_object as before. The first range that fails for good stops the others: queued
+    ranges are cancelled and running ones give up at their next chunk.
+    """
+
+    def __init__(
+        self,
+        client,
+        part_size: int = 64 * 1024 * 1024,
+        workers: int = 8,
+        threshold: int = 256 * 1024 * 1024,
+        chunk_size: int = 1024 * 1024,
+        retries: int = 0,
+        retry_backoff: float = 0.5,
+        logger=None,
+    ):
+        self.client = client
+        self.part_size = max(part_size, 1)
+        self.workers = max(workers, 1)
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.retries = max(retries, 0)
+        self.retry_backoff = retry_backoff
+        self.logger = logger
+
+    def download(
+        self,
+        bucket: str,
+        object_name: str,
+        file_path: str,
+        size: Optional[int] = None,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> int:
+        """download the object to file_path and return its size.
+
+        size is the expected object size when it is already known, it only decides whether the object is worth
+        splitting so small objects cost no extra stat request. progress is called with the bytes of every chunk
+        written, negative for the bytes of a range that is fetched again, or once with the size of an object
+        downloaded whole.
+        """
+        progress = progress or _no_progress
+        if self.workers == 1 or (size is not None and size < self.threshold):
+            return self._download_whole(bucket, object_name, file_path, progress)
+
+        stat = self.client.stat_object(bucket, object_name)
+        if stat.size < self.threshold:
+            return self._download_whole(bucket, object_name, file_path, progress, stat.size)
+
+        folder = os.path.dirname(file_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        part_path = file_path + '.part'
+        start = time.time()
+        ranges = split_ranges(stat.size, self.part_size)
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            self._preallocate(fd, stat.size)
+            self._fetch_ranges(fd, bucket, object_name, stat.etag, ranges, progress)
+        except BaseException:
+            os.close(fd)
+            os.remove(part_path)
+            raise
+        os.close(fd)
+
+        if self.client.stat_object(bucket, object_name).etag != stat.etag:
+            os.remove(part_path)
+            raise ObjectChangedError(f'{bucket}/{object_name} changed during the download')
+        os.replace(part_path, file_path)
+        if self.logger:
+            elapsed = time.time() - start
+            self.logger.info(
+                f'Downloaded {bucket}/{object_name} ({stat.size} bytes) in {len(ranges)} parts in {elapsed:.2f}s'
+            )
+        return stat.size
+
+    def _download_whole(
+        self, bucket: str, object_name: str, file_path: str, progress: Callable[[int], None], size: Optional[int] = None
+    ) -> int:
+        self.client.fget_object(bucket, object_name, file_path)
+        if size is None:
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        progress(size)
+        return size
+
+    def _fetch_ranges(
+        self,
+        fd: int,
+        bucket: str,
+        object_name: str,
+        etag: str,
+        ranges: List[Tuple[int, int]],
+        progress: Callable[[int], None],
+    ):
+        """fetch the ranges into fd, the first failure cancels the ranges not started yet."""
+        cancelled = threading.Event()
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(ranges)), 1)) as executor:
+            futures = [
+                executor.submit(self._fetch_range, fd, bucket, object_name, etag, offset, length, cancelled, progress)
+                for offset, length in ranges
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                cancelled.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    @staticmethod
+    def _preallocate(fd: int, size: int):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # not every platform or file system (nfs) supports fallocate
+            os.ftruncate(fd, size)
+
+    def _fetch_range(
+        self,
+        fd: int,
+        bucket: str,
+        object_name: str,
+        etag: str,
+        offset: int,
+        length: int,
+        cancelled: threading.Event,
+        progress: Callable[[int], None] = None,
+    ):
+        attempt = 0
+        while True:
+            try:
+                return self._write_range(fd, bucket, object_name, etag, offset, length, cancelled, progress)
+            except Exception as e:
+                if cancelled.is_set() or attempt >= self.retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                if self.logger:
+                    self.logger.warning(f'Retry {attempt}/{self.retries} for {bucket}/{object_name}@{offset}: {e}')
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+
+    def _write_range(
+        self,
+        fd: int,
+        bucket: str,
+        object_name: str,
+        etag: str,
+        offset: int,
+        length: int,
+        cancelled: threading.Event,
+        progress: Callable[[int], None] = None,
+    ):
+        if cancelled.is_set():
+            raise DownloadCancelled(f'{bucket}/{object_name}@{offset}')
+        progress = progress or _no_progress
+        headers = {'If-Match': f'"{etag}"'} if etag else None
+        response = self.client.get_object(bucket, object_name, offset=offset, length=length, request_headers=headers)
+        position = offset
+        try:
+            for chunk in response.stream(self.chunk_size):
+                if cancelled.is_set():
+                    raise DownloadCancelled(f'{bucket}/{object_name}@{offset}')
+                os.pwrite(fd, chunk, position)
+                position += len(chunk)
+                progress(len(chunk))
+        except BaseException:
+            # the range is written again from its start if it is retried
+            progress(offset - position)
+            raise
+        finally:
+            response.close()
+            response.release_conn()
+        if position != offset + length:
+            raise IOError(f'Short read for {bucket}/{object_name}: got {position - offset} of {length} bytes')
+
+
+def _no_progress(amount: int):
+    pass
+
+
+def get_segmented_downloader(client, logger=None, retries: Optional[int] = None) -> SegmentedDownloader:
+    """downloader from the config, retries overrides the per range retries when the caller retries itself."""
+    return SegmentedDownloader(
+        client,
+        part_size=ConfigClass.SEGMENTED_DOWNLOAD_PART_SIZE,
+        workers=ConfigClass.SEGMENTED_DOWNLOAD_WORKERS,
+        threshold=ConfigClass.SEGMENTED_DOWNLOAD_THRESHOLD,
+        chunk_size=ConfigClass.ZIP_STREAM_CHUNK_SIZE,
+        retries=ConfigClass.DOWNLOAD_FETCH_RETRIES if retries is None else retries,
+        retry_backoff=ConfigClass.DOWNLOAD_FETCH_RETRY_BACKOFF,
+        logger=logger,
+    )
@@ -0,0 +1,116 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+from datetime import timedelta
+from typing import AsyncIterator
+from typing import Optional
+
+import httpx
+import minio
+from starlette.concurrency import run_in_threadpool
+
+from app.config import ConfigClass
+
+_http_client = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """process wide client so object streams share one connection pool."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ConfigClass.ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ConfigClass.ASYNC_HTTP_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(ConfigClass.ASYNC_HTTP_TIMEOUT),
+        )
+    return _http_client
+
+
+async def close_async_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+class ObjectStat:
+    def __init__(self, size: int, etag: Optional[str], last_modified: Optional[str]):
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class AsyncObjectReader:
+    """Read a minio object on the event loop.
+
+    The requests are presigned with the given minio client and sent through the shared httpx.AsyncClient, so no
+    thread is involved per chunk. Signing runs in the threadpool since it is only local when the client knows its
+    region (MINIO_REGION), otherwise minio looks up the bucket location with a blocking request first. Chunks are
+    only pulled from minio when the previous one was sent to the client, a slow client slows the transfer instead
+    of filling memory.
+    """
+
+    def __init__(self, client: minio.Minio, bucket: str, object_name: str, chunk_size: int = 256 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.object_name = object_name
+        self.chunk_size = chunk_size
+
+    async def _url(self, method: str) -> str:
+        return await run_in_threadpool(
+            self.client.get_presigned_url,
+            method,
+            self.bucket,
+            self.object_name,
+            expires=timedelta(seconds=ConfigClass.PRESIGNED_URL_EXPIRE),
+        )
+
+    def _raise_for_status(self, response: httpx.Response):
+        if response.status_code < 400:
+            return
+        codes = {403: 'AccessDenied', 404: 'NoSuchKey', 412: 'PreconditionFailed', 503: 'SlowDown'}
+        code = codes.get(response.status_code, 'InternalError')
+        raise minio.error.S3Error(
+            code=code,
+            message=f'{response.status_code} for {self.bucket}/{self.object_name}',
+            resource=self.object_name,
+            request_id=response.headers.get('x-amz-request-id', ''),
+            host_id=response.headers.get('x-amz-id-2', ''),
+            response=response,
+            bucket_name=self.bucket,
+            object_name=self.object_name,
+        )
+
+    async def stat(self) -> ObjectStat:
+        response = await get_async_http_client().head(await self._url('HEAD'))
+        self._raise_for_status(response)
+        etag = response.headers.get('ETag')
+        return ObjectStat(int(response.headers.get('Content-Length', 0)), etag, response.headers.get('Last-Modified'))
+
+    async def read_range(self, offset: int, length: int) -> AsyncIterator[bytes]:
+        if length <= 0:
+            return
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+        async with get_async_http_client().stream('GET', await self._url('GET'), headers=headers) as response:
+            self._raise_for_status(response)
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                yield chunk
@@ -18,13 +18,46 @@
 # permissions and limitations under the Licence.
 # 
 
-import httpx
+from datetime import datetime
+from typing import Optional
+from xml.etree import ElementTree
+
+import urllib3
 from minio import Minio
 from minio.credentials.providers import ClientGrantsProvider
+from minio.time import from_iso8601utc
 
+from app.commons.service_connection.upstream import get_upstream_client
 from app.config import ConfigClass
 
 
+def parse_sts_expiration(body: bytes) -> Optional[datetime]:
+    """utc expiry of the credentials in an sts AssumeRole* response, None when it has none."""
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        return None
+    for element in root.iter():
+        if element.tag.split('}')[-1] == 'Expiration' and element.text:
+            return from_iso8601utc(element.text.strip()).replace(tzinfo=None)
+    return None
+
+
+class StsHttpClient(urllib3.PoolManager):
+    """Pool of the sts requests of a credentials provider, it keeps the expiry of the last credentials fetched."""
+
+    def __init__(self):
+        # the retries minio's providers use when no http client is given
+        super().__init__(retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]))
+        self.expiration = None
+
+    def urlopen(self, method, url, *args, **kwargs):
+        response = super().urlopen(method, url, *args, **kwargs)
+        if response.status == 200:
+            self.expiration = parse_sts_expiration(response.data)
+        return response
+
+
 class Minio_Client_:
     def __init__(self, access_token, refresh_token):
         # preset the tokens for refreshing
@@ -32,14 +65,27 @@ class Minio_Client_:
         self.refresh_token = refresh_token
 
         # retrieve credential provide with tokens
-        c = self.get_provider()
+        self.sts_http = StsHttpClient()
+        self.provider = self.get_provider()
 
-        self.client = Minio(ConfigClass.MINIO_ENDPOINT, credentials=c, secure=ConfigClass.MINIO_HTTPS)
+        self.client = Minio(
+            ConfigClass.MINIO_ENDPOINT,
+            credentials=self.provider,
+            secure=ConfigClass.MINIO_HTTPS,
+            region=ConfigClass.MINIO_REGION or None,
+        )
 
         # add a sanity check for the token to see if the token
         # is expired
         self.client.list_buckets()
 
+    def credentials_expiration(self) -> Optional[datetime]:
+        """utc time the sts credentials expire, urls signed with them stop working then.
+
+        None before they were fetched.
+        """
+        return self.sts_http.expiration
+
     # function helps to get new token/refresh the token
     def _get_jwt(self):
         # enable the token exchange with different azp
@@ -54,8 +100,7 @@ class Minio_Client_:
         }
 
         # use http request to fetch from keycloak
-        with httpx.Client() as client:
-            result = client.post(ConfigClass.KEYCLOAK_URL, data=payload, headers=headers)
+        result = get_upstream_client('keycloak').post(ConfigClass.KEYCLOAK_URL, data=payload, headers=headers)
         if result.status_code != 200:
             raise Exception('Token refresh failed with ' + str(result.json()))
 
@@ -75,6 +120,7 @@ class Minio_Client_:
         provider = ClientGrantsProvider(
             self._get_jwt,
             minio_http,
+            http_client=self.sts_http,
         )
 
         return provider
@@ -89,4 +135,5 @@ class Minio_Client:
             access_key=ConfigClass.MINIO_ACCESS_KEY,
             secret_key=ConfigClass.MINIO_SECRET_KEY,
             secure=ConfigClass.MINIO_HTTPS,
+            region=ConfigClass.MINIO_REGION or None,
         )
@@ -0,0 +1,291 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import asyncio
+import random
+import threading
+import time
+import weakref
+from typing import Dict
+from typing import Optional
+
+import httpx
+
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.config import ConfigClass
+
+_logger = SrvLoggerFactory('upstream').get_logger()
+
+# internal services reached through get_upstream_client
+SERVICES = ('neo4j', 'dataset', 'queue', 'provenance', 'data_ops', 'utility', 'keycloak')
+
+_IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# the service is restarting or overloaded, another attempt may succeed
+_RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The service failed too often lately, requests are refused without being sent."""
+
+
+class CircuitBreaker:
+    """Refuse requests to a service after `threshold` failures in a row.
+
+    Once reset_timeout seconds passed a single request is let through again, the circuit closes when it
+    succeeds and stays open for another reset_timeout when it fails.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30.0):
+        self.threshold = max(threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # half open, this request is the trial and the others wait for its outcome
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """Long lived, keep-alive connection pool to one internal service.
+
+    The sync httpx.Client is shared by all threads, the httpx.AsyncClient is created once per event loop since
+    its connections belong to the loop. Transport errors and 502/503/504 responses are retried `retries` times
+    with full jitter backoff, by default only for idempotent methods, pass retry=True for read only POST queries.
+    Transport errors and 5xx responses count as failures for the circuit breaker. HTTP/2 is negotiated over TLS
+    when enabled and the h2 package is installed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.2,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        http2: bool = False,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = max(retries, 0)
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.http2 = http2 and _h2_available()
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _client_kwargs(self) -> dict:
+        return {
+            'timeout': httpx.Timeout(self.timeout),
+            'limits': httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive),
+            'http2': self.http2,
+        }
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None or self._client.is_closed:
+                self._client = httpx.Client(**self._client_kwargs())
+            return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None or client.is_closed:
+                client = httpx.AsyncClient(**self._client_kwargs())
+                self._async_clients[loop] = client
+            return client
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, self.backoff * (2 ** (attempt - 1)))
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'Circuit of {self.name} is open after {self.breaker.failures} failures')
+
+    def _record(self, response: httpx.Response):
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _retry_response(self, response: httpx.Response, retry: bool, attempt: int) -> bool:
+        return retry and attempt < self.retries and response.status_code in _RETRY_STATUS_CODES
+
+    def _log_retry(self, method: str, url: str, attempt: int, reason):
+        _logger.warning(f'Retry {attempt}/{self.retries} {method} {url} on {self.name}: {reason}')
+
+    def request(self, method: str, url: str, retry: Optional[bool] = None, **kwargs) -> httpx.Response:
+        retry = method.upper() in _IDEMPOTENT_METHODS if retry is None else retry
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if not retry or attempt >= self.retries:
+                    raise
+                reason = e
+            else:
+                self._record(response)
+                if not self._retry_response(response, retry, attempt):
+                    return response
+                reason = response.status_code
+                response.close()
+            attempt += 1
+            self._log_retry(method, url, attempt, reason)
+            time.sleep(self._delay(attempt))
+
+    async def arequest(self, method: str, url: str, retry: Optional[bool] = None, **kwargs) -> httpx.Response:
+        retry = method.upper() in _IDEMPOTENT_METHODS if retry is None else retry
+        attempt = 0
+        while True:
+            self._check_breaker()
+            try:
+                response = await self.async_client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if not retry or attempt >= self.retries:
+                    raise
+                reason = e
+            else:
+                self._record(response)
+                if not self._retry_response(response, retry, attempt):
+                    return response
+                reason = response.status_code
+                await response.aclose()
+            attempt += 1
+            self._log_retry(method, url, attempt, reason)
+            await asyncio.sleep(self._delay(attempt))
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        return self.request('POST', url, **kwargs)
+
+    async def aget(self, url: str, **kwargs) -> httpx.Response:
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url: str, **kwargs) -> httpx.Response:
+        return await self.arequest('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    async def aclose(self):
+        self.close()
+        await self.aclose_loop_client()
+
+    async def aclose_loop_client(self):
+        """close the async client of the running loop, to be called before a short lived loop ends."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        with self._lock:
+            client = self._async_clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+
+def _h2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        _logger.warning('HTTP/2 is enabled but the h2 package is not installed, using HTTP/1.1')
+        return False
+    return True
+
+
+_clients: Dict[str, UpstreamClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_upstream_client(service: str) -> UpstreamClient:
+    """process wide client of one of SERVICES, configured from UPSTREAM_* settings."""
+    with _clients_lock:
+        client = _clients.get(service)
+        if client is None:
+            if service not in SERVICES:
+                raise ValueError(f'Unknown upstream service {service}')
+            client = UpstreamClient(
+                service,
+                timeout=ConfigClass.UPSTREAM_TIMEOUTS.get(service, ConfigClass.UPSTREAM_TIMEOUT),
+                retries=ConfigClass.UPSTREAM_RETRIES,
+                backoff=ConfigClass.UPSTREAM_RETRY_BACKOFF,
+                max_connections=ConfigClass.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive=ConfigClass.UPSTREAM_MAX_KEEPALIVE,
+                http2=ConfigClass.UPSTREAM_HTTP2,
+                breaker=CircuitBreaker(ConfigClass.UPSTREAM_BREAKER_THRESHOLD, ConfigClass.UPSTREAM_BREAKER_RESET),
+            )
+            _clients[service] = client
+    return client
+
+
+async def close_upstream_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def reset_upstream_clients():
+    """close the sync pools and forget every client and breaker state."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,215 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import asyncio
+import json
+import threading
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from starlette.requests import Request
+
+from app.commons.data_providers.redis import get_redis_client
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.config import ConfigClass
+
+_logger = SrvLoggerFactory('status_stream').get_logger()
+
+# set_status publishes every record on the channel of its session
+STATUS_CHANNEL = 'dataaction_status:'
+
+KEEP_ALIVE = ': keep-alive\n\n'
+
+
+def status_channel(session_id) -> str:
+    return f'{STATUS_CHANNEL}{session_id}'
+
+
+class StatusQueue(asyncio.Queue):
+    """Records of a session waiting for its stream.
+
+    Once maxsize records are waiting the queued record of the same job is replaced by the new one, or the
+    oldest record is dropped when there is none, so a stalled client holds at most maxsize records.
+    """
+
+    def put_latest(self, record: dict):
+        if self.full():
+            for index, queued in enumerate(self._queue):
+                if (queued['job_id'], queued['source']) == (record['job_id'], record['source']):
+                    self._queue[index] = record
+                    return
+            dropped = self.get_nowait()
+            _logger.warning(f'Status stream of session {record["session_id"]} is full, dropped {dropped["status"]}')
+        self.put_nowait(record)
+
+
+class StatusBroadcaster:
+    """Fan the published status records out to the streams open in this process.
+
+    A single thread holds one pattern subscription to every status channel, so the number of redis
+    connections does not grow with the number of clients waiting for their jobs. Each stream gets a
+    StatusQueue of the records of its session, filled from the thread with call_soon_threadsafe.
+    """
+
+    def __init__(self, poll_timeout: float = 1.0, queue_size: int = 100):
+        self.poll_timeout = poll_timeout
+        self.queue_size = queue_size
+        self._listeners: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, StatusQueue]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._subscribed = threading.Event()
+        self._thread = None
+
+    def subscribe(self, session_id) -> StatusQueue:
+        """queue of the records published for the session from now on, must be called in the event loop."""
+        queue = StatusQueue(self.queue_size)
+        with self._lock:
+            self._listeners.setdefault(str(session_id), set()).add((asyncio.get_running_loop(), queue))
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._subscribed.clear()
+                self._thread = threading.Thread(target=self._run, name='status-broadcaster', daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, session_id, queue: StatusQueue):
+        with self._lock:
+            listeners = self._listeners.get(str(session_id), set())
+            listeners.difference_update({listener for listener in listeners if listener[1] is queue})
+            if not listeners:
+                self._listeners.pop(str(session_id), None)
+
+    def wait_subscribed(self, timeout: float = None) -> bool:
+        return self._subscribed.wait(timeout)
+
+    def _dispatch(self, channel: str, data: bytes):
+        session_id = channel[len(STATUS_CHANNEL) :]
+        with self._lock:
+            listeners = list(self._listeners.get(session_id, ()))
+        if not listeners:
+            return
+        record = json.loads(data)
+        for loop, queue in listeners:
+            try:
+                loop.call_soon_threadsafe(queue.put_latest, record)
+            except RuntimeError:
+                # the loop of the stream is closed
+                self.unsubscribe(session_id, queue)
+
+    def _listen(self):
+        pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.psubscribe(STATUS_CHANNEL + '*')
+            self._subscribed.set()
+            while not self._stop.is_set():
+                message = pubsub.get_message(timeout=self.poll_timeout)
+                if message and message['type'] == 'pmessage':
+                    channel = message['channel']
+                    self._dispatch(channel.decode() if isinstance(channel, bytes) else channel, message['data'])
+        finally:
+            self._subscribed.clear()
+            pubsub.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                _logger.error(f'Status subscription failed, subscribing again: {str(e)}')
+                self._stop.wait(self.poll_timeout)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_broadcaster = None
+
+
+def get_status_broadcaster() -> StatusBroadcaster:
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = StatusBroadcaster(queue_size=ConfigClass.STATUS_STREAM_QUEUE_SIZE)
+    return _broadcaster
+
+
+def stop_status_broadcaster():
+    global _broadcaster
+    if _broadcaster is not None:
+        _broadcaster.stop()
+        _broadcaster = None
+
+
+def format_event(record: dict) -> str:
+    return f'event: status\ndata: {json.dumps(record)}\n\n'
+
+
+async def _next_event(
+    request: Request, queue: StatusQueue, accept: Callable[[dict], bool], heartbeat: float
+) -> Optional[Union[dict, str]]:
+    """next accepted record, KEEP_ALIVE after heartbeat seconds without one, None once the client is gone."""
+    while True:
+        try:
+            record = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+        except asyncio.TimeoutError:
+            return None if await request.is_disconnected() else KEEP_ALIVE
+        if accept(record):
+            return None if await request.is_disconnected() else record
+
+
+async def status_events(
+    request: Request,
+    session_id,
+    queue: StatusQueue,
+    current: Iterable[dict],
+    accept: Callable[[dict], bool],
+    final_statuses: Iterable[str] = (),
+    heartbeat: float = 15.0,
+) -> AsyncIterator[str]:
+    """Server-sent events of the accepted records, the current ones first.
+
+    The queue must be subscribed before the current records are read so no transition is missed. The stream
+    ends once an accepted record reaches one of the final statuses or the client disconnects, a comment is
+    sent every heartbeat seconds without records to keep proxies from closing the connection.
+    """
+    try:
+        for record in current:
+            yield format_event(record)
+            if record['status'] in final_statuses:
+                return
+        while True:
+            event = await _next_event(request, queue, accept, heartbeat)
+            if event is None:
+                return
+            if event is KEEP_ALIVE:
+                yield KEEP_ALIVE
+                continue
+            yield format_event(event)
+            if event['status'] in final_statuses:
+                return
+    finally:
+        get_status_broadcaster().unsubscribe(session_id, queue)
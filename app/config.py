@@ -20,10 +20,12 @@
 
 from typing import Any
 from typing import Dict
+from typing import Optional
 
 from common import VaultClient
 from pydantic import BaseSettings
 from pydantic import Extra
+from pydantic import validator
 from starlette.config import Config
 
 config = Config('.env')
@@ -74,6 +76,110 @@ class Settings(BaseSettings):
     MINIO_ACCESS_KEY: str
     MINIO_SECRET_KEY: str
     KEYCLOAK_MINIO_SECRET: str
+    # region of the minio server, when set the clients never have to ask
+    # for a bucket location before signing a request
+    MINIO_REGION: Optional[str] = None
+
+    # resource locks requested or released at the same time per download
+    LOCK_CONCURRENCY: int = 16
+    # lock a selected folder once on its prefix instead of every node below it,
+    # only for a data ops service checking prefix and intent_read locks
+    LOCK_HIERARCHICAL: bool = False
+    # a job renews the lease of its locks every LOCK_HEARTBEAT_INTERVAL seconds,
+    # the locks of a lease not renewed for LOCK_LEASE_TTL seconds are released
+    # by the sweeper running every LOCK_SWEEP_INTERVAL seconds
+    LOCK_LEASE_TTL: int = 30
+    LOCK_HEARTBEAT_INTERVAL: int = 10
+    LOCK_SWEEP_INTERVAL: int = 15
+
+    # pooled clients of the internal services, UPSTREAM_TIMEOUTS overrides the
+    # timeout per service ({"neo4j": 60}). The circuit of a service opens after
+    # UPSTREAM_BREAKER_THRESHOLD failures in a row for UPSTREAM_BREAKER_RESET seconds
+    UPSTREAM_TIMEOUT: float = 30.0
+    UPSTREAM_TIMEOUTS: Dict[str, float] = {}
+    UPSTREAM_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF: float = 0.2
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE: int = 20
+    UPSTREAM_HTTP2: bool = False
+    UPSTREAM_BREAKER_THRESHOLD: int = 5
+    UPSTREAM_BREAKER_RESET: float = 30.0
+
+    # geids resolved per neo4j batch query, and concurrent
+    # requests when single node lookups are needed instead
+    NEO4J_BATCH_SIZE: int = 500
+    NEO4J_FETCH_WORKERS: int = 16
+    # folder listings in flight while walking a folder tree
+    NEO4J_WALK_CONCURRENCY: int = 8
+    # neo4j nodes and folder listings cached in redis for METADATA_CACHE_TTL
+    # seconds, with a per process LRU of METADATA_CACHE_LOCAL_SIZE entries in
+    # front that keeps them METADATA_CACHE_LOCAL_TTL seconds
+    METADATA_CACHE_ENABLED: bool = True
+    METADATA_CACHE_TTL: int = 300
+    METADATA_CACHE_LOCAL_TTL: int = 30
+    METADATA_CACHE_LOCAL_SIZE: int = 4096
+
+    # archive
+    # stream folder zips from minio to the client instead of staging them on disk
+    OBJECT_ZIP_STREAMING: bool = True
+    ZIP_STREAM_CHUNK_SIZE: int = 1024 * 1024
+    # concurrent object fetch for the pre-download jobs, the byte
+    # budget caps how much data a single job has in flight
+    DOWNLOAD_FETCH_WORKERS: int = 8
+    DOWNLOAD_FETCH_BYTE_BUDGET: int = 4 * 1024 ** 3
+    DOWNLOAD_FETCH_RETRIES: int = 3
+    DOWNLOAD_FETCH_RETRY_BACKOFF: float = 0.5
+    # single file pre downloads are streamed from minio by /v1/download
+    # instead of being copied to the tmp folder first
+    DIRECT_SINGLE_FILE_DOWNLOAD: bool = True
+    # objects from the threshold up are fetched as concurrent byte ranges
+    SEGMENTED_DOWNLOAD_THRESHOLD: int = 256 * 1024 * 1024
+    SEGMENTED_DOWNLOAD_PART_SIZE: int = 64 * 1024 * 1024
+    SEGMENTED_DOWNLOAD_WORKERS: int = 8
+    # chunks each object reader may buffer ahead of the archive writer
+    ARCHIVE_READ_AHEAD_CHUNKS: int = 4
+    # processes deflating archive chunks, 0 or 1 compresses in the calling thread
+    ZIP_COMPRESSION_WORKERS: int = 4
+    # per entry choice between store and deflate, see CompressionPolicy
+    ZIP_STORED_EXTENSIONS: str = (
+        '.gz,.tgz,.bz2,.xz,.zst,.zip,.7z,.rar,.jpg,.jpeg,.png,.gif,.webp,.heic,'
+        '.mp4,.mkv,.mov,.avi,.webm,.mp3,.aac,.ogg,.flac,.docx,.xlsx,.pptx,.bam,.cram'
+    )
+    ZIP_STORE_BELOW_SIZE: int = 128
+    ZIP_PROBE_SIZE: int = 4096
+    ZIP_PROBE_STORE_RATIO: float = 0.9
+    # MANIFEST.sha256/.md5 in pre download archives and the archive sha256 in the job status
+    ARCHIVE_CHECKSUMS: bool = True
+    # tar.gz and tar.zst pre download archives, -1 threads lets zstd use every core
+    TAR_GZ_LEVEL: int = 6
+    ZSTD_LEVEL: int = 3
+    ZSTD_THREADS: int = -1
+
+    # ranged downloads, requests with more ranges than this get the whole file
+    DOWNLOAD_MAX_RANGES: int = 16
+    DOWNLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+    # stream minio objects on the event loop through a shared async http client
+    # instead of iterating urllib3 responses in the threadpool
+    ASYNC_OBJECT_STREAMING: bool = True
+    ASYNC_STREAM_CHUNK_SIZE: int = 256 * 1024
+    ASYNC_HTTP_MAX_CONNECTIONS: int = 500
+    ASYNC_HTTP_MAX_KEEPALIVE: int = 100
+    ASYNC_HTTP_TIMEOUT: float = 60.0
+
+    # hand staged files to the fronting web server instead of sending them from python:
+    # '' (off), 'x-accel-redirect' (nginx) or 'x-sendfile' (apache, lighttpd). For nginx
+    # DOWNLOAD_OFFLOAD_PREFIX is an internal location serving DOWNLOAD_OFFLOAD_ROOT,
+    # which defaults to MINIO_TMP_PATH
+    DOWNLOAD_OFFLOAD_MODE: str = ''
+    DOWNLOAD_OFFLOAD_PREFIX: str = '/protected_downloads/'
+    DOWNLOAD_OFFLOAD_ROOT: str = ''
+
+    # presigned minio urls, cached per user and object until
+    # PRESIGNED_URL_CACHE_MARGIN seconds before they expire
+    PRESIGNED_URL_EXPIRE: int = 3600
+    PRESIGNED_URL_CACHE_MARGIN: int = 300
+    PRESIGNED_URL_BATCH_LIMIT: int = 5000
 
     # download secret
     DOWNLOAD_KEY: str = 'indoc101'
@@ -83,6 +189,31 @@ class Settings(BaseSettings):
     REDIS_PORT: str
     REDIS_DB: str
     REDIS_PASSWORD: str
+    # connections per worker process, a command waiting longer than
+    # REDIS_SOCKET_TIMEOUT seconds for its reply fails
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_CONNECT_TIMEOUT: float = 2.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    # seconds without status change before a keep-alive comment on the status streams
+    STATUS_STREAM_HEARTBEAT: float = 15.0
+    # records waiting for a slow status stream, older records of the same job are replaced beyond it
+    STATUS_STREAM_QUEUE_SIZE: int = 100
+    # seconds between two progress updates of a running zip job
+    PROGRESS_UPDATE_INTERVAL: float = 0.5
+
+    # zip jobs are queued in redis and run by the `python -m app.worker` processes
+    # instead of a background task of the api worker. A job not renewed for
+    # JOB_LEASE_TTL seconds is taken over by another worker, at most
+    # JOB_MAX_ATTEMPTS times. The record of a job holds the tokens of the user
+    # and expires JOB_MAX_AGE seconds after it was queued
+    JOB_QUEUE_ENABLED: bool = False
+    JOB_WORKER_CONCURRENCY: int = 2
+    JOB_LEASE_TTL: int = 60
+    JOB_HEARTBEAT_INTERVAL: int = 20
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_MAX_AGE: int = 86400
 
     # Postgres
     RDS_HOST: str
@@ -96,6 +227,13 @@ class Settings(BaseSettings):
     OPEN_TELEMETRY_HOST: str = '127.0.0.1'
     OPEN_TELEMETRY_PORT: int = 6831
 
+    @validator('DOWNLOAD_OFFLOAD_MODE')
+    def check_download_offload_mode(cls, value: str) -> str:
+        value = value.lower()
+        if value not in ('', 'x-accel-redirect', 'x-sendfile'):
+            raise ValueError(f'Unknown download offload mode {value}')
+        return value
+
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
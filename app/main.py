@@ -33,8 +33,15 @@ from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 
 from app.api_registry import api_registry
+from app.commons.data_providers.redis import close_redis_client
+from app.commons.locks import start_lease_sweeper
+from app.commons.locks import stop_lease_sweeper
+from app.commons.service_connection.async_object_stream import close_async_http_client
+from app.commons.service_connection.upstream import close_upstream_clients
+from app.commons.status_stream import stop_status_broadcaster
 from app.config import ConfigClass
 from app.resources.error_handler import APIException
+from app.resources.helpers import index_status_records
 
 
 def create_app():
@@ -64,6 +71,14 @@ def create_app():
 
     api_registry(app)
 
+    app.add_event_handler('startup', index_status_records)
+    app.add_event_handler('startup', start_lease_sweeper)
+    app.add_event_handler('shutdown', stop_lease_sweeper)
+    app.add_event_handler('shutdown', stop_status_broadcaster)
+    app.add_event_handler('shutdown', close_async_http_client)
+    app.add_event_handler('shutdown', close_upstream_clients)
+    app.add_event_handler('shutdown', close_redis_client)
+
     instrument_app(app)
 
     return app
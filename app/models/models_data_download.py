@@ -32,6 +32,15 @@ from pydantic.types import constr
 from .base_models import APIResponse
 
 
+class EArchiveFormat(str, Enum):
+    """Archive formats a pre download job can produce."""
+
+    ZIP = 'zip'
+    TAR = 'tar'
+    TAR_GZ = 'tar.gz'
+    TAR_ZST = 'tar.zst'
+
+
 class PreDataDownloadPOST(BaseModel):
     """Pre download payload model."""
 
@@ -42,6 +51,7 @@ class PreDataDownloadPOST(BaseModel):
     dataset_geid: str = ''
     dataset_description: bool = False
     approval_request_id: Optional[UUID]
+    archive_format: EArchiveFormat = EArchiveFormat.ZIP
 
 
 class DatasetPrePOST(BaseModel):
@@ -50,6 +60,7 @@ class DatasetPrePOST(BaseModel):
     dataset_geid: constr(min_length=2)
     operator: str
     session_id: str
+    archive_format: EArchiveFormat = EArchiveFormat.ZIP
 
 
 class PreSignedDownload(BaseModel):
@@ -64,6 +75,12 @@ class PreSignedBatchDownload(BaseModel):
     object_path: list
 
 
+class MetadataCacheInvalidatePOST(BaseModel):
+    """Geids whose cached neo4j nodes and folder listings are dropped."""
+
+    geids: List[str]
+
+
 class PreDataDownloadResponse(APIResponse):
     """Pre download response class."""
 
@@ -0,0 +1,58 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+from typing import Optional
+from urllib.parse import quote
+
+from fastapi.responses import Response
+
+from app.config import ConfigClass
+
+OFFLOAD_X_ACCEL_REDIRECT = 'x-accel-redirect'
+OFFLOAD_X_SENDFILE = 'x-sendfile'
+
+
+def offload_headers(full_path: str) -> Optional[dict]:
+    """headers telling the web server in front of us to send full_path, None if offloading does not apply.
+
+    DOWNLOAD_OFFLOAD_MODE is checked when the settings are loaded.
+    """
+    mode = ConfigClass.DOWNLOAD_OFFLOAD_MODE
+    if not mode:
+        return None
+    path = os.path.abspath(full_path)
+    if mode == OFFLOAD_X_SENDFILE:
+        return {'X-Sendfile': path}
+    root = os.path.abspath(ConfigClass.DOWNLOAD_OFFLOAD_ROOT or ConfigClass.MINIO_TMP_PATH)
+    relative = os.path.relpath(path, root)
+    if relative == os.curdir or relative.startswith(os.pardir):
+        # only files below the root are reachable through the internal location
+        return None
+    return {'X-Accel-Redirect': quote(ConfigClass.DOWNLOAD_OFFLOAD_PREFIX.rstrip('/') + '/' + relative)}
+
+
+def offload_response(full_path: str, filename: str, media_type: str) -> Optional[Response]:
+    """empty response the web server fills with the file, it handles Range requests itself."""
+    headers = offload_headers(full_path)
+    if headers is None:
+        return None
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return Response(headers=headers, media_type=media_type)
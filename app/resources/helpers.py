@@ -18,33 +18,44 @@
 # permissions and limitations under the Licence.
 # 
 
+import asyncio
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+from typing import Dict
 from typing import List
 
 import httpx
+from redis.exceptions import RedisError
 
 from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.metadata_cache import CHILDREN
+from app.commons.metadata_cache import FOLDER
+from app.commons.metadata_cache import NODE
+from app.commons.metadata_cache import get_metadata_cache
+from app.commons.service_connection.upstream import get_upstream_client
+from app.commons.status_stream import status_channel
 from app.config import ConfigClass
 
 from .error_handler import internal_jsonrespon_handler
 
+_logger = SrvLoggerFactory('helpers').get_logger()
+
 
 def get_geid():
     url = ConfigClass.UTILITY_SERVICE + 'utility/id'
-    with httpx.Client() as client:
-        response = client.get(url)
+    response = get_upstream_client('utility').get(url)
     if response.status_code == 200:
         return response.json()['result']
     else:
         raise Exception('get_geid {}: {}'.format(response.status_code, url))
 
 
-def get_files_recursive(folder_geid):
-    all_files = []
-
-    query = {
+def _folder_query(folder_geid: str) -> dict:
+    return {
         'start_label': 'Folder',
         'end_labels': ['File', 'Folder'],
         'query': {
@@ -56,19 +67,79 @@ def get_files_recursive(folder_geid):
             },
         },
     }
-    with httpx.Client() as client:
-        resp = client.post(ConfigClass.NEO4J_SERVICE_V2 + 'relations/query', json=query)
-    for node in resp.json()['results']:
-        if 'File' in node['labels']:
-            all_files.append(node)
-        else:
-            all_files += get_files_recursive(node['global_entity_id'])
-    return all_files
+
+
+async def walk_folder_files(
+    folder_geid: str, concurrency: int = 8, include_folders: bool = False
+) -> AsyncIterator[dict]:
+    """Yield the file nodes below a folder, breadth first.
+
+    Every level of the tree is listed with up to `concurrency` relations/query calls at a time. The files are
+    yielded in the order of their folders as each listing completes, so the output is deterministic and the
+    depth of the tree is not limited by python recursion. Listings are kept in the metadata cache. With
+    include_folders the sub folder nodes are yielded too, before the content of the folder.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    cache = get_metadata_cache()
+    client = get_upstream_client('neo4j')
+
+    async def list_folder(geid: str) -> list:
+        results = cache.get(FOLDER, geid)
+        if results is not None:
+            return results
+        async with semaphore:
+            resp = await client.apost(
+                ConfigClass.NEO4J_SERVICE_V2 + 'relations/query', json=_folder_query(geid), retry=True
+            )
+        if resp.status_code != 200:
+            raise Exception(f'Failed to list folder {geid}: {resp.status_code} {resp.text}')
+        results = resp.json()['results']
+        cache.set(FOLDER, geid, results)
+        return results
+
+    level = [folder_geid]
+    while level:
+        tasks = [asyncio.ensure_future(list_folder(geid)) for geid in level]
+        level = []
+        try:
+            for task in tasks:
+                for node in await task:
+                    if 'File' in node['labels']:
+                        yield node
+                    else:
+                        if include_folders:
+                            yield node
+                        level.append(node['global_entity_id'])
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def _collect_folder_files(folder_geid: str, include_folders: bool) -> list:
+    walk = walk_folder_files(folder_geid, ConfigClass.NEO4J_WALK_CONCURRENCY, include_folders)
+    try:
+        return [node async for node in walk]
+    finally:
+        await get_upstream_client('neo4j').aclose_loop_client()
+
+
+def get_files_recursive(folder_geid, include_folders: bool = False):
+    """all file nodes below the folder, see walk_folder_files.
+
+    The walk runs in its own event loop, so this has to be called from a worker thread, never from the loop
+    serving requests.
+    """
+    return asyncio.run(_collect_folder_files(folder_geid, include_folders))
 
 
 def get_children_nodes(start_geid: str) -> list:
     """The function is different than above one this one will return next layer folder or files under the start_geid."""
 
+    cache = get_metadata_cache()
+    ffs = cache.get(CHILDREN, start_geid)
+    if ffs is not None:
+        return ffs
+
     payload = {
         'label': 'own',
         'start_label': 'Folder',
@@ -76,9 +147,10 @@ def get_children_nodes(start_geid: str) -> list:
     }
 
     node_query_url = ConfigClass.NEO4J_SERVICE + 'relations/query'
-    with httpx.Client() as client:
-        response = client.post(node_query_url, json=payload)
+    response = get_upstream_client('neo4j').post(node_query_url, json=payload, retry=True)
     ffs = [x.get('end_node') for x in response.json()]
+    if response.status_code == 200:
+        cache.set(CHILDREN, start_geid, ffs)
 
     return ffs
 
@@ -88,10 +160,7 @@ def get_resource_bygeid(geid, exclude_archived=False) -> dict:
 
     raise exception if the geid is not exist
     """
-    url = ConfigClass.NEO4J_SERVICE + 'nodes/geid/%s' % geid
-    with httpx.Client() as client:
-        res = client.get(url)
-    nodes = res.json()
+    nodes = get_nodes_by_geids([geid])[geid]
 
     if len(nodes) == 0:
         raise Exception('Not found resource: ' + geid)
@@ -99,6 +168,90 @@ def get_resource_bygeid(geid, exclude_archived=False) -> dict:
     return nodes[0]
 
 
+def get_nodes_by_geids(geids: List[str]) -> Dict[str, list]:
+    """Nodes of many geids, as lists like GET nodes/geid/{geid} returns them.
+
+    The geids are resolved NEO4J_BATCH_SIZE at a time with the batch query endpoint. Whatever that does not
+    return, because a batch failed or the endpoint is not available, is fetched with concurrent GET
+    nodes/geid/{geid} requests. A single geid goes straight to the GET endpoint. Nodes found are kept in the
+    metadata cache, only the geids not cached are looked up.
+    """
+    cache = get_metadata_cache()
+    cached = cache.get_many(NODE, geids)
+    geids = [geid for geid in dict.fromkeys(geids) if geid not in cached]
+    nodes = {}
+    client = get_upstream_client('neo4j')
+    if len(geids) > 1:
+        url = ConfigClass.NEO4J_SERVICE + 'nodes/query/geids'
+        for i in range(0, len(geids), ConfigClass.NEO4J_BATCH_SIZE):
+            try:
+                res = client.post(url, json={'geids': geids[i : i + ConfigClass.NEO4J_BATCH_SIZE]}, retry=True)
+            except httpx.HTTPError:
+                break
+            if res.status_code != 200:
+                break
+            result = res.json()
+            if isinstance(result, dict):
+                result = result.get('result', [])
+            for node in result:
+                nodes.setdefault(node['global_entity_id'], []).append(node)
+
+    missing = [geid for geid in geids if geid not in nodes]
+    if missing:
+
+        def get_node(geid: str) -> list:
+            return client.get(ConfigClass.NEO4J_SERVICE + f'nodes/geid/{geid}').json()
+
+        with ThreadPoolExecutor(max_workers=min(ConfigClass.NEO4J_FETCH_WORKERS, len(missing))) as executor:
+            nodes.update(zip(missing, executor.map(get_node, missing)))
+    # empty or error responses are not cached, the node may just have been created
+    cache.set_many(NODE, {geid: node for geid, node in nodes.items() if isinstance(node, list) and node})
+    nodes.update(cached)
+    return nodes
+
+
+def _is_pattern(value) -> bool:
+    return value is None or any(char in str(value) for char in '*?[')
+
+
+def status_indexes(session_id, job_id='*', project_code='*', operator='*') -> List[str]:
+    """index sets of the status records, only for the values which are not glob patterns."""
+    indexes = []
+    if not _is_pattern(session_id):
+        indexes.append(f'dataaction:index:session:{session_id}')
+    if not _is_pattern(job_id):
+        indexes.append(f'dataaction:index:job:{job_id}')
+    if not _is_pattern(project_code) and not _is_pattern(operator):
+        indexes.append(f'dataaction:index:operator:{project_code}:{operator}')
+    return indexes
+
+
+def _record_indexes(key: str) -> List[str]:
+    # dataaction:{session_id}:{job_id}:{action}:{project_code}:{operator}:{source}
+    _, session_id, job_id, _, project_code, operator, _ = key.split(':', 6)
+    return [
+        f'dataaction:index:session:{session_id}',
+        f'dataaction:index:job:{job_id}',
+        f'dataaction:index:operator:{project_code}:{operator}',
+    ]
+
+
+def index_status_records() -> int:
+    """add the status records written before the indexes existed to them, once per redis."""
+    srv_redis = SrvRedisSingleton()
+    try:
+        if not srv_redis.set_with_expire('dataaction:index:version', '1', None, only_if_absent=True):
+            return 0
+        keys = [key.decode() for key in srv_redis.scan_keys('dataaction:*')]
+        keys = [key for key in keys if not key.startswith('dataaction:index:') and key.count(':') >= 6]
+        srv_redis.index_keys({key: _record_indexes(key) for key in keys})
+    except RedisError as e:
+        _logger.error(f'Fail to index the status records: {str(e)}')
+        return 0
+    _logger.info(f'Indexed {len(keys)} status records')
+    return len(keys)
+
+
 def set_status(
     session_id, job_id, source, action, target_status, project_code, operator, geid, payload=None, progress=0
 ):
@@ -123,7 +276,7 @@ def set_status(
         'update_timestamp': str(round(time.time())),
     }
     my_value = json.dumps(record)
-    srv_redis.set_by_key(my_key, my_value)
+    srv_redis.set_with_indexes(my_key, my_value, _record_indexes(my_key), status_channel(session_id))
     return record
 
 
@@ -134,7 +287,11 @@ def get_status(session_id, job_id, project_code, action, operator=None) -> List[
     my_key = 'dataaction:{}:{}:{}:{}'.format(session_id, job_id, action, project_code)
     if operator:
         my_key = 'dataaction:{}:{}:{}:{}:{}'.format(session_id, job_id, action, project_code, operator)
-    res_binary = srv_redis.mget_by_prefix(my_key)
+    indexes = status_indexes(session_id, job_id, project_code, operator or '*')
+    if indexes:
+        res_binary = srv_redis.mget_by_indexes(indexes, my_key + ':*')
+    else:
+        res_binary = srv_redis.mget_by_prefix(my_key)
     return [json.loads(record.decode('utf-8')) for record in res_binary] if res_binary else []
 
 
@@ -143,7 +300,12 @@ def delete_by_session_id(session_id: str, job_id: str = '*', action: str = '*'):
 
     srv_redis = SrvRedisSingleton()
     prefix = 'dataaction:' + session_id + ':' + job_id + ':' + action
-    srv_redis.mdelete_by_prefix(prefix)
+    indexes = status_indexes(session_id, job_id)
+    if indexes:
+        keys = srv_redis.keys_by_indexes(indexes, prefix + ':*')
+        srv_redis.delete_with_indexes({key: _record_indexes(key) for key in keys})
+    else:
+        srv_redis.mdelete_by_prefix(prefix)
     return True
 
 
@@ -165,6 +327,5 @@ def update_file_operation_logs(operator, download_path, project_code,
         'project_code': project_code,
         'extra': extra if extra else {},
     }
-    with httpx.Client() as client:
-        res_audit_logs = client.post(url_audit_log, json=payload_audit_log)
+    res_audit_logs = get_upstream_client('provenance').post(url_audit_log, json=payload_audit_log)
     return internal_jsonrespon_handler(url_audit_log, res_audit_logs)
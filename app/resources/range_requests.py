@@ -0,0 +1,356 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import hashlib
+import inspect
+import os
+import sys
+from email.utils import formatdate
+from typing import AsyncIterator
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import uuid4
+
+from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+
+# read_range(start, length) returns an iterator over those bytes of the content,
+# it may be an async generator function as well
+RangeReader = Callable[[int, int], Iterator[bytes]]
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlap the content."""
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a `bytes=` Range header into sorted (start, end) pairs, end inclusive.
+
+    Overlapping and adjacent ranges are coalesced. None means the header is absent or malformed and the whole
+    content should be sent, RangeNotSatisfiable is raised when it is valid but no range overlaps the content.
+    """
+    if not range_header:
+        return None
+    unit, _, specs = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    ranges = []
+    try:
+        for spec in specs.split(','):
+            spec = spec.strip()
+            if spec:
+                byte_range = _parse_range_spec(spec, size)
+                if byte_range is not None:
+                    ranges.append(byte_range)
+    except ValueError:
+        return None
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    return _coalesce_ranges(ranges)
+
+
+def _parse_range_spec(spec: str, size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) of a `start-end`, `start-` or `-suffix` spec, None when it does not overlap the content.
+
+    ValueError is raised when the spec is malformed.
+    """
+    start, sep, end = spec.partition('-')
+    start, end = start.strip(), end.strip()
+    if not sep or not (start or end) or (start and not start.isdigit()) or (end and not end.isdigit()):
+        raise ValueError(spec)
+    if not start:
+        # suffix range, the last N bytes
+        suffix = int(end)
+        return (max(size - suffix, 0), size - 1) if suffix > 0 and size > 0 else None
+    first = int(start)
+    if end and int(end) < first:
+        raise ValueError(spec)
+    if first >= size:
+        return None
+    return first, min(int(end) if end else size - 1, size - 1)
+
+
+def _coalesce_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """sort the ranges and merge the overlapping and adjacent ones."""
+    ranges = sorted(ranges)
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def requests_first_byte(range_header: Optional[str]) -> bool:
+    """whether the request gets the start of the content, it is a new download and not a later part of one."""
+    try:
+        ranges = parse_range_header(range_header, sys.maxsize)
+    except RangeNotSatisfiable:
+        return False
+    return ranges is None or ranges[0][0] == 0
+
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str], last_modified: Optional[str]) -> bool:
+    """check the If-Range validator, ranges are only honoured when it still matches the content."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('W/'):
+        # weak entity tags never match for ranges
+        return False
+    if if_range.startswith('"'):
+        return etag is not None and if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+def file_validators(path: str) -> Tuple[str, str]:
+    """ETag and Last-Modified of a local file, computed the same way as starlette's FileResponse."""
+    stat_result = os.stat(path)
+    etag_base = str(stat_result.st_mtime) + '-' + str(stat_result.st_size)
+    etag = '"' + hashlib.md5(etag_base.encode()).hexdigest() + '"'
+    return etag, formatdate(stat_result.st_mtime, usegmt=True)
+
+
+def iter_file_range(path: str, start: int, length: int, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    with open(path, 'rb') as file:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _iter_multipart(parts: List[Tuple[bytes, int, int]], closing: bytes, read_range: RangeReader) -> Iterator[bytes]:
+    for part_header, start, length in parts:
+        yield part_header
+        for chunk in read_range(start, length):
+            yield chunk
+        yield b'\r\n'
+    yield closing
+
+
+async def _aiter_multipart(
+    parts: List[Tuple[bytes, int, int]], closing: bytes, read_range: RangeReader
+) -> AsyncIterator[bytes]:
+    for part_header, start, length in parts:
+        yield part_header
+        async for chunk in read_range(start, length):
+            yield chunk
+        yield b'\r\n'
+    yield closing
+
+
+class FileRangeResponse(StreamingResponse):
+    """Part of a local file, handed to the server with the zerocopysend extension when it offers it.
+
+    Servers implementing the ASGI `http.response.zerocopysend` extension send the bytes with os.sendfile, for
+    the others the content is streamed as usual.
+    """
+
+    def __init__(self, content, file_path: str, offset: int, count: int, **kwargs):
+        super().__init__(content, **kwargs)
+        self.file_path = file_path
+        self.offset = offset
+        self.count = count
+
+    async def __call__(self, scope, receive, send):
+        if 'http.response.zerocopysend' not in scope.get('extensions', {}):
+            await super().__call__(scope, receive, send)
+            return
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        with open(self.file_path, 'rb') as file:
+            # the extension takes the file object itself, the whole range is sent in this one message
+            await send(
+                {
+                    'type': 'http.response.zerocopysend',
+                    'file': file,
+                    'offset': self.offset,
+                    'count': self.count,
+                    'more_body': False,
+                }
+            )
+
+
+def range_response(
+    range_header: Optional[str],
+    if_range: Optional[str],
+    size: int,
+    read_range: RangeReader,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    media_type: str = 'application/octet-stream',
+    headers: Optional[Dict[str, str]] = None,
+    max_ranges: int = 16,
+    file_path: Optional[str] = None,
+) -> Response:
+    """Build a 200, 206 or 416 response for content of the given size.
+
+    A single range is sent as it is with Content-Range, several ranges as multipart/byteranges. Requests with
+    more than max_ranges ranges get the whole content. read_range is called here for the whole content or a
+    single range, but a generator reader only runs once the body is sent, after the status line and headers, so
+    anything that can fail (a missing file or object) has to be checked before. When the content is the local
+    file_path, those are sent as a FileRangeResponse.
+    """
+    headers = dict(headers or {})
+    headers['Accept-Ranges'] = 'bytes'
+    if etag:
+        headers['ETag'] = etag
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+
+    ranges = None
+    if if_range_matches(if_range, etag, last_modified):
+        try:
+            ranges = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            headers['Content-Range'] = f'bytes */{size}'
+            headers.pop('Content-Disposition', None)
+            return Response(status_code=416, headers=headers)
+    if ranges is not None and len(ranges) > max_ranges:
+        ranges = None
+
+    if ranges is None or len(ranges) == 1:
+        return _single_range_response(ranges, size, read_range, media_type, headers, file_path)
+    return _multipart_response(ranges, size, read_range, media_type, headers)
+
+
+def _single_range_response(
+    ranges: Optional[List[Tuple[int, int]]],
+    size: int,
+    read_range: RangeReader,
+    media_type: str,
+    headers: Dict[str, str],
+    file_path: Optional[str],
+) -> Response:
+    """the whole content as a 200 when ranges is None, otherwise its only range as a 206."""
+    if ranges is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = ranges[0], 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    content = read_range(start, end - start + 1)
+    if file_path is not None:
+        return FileRangeResponse(
+            content,
+            file_path,
+            start,
+            end - start + 1,
+            status_code=status_code,
+            media_type=media_type,
+            headers=headers,
+        )
+    return StreamingResponse(content, status_code=status_code, media_type=media_type, headers=headers)
+
+
+def _multipart_response(
+    ranges: List[Tuple[int, int]], size: int, read_range: RangeReader, media_type: str, headers: Dict[str, str]
+) -> Response:
+    boundary = uuid4().hex
+    parts = []
+    content_length = 0
+    for start, end in ranges:
+        part_header = (
+            f'--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        parts.append((part_header, start, end - start + 1))
+        content_length += len(part_header) + end - start + 1 + 2
+    closing = f'--{boundary}--\r\n'.encode()
+    headers['Content-Length'] = str(content_length + len(closing))
+    iter_multipart = _aiter_multipart if inspect.isasyncgenfunction(read_range) else _iter_multipart
+    return StreamingResponse(
+        iter_multipart(parts, closing, read_range),
+        status_code=206,
+        media_type=f'multipart/byteranges; boundary={boundary}',
+        headers=headers,
+    )
+
+
+def _iter_object_chunks(response, chunk_size: int) -> Iterator[bytes]:
+    try:
+        for chunk in response.stream(chunk_size):
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
+
+def object_range_response(
+    client,
+    bucket: str,
+    object_name: str,
+    range_header: Optional[str],
+    if_range: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+    max_ranges: int = 16,
+    chunk_size: int = 1024 * 1024,
+) -> Response:
+    """range_response for a minio object, every range is read with its own offset/length request."""
+    stat = client.stat_object(bucket, object_name)
+    last_modified = None
+    if stat.last_modified:
+        last_modified = formatdate(stat.last_modified.timestamp(), usegmt=True)
+
+    def read_range(offset: int, length: int) -> Iterator[bytes]:
+        response = client.get_object(bucket, object_name, offset=offset, length=length)
+        return _iter_object_chunks(response, chunk_size)
+
+    return range_response(
+        range_header,
+        if_range,
+        stat.size,
+        read_range,
+        etag=f'"{stat.etag}"' if stat.etag else None,
+        last_modified=last_modified,
+        headers=headers,
+        max_ranges=max_ranges,
+    )
+
+
+async def async_object_range_response(
+    reader,
+    range_header: Optional[str],
+    if_range: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+    max_ranges: int = 16,
+) -> Response:
+    """range_response for an AsyncObjectReader, the body is streamed on the event loop."""
+    stat = await reader.stat()
+    return range_response(
+        range_header,
+        if_range,
+        stat.size,
+        reader.read_range,
+        etag=stat.etag,
+        last_modified=stat.last_modified,
+        headers=headers,
+        max_ranges=max_ranges,
+    )
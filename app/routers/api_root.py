@@ -34,3 +34,4 @@ async def root():
         'name': ConfigClass.APP_NAME,
         'version': ConfigClass.VERSION,
     }
+
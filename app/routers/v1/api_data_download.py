@@ -18,15 +18,26 @@
 # permissions and limitations under the Licence.
 # 
 
+import mimetypes
 import os
+from fnmatch import fnmatchcase
+from functools import partial
+from typing import Optional
 
+import minio
 from fastapi import APIRouter
 from fastapi import Header
-from fastapi.responses import FileResponse
+from fastapi import Request
 from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
 
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.service_connection.async_object_stream import AsyncObjectReader
+from app.commons.service_connection.minio_client import Minio_Client
+from app.commons.status_stream import get_status_broadcaster
+from app.commons.status_stream import status_events
 from app.config import ConfigClass
 from app.models.base_models import APIResponse
 from app.models.base_models import EAPIResponseCode
@@ -37,10 +48,17 @@ from app.resources.download_token_manager import verify_download_token
 from app.resources.error_handler import ECustomizedError
 from app.resources.error_handler import catch_internal
 from app.resources.error_handler import customized_error_template
+from app.resources.file_offload import offload_response
 from app.resources.helpers import delete_by_session_id
 from app.resources.helpers import get_status
 from app.resources.helpers import set_status
 from app.resources.helpers import update_file_operation_logs
+from app.resources.range_requests import async_object_range_response
+from app.resources.range_requests import file_validators
+from app.resources.range_requests import iter_file_range
+from app.resources.range_requests import object_range_response
+from app.resources.range_requests import range_response
+from app.resources.range_requests import requests_first_byte
 
 router = APIRouter()
 
@@ -72,7 +90,7 @@ class APIDataDownload:
         """Fetch download status list."""
 
         response = APIResponse()
-        jobs_fetched = get_status(session_id, job_id, project_code, 'data_download', operator)
+        jobs_fetched = await run_in_threadpool(get_status, session_id, job_id, project_code, 'data_download', operator)
         if len(jobs_fetched) > 0:
             response.code = EAPIResponseCode.success
         else:
@@ -107,7 +125,7 @@ class APIDataDownload:
         job_id = res_verify_token['job_id']
         project_code = res_verify_token['project_code']
         operator = res_verify_token['operator']
-        job_fatched = get_status(session_id, job_id, project_code, 'data_download', operator)
+        job_fatched = await run_in_threadpool(get_status, session_id, job_id, project_code, 'data_download', operator)
         found = False
         self.__logger.info('job_fatched list: ' + str(job_fatched))
         self.__logger.info('res_verify_token: ' + str(res_verify_token))
@@ -131,14 +149,106 @@ class APIDataDownload:
             response.error_msg = customized_error_template(ECustomizedError.JOB_NOT_FOUND)
             return response.json_response()
 
+    @router.get(
+        '/downloads/status/stream',
+        tags=[_API_TAG],
+        summary='Stream the download status changes of a session as server-sent events',
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def data_download_status_list_stream(
+        self,
+        request: Request,
+        project_code: str,
+        operator: str,
+        job_id: str = '*',
+        session_id: str = Header(None),
+    ):
+        """Send the current status of the session jobs, then every change until the client disconnects."""
+
+        def accept(record: dict) -> bool:
+            return (
+                record['action'] == 'data_download'
+                and record['project_code'] == project_code
+                and record['operator'] == operator
+                and fnmatchcase(record['job_id'], job_id)
+            )
+
+        queue = await self._subscribe(session_id)
+        current = await run_in_threadpool(get_status, session_id, job_id, project_code, 'data_download', operator)
+        return self._event_stream(request, session_id, queue, current, accept)
+
+    @router.get(
+        '/download/status/{hash_code}/stream',
+        tags=[_API_TAG],
+        summary='Stream the status changes of a download job as server-sent events',
+    )
+    @catch_internal(_API_NAMESPACE)
+    async def data_download_status_stream(self, request: Request, hash_code: str):
+        """Send the current status of the job, then every change until it is ready, succeeded or cancelled."""
+
+        response = APIResponse()
+        res_verify_token = verify_download_token(hash_code)
+        if not res_verify_token[0]:
+            response.code = EAPIResponseCode.unauthorized
+            response.error_msg = res_verify_token[1]
+            return response.json_response()
+        res_verify_token = res_verify_token[1]
+        session_id = res_verify_token['session_id']
+        job_id = res_verify_token['job_id']
+
+        def accept(record: dict) -> bool:
+            return record['job_id'] == job_id and record['source'] == res_verify_token['full_path']
+
+        queue = await self._subscribe(session_id)
+        current = await run_in_threadpool(
+            get_status,
+            session_id,
+            job_id,
+            res_verify_token['project_code'],
+            'data_download',
+            res_verify_token['operator'],
+        )
+        current = [record for record in current if accept(record)]
+        if not current:
+            get_status_broadcaster().unsubscribe(session_id, queue)
+            response.code = EAPIResponseCode.not_found
+            response.error_msg = customized_error_template(ECustomizedError.JOB_NOT_FOUND)
+            return response.json_response()
+        final_statuses = (
+            EDataDownloadStatus.READY_FOR_DOWNLOADING.name,
+            EDataDownloadStatus.SUCCEED.name,
+            EDataDownloadStatus.CANCELLED.name,
+        )
+        return self._event_stream(request, session_id, queue, current, accept, final_statuses)
+
+    async def _subscribe(self, session_id):
+        """subscribe before the current status is read, so no change in between is missed."""
+        broadcaster = get_status_broadcaster()
+        queue = broadcaster.subscribe(session_id)
+        await run_in_threadpool(broadcaster.wait_subscribed, 5)
+        return queue
+
+    def _event_stream(self, request, session_id, queue, current, accept, final_statuses=()) -> StreamingResponse:
+        events = status_events(
+            request, session_id, queue, current, accept, final_statuses, ConfigClass.STATUS_STREAM_HEARTBEAT
+        )
+        # no buffering by nginx, the events are sent as they happen
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return StreamingResponse(events, media_type='text/event-stream', headers=headers)
+
     @router.get(
         '/download/{hash_code}',
         tags=[_API_TAG],
         summary='Download the data, asynchronously streams a file as the response.',
     )
     @catch_internal(_API_NAMESPACE)
-    async def data_download(self, hash_code: str):
-        """If succeed, asynchronously streams a FileResponse."""
+    async def data_download(
+        self,
+        hash_code: str,
+        range_header: Optional[str] = Header(None, alias='Range'),
+        if_range: Optional[str] = Header(None),
+    ):
+        """If succeed, asynchronously streams the file, honouring Range and If-Range."""
 
         response = APIResponse()
         self.__logger.info(f'Check downloading request: {hash_code}')
@@ -157,19 +267,84 @@ class APIDataDownload:
         # and use it to fetch the actual file
         full_path = res_verify_token['full_path']
 
-        # Use root to generate the path
-        if not os.path.exists(full_path):
-            self.__logger.error(f'File not found {full_path} in namespace {ConfigClass.namespace}')
-            response.code = EAPIResponseCode.not_found
-            response.result = None
-            response.error_msg = customized_error_template(ECustomizedError.FILE_NOT_FOUND) % full_path
-            return response.json_response()
-
         # this operation is needed since the file will be
         # download to nfs from minio then transfer to user
         filename = os.path.basename(full_path)
 
-        # Add Download Log
+        minio_location = res_verify_token.get('minio_location')
+        if minio_location:
+            # single file that was not staged, stream it from minio
+            try:
+                file_response = await self._object_response(minio_location, filename, range_header, if_range)
+            except minio.error.S3Error as e:
+                if e.code != 'NoSuchKey':
+                    raise
+                self.__logger.error(f'Object not found {minio_location}: {str(e)}')
+                return self._not_found(full_path)
+        elif not os.path.exists(full_path):
+            # Use root to generate the path
+            self.__logger.error(f'File not found {full_path} in namespace {ConfigClass.namespace}')
+            return self._not_found(full_path)
+        else:
+            file_response = self._file_response(full_path, filename, range_header, if_range)
+
+        # requests for later ranges are resumed or parallel parts of a download that was already logged
+        if file_response.status_code != 416 and requests_first_byte(range_header):
+            await run_in_threadpool(self.log_download, res_verify_token, full_path)
+        return file_response
+
+    def _not_found(self, full_path: str) -> JSONResponse:
+        response = APIResponse()
+        response.code = EAPIResponseCode.not_found
+        response.result = None
+        response.error_msg = customized_error_template(ECustomizedError.FILE_NOT_FOUND) % full_path
+        return response.json_response()
+
+    async def _object_response(
+        self, minio_location: str, filename: str, range_header: Optional[str], if_range: Optional[str]
+    ):
+        """response streaming the object at the minio location, minio's S3Error is raised when it is missing."""
+        _, bucket, object_name = tuple(minio_location.split('//')[-1].split('/', 2))
+        headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+        mc = Minio_Client()
+        if ConfigClass.ASYNC_OBJECT_STREAMING:
+            reader = AsyncObjectReader(mc.client, bucket, object_name, chunk_size=ConfigClass.ASYNC_STREAM_CHUNK_SIZE)
+            return await async_object_range_response(
+                reader, range_header, if_range, headers=headers, max_ranges=ConfigClass.DOWNLOAD_MAX_RANGES
+            )
+        return object_range_response(
+            mc.client,
+            bucket,
+            object_name,
+            range_header,
+            if_range,
+            headers=headers,
+            max_ranges=ConfigClass.DOWNLOAD_MAX_RANGES,
+            chunk_size=ConfigClass.DOWNLOAD_CHUNK_SIZE,
+        )
+
+    def _file_response(self, full_path: str, filename: str, range_header: Optional[str], if_range: Optional[str]):
+        """response sending the staged file, offloaded to the web server when it is configured for it."""
+        media_type = mimetypes.guess_type(filename)[0] or 'text/plain'
+        file_response = offload_response(full_path, filename, media_type)
+        if file_response is not None:
+            return file_response
+        etag, last_modified = file_validators(full_path)
+        return range_response(
+            range_header,
+            if_range,
+            os.path.getsize(full_path),
+            partial(iter_file_range, full_path, chunk_size=ConfigClass.DOWNLOAD_CHUNK_SIZE),
+            etag=etag,
+            last_modified=last_modified,
+            media_type=media_type,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+            max_ranges=ConfigClass.DOWNLOAD_MAX_RANGES,
+            file_path=full_path,
+        )
+
+    def log_download(self, res_verify_token: dict, full_path: str):
+        """add the download log and mark the job as succeeded."""
         update_file_operation_logs(
             res_verify_token['operator'],
             full_path,
@@ -205,8 +380,6 @@ class APIDataDownload:
 
         self.__logger.debug(status_update_res)
 
-        return FileResponse(path=full_path, filename=filename)
-
     @router.delete('/download/status', tags=[_API_TAG], summary='Delete the download session status.')
     @catch_internal(_API_NAMESPACE)
     async def clear_status(self, session_id: str = Header(None)):
@@ -218,7 +391,7 @@ class APIDataDownload:
             __res.result = {}
             __res.error_msg = 'Invalid Session ID: ' + str(session_id)
             return __res.json_response()
-        delete_by_session_id(session_id, action='data_download')
+        await run_in_threadpool(delete_by_session_id, session_id, action='data_download')
         __res.code = EAPIResponseCode.success
         __res.result = {'message': 'Success'}
         return __res.json_response()
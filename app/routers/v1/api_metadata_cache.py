@@ -0,0 +1,63 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
+
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.metadata_cache import get_metadata_cache
+from app.models.base_models import APIResponse
+from app.models.base_models import EAPIResponseCode
+from app.models.models_data_download import MetadataCacheInvalidatePOST
+from app.resources.error_handler import catch_internal
+
+router = APIRouter()
+
+_API_TAG = 'v1/metadata-cache'
+_API_NAMESPACE = 'api_metadata_cache'
+
+
+@cbv.cbv(router)
+class APIMetadataCache:
+    """Invalidation hook and metrics of the neo4j metadata cache."""
+
+    def __init__(self):
+        self.__logger = SrvLoggerFactory('api_metadata_cache').get_logger()
+
+    @router.post('/metadata-cache/invalidate', tags=[_API_TAG], summary='Drop cached nodes and folder listings')
+    @catch_internal(_API_NAMESPACE)
+    async def invalidate(self, data: MetadataCacheInvalidatePOST) -> JSONResponse:
+        """Called when nodes are moved, renamed, archived or folder contents change."""
+
+        api_response = APIResponse()
+        geids = await run_in_threadpool(get_metadata_cache().invalidate, data.geids)
+        self.__logger.info(f'Invalidated metadata cache of {len(geids)} geids')
+        api_response.result = geids
+        api_response.total = len(geids)
+        api_response.code = EAPIResponseCode.success
+        return api_response.json_response()
+
+    @router.get('/metadata-cache/stats', tags=[_API_TAG], summary='Hits and misses of this worker process')
+    @catch_internal(_API_NAMESPACE)
+    async def stats(self) -> JSONResponse:
+        api_response = APIResponse()
+        api_response.result = get_metadata_cache().stats.to_dict()
+        return api_response.json_response()
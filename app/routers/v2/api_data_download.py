@@ -21,7 +21,6 @@
 from typing import Optional
 from typing import Union
 
-import httpx
 from fastapi import APIRouter
 from fastapi import BackgroundTasks
 from fastapi import Header
@@ -30,10 +29,16 @@ from fastapi.responses import StreamingResponse
 from fastapi_utils import cbv
 from sqlalchemy import MetaData
 from sqlalchemy import create_engine
+from starlette.concurrency import run_in_threadpool
 
 from app.commons.download_manager import DownloadClient
+from app.commons.job_queue import enqueue_download_job
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.metadata_cache import NODE
+from app.commons.metadata_cache import get_metadata_cache
+from app.commons.service_connection.async_object_stream import AsyncObjectReader
 from app.commons.service_connection.minio_client import Minio_Client
+from app.commons.service_connection.upstream import get_upstream_client
 from app.config import ConfigClass
 from app.models.base_models import APIResponse
 from app.models.base_models import EAPIResponseCode
@@ -43,6 +48,8 @@ from app.models.models_data_download import PreDataDownloadPOST
 from app.models.models_data_download import PreDataDownloadResponse
 from app.resources.download_token_manager import verify_dataset_version_token
 from app.resources.error_handler import catch_internal
+from app.resources.range_requests import async_object_range_response
+from app.resources.range_requests import object_range_response
 from app.services.approval.client import ApprovalServiceClient
 
 router = APIRouter()
@@ -94,14 +101,19 @@ class APIDataDownload:
         else:
             object_geid = data.dataset_geid
             download_type = 'dataset_files'
-            with httpx.Client() as client:
-                res = client.get(ConfigClass.NEO4J_SERVICE + 'nodes/geid/' + data.dataset_geid)
+            cache = get_metadata_cache()
+            dataset = await run_in_threadpool(cache.get, NODE, data.dataset_geid)
+            if dataset is None:
+                res = await get_upstream_client('neo4j').aget(
+                    ConfigClass.NEO4J_SERVICE + 'nodes/geid/' + data.dataset_geid
+                )
                 if res.status_code != 200:
                     error_msg = 'Get dataset code error {}: {}'.format(res.status_code, res.text)
                     response.error_msg = error_msg
                     response.code = EAPIResponseCode.internal_error
                     return response.json_response()
-            dataset = res.json()
+                dataset = res.json()
+                await run_in_threadpool(cache.set, NODE, data.dataset_geid, dataset)
             object_code = dataset[0]['code']
 
         file_geids_to_include = None
@@ -112,7 +124,8 @@ class APIDataDownload:
             approval_service_client = ApprovalServiceClient(engine, metadata)
             request_approval_entities = approval_service_client.get_approval_entities(str(data.approval_request_id))
             file_geids_to_include = set(request_approval_entities.keys())
-        download_client = DownloadClient(
+        download_client = await run_in_threadpool(
+            DownloadClient,
             data.files,
             minio_token,
             data.operator,
@@ -121,13 +134,26 @@ class APIDataDownload:
             data.session_id,
             download_type,
             file_geids_to_include,
+            archive_format=data.archive_format.value,
         )
         hash_code = download_client.generate_hash_code()
-        status_result = download_client.set_status(EDataDownloadStatus.ZIPPING.name, payload={'hash_code': hash_code})
-        download_client.logger.info(f'Starting background job for: {data.project_code} {download_client.files_to_zip}')
+        if download_client.direct_download:
+            # single file is streamed from minio on download, nothing to prepare
+            await run_in_threadpool(download_client.check_direct_access)
+            status_result = await run_in_threadpool(download_client.direct_download_ready, hash_code)
+        else:
+            status_result = await run_in_threadpool(
+                download_client.set_status, EDataDownloadStatus.ZIPPING.name, payload={'hash_code': hash_code}
+            )
+            download_client.logger.info(
+                f'Starting background job for: {data.project_code} {download_client.files_to_zip}'
+            )
 
-        # start the background job for the zipping
-        background_tasks.add_task(download_client.zip_worker, hash_code)
+            # start the background job for the zipping
+            if ConfigClass.JOB_QUEUE_ENABLED:
+                await run_in_threadpool(enqueue_download_job, download_client, hash_code)
+            else:
+                background_tasks.add_task(download_client.zip_worker, hash_code)
         response.result = status_result
         response.code = EAPIResponseCode.success
         return response.json_response()
@@ -162,18 +188,23 @@ class APIDataDownload:
             },
         }
 
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(ConfigClass.NEO4J_SERVICE_V2 + 'relations/query', json=query)
-            res = await client.get(ConfigClass.NEO4J_SERVICE + 'nodes/geid/' + data.dataset_geid)
-            if resp.status_code != 200 or res.status_code != 200:
-                error_msg = 'Error when getting node for neo4j'
-                api_response.error_msg = error_msg
-                api_response.code = EAPIResponseCode.internal_error
-                return api_response.json_response()
+        cache = get_metadata_cache()
+        dataset = await run_in_threadpool(cache.get, NODE, data.dataset_geid)
+        client = get_upstream_client('neo4j')
+        resp = await client.apost(ConfigClass.NEO4J_SERVICE_V2 + 'relations/query', json=query, retry=True)
+        if dataset is None:
+            res = await client.aget(ConfigClass.NEO4J_SERVICE + 'nodes/geid/' + data.dataset_geid)
+            if res.status_code == 200:
+                dataset = res.json()
+                await run_in_threadpool(cache.set, NODE, data.dataset_geid, dataset)
+        if resp.status_code != 200 or dataset is None:
+            error_msg = 'Error when getting node for neo4j'
+            api_response.error_msg = error_msg
+            api_response.code = EAPIResponseCode.internal_error
+            return api_response.json_response()
 
-            nodes = resp.json()['results']
-            dataset = res.json()
-            dataset_code = dataset[0]['code']
+        nodes = resp.json()['results']
+        dataset_code = dataset[0]['code']
 
         files = []
         for node in nodes:
@@ -183,7 +214,8 @@ class APIDataDownload:
                 }
             )
 
-        download_client = DownloadClient(
+        download_client = await run_in_threadpool(
+            DownloadClient,
             files,
             minio_token,
             data.operator,
@@ -191,11 +223,17 @@ class APIDataDownload:
             data.dataset_geid,
             data.session_id,
             download_type='full_dataset',
+            archive_format=data.archive_format.value,
         )
         hash_code = download_client.generate_hash_code()
-        status_result = download_client.set_status(EDataDownloadStatus.ZIPPING.name, payload={'hash_code': hash_code})
+        status_result = await run_in_threadpool(
+            download_client.set_status, EDataDownloadStatus.ZIPPING.name, payload={'hash_code': hash_code}
+        )
         download_client.logger.info(f'Starting background job for: {dataset_code} {download_client.files_to_zip}')
-        background_tasks.add_task(download_client.zip_worker, hash_code)
+        if ConfigClass.JOB_QUEUE_ENABLED:
+            await run_in_threadpool(enqueue_download_job, download_client, hash_code)
+        else:
+            background_tasks.add_task(download_client.zip_worker, hash_code)
         download_client.update_activity_log(
             data.dataset_geid,
             data.dataset_geid,
@@ -211,12 +249,16 @@ class APIDataDownload:
         hash_code: str,
         authorization: Optional[str] = Header(None),
         refresh_token: Optional[str] = Header(None),
+        range_header: Optional[str] = Header(None, alias='Range'),
+        if_range: Optional[str] = Header(None),
     ) -> Union[StreamingResponse, JSONResponse]:
         """Download a specific version of a dataset given a hash_code Please note here, this hash code api is different
         with other async download this one will use the minio client to fetch the file and directly send to frontend.
         and in /dataset/download/pre it will ONLY take the hashcode.
 
         Other api like project files will use the /pre to download from minio and zip.
+
+        Range requests are passed to minio as offset and length, so only the requested bytes are read.
         """
 
         api_response = APIResponse()
@@ -234,12 +276,25 @@ class APIDataDownload:
 
         try:
             mc = Minio_Client()
-            result = mc.client.stat_object(bucket, file_path)
-            headers = {'Content-Length': str(result.size), 'Content-Disposition': f'attachment; filename={filename}'}
-            response = mc.client.get_object(bucket, file_path)
+            headers = {'Content-Disposition': f'attachment; filename={filename}'}
+            if ConfigClass.ASYNC_OBJECT_STREAMING:
+                reader = AsyncObjectReader(mc.client, bucket, file_path, chunk_size=ConfigClass.ASYNC_STREAM_CHUNK_SIZE)
+                return await async_object_range_response(
+                    reader, range_header, if_range, headers=headers, max_ranges=ConfigClass.DOWNLOAD_MAX_RANGES
+                )
+            return object_range_response(
+                mc.client,
+                bucket,
+                file_path,
+                range_header,
+                if_range,
+                headers=headers,
+                max_ranges=ConfigClass.DOWNLOAD_MAX_RANGES,
+                chunk_size=ConfigClass.DOWNLOAD_CHUNK_SIZE,
+            )
         except Exception as e:
             error_msg = f'Error getting file from minio: {str(e)}'
             self.__logger.error(error_msg)
             api_response.error_msg = error_msg
             return api_response.json_response()
-        return StreamingResponse(response.stream(), headers=headers)
+
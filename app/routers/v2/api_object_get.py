@@ -18,23 +18,29 @@
 # permissions and limitations under the Licence.
 # 
 
-import shutil
+import itertools
 import time
+from typing import Optional
 
-import httpx
 import minio
 from fastapi import APIRouter
 from fastapi import Header
 from fastapi.responses import FileResponse
 from fastapi.responses import StreamingResponse
 from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
 
+from app.commons.archive.parallel import make_zip_archive
+from app.commons.archive.zip_writer import stream_zip
 from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.segmented_download import get_segmented_downloader
+from app.commons.service_connection.async_object_stream import AsyncObjectReader
 from app.commons.service_connection.minio_client import Minio_Client_
+from app.commons.service_connection.upstream import get_upstream_client
 from app.config import ConfigClass
 from app.models.base_models import APIResponse
 from app.resources.error_handler import catch_internal
-from app.resources.helpers import get_files_recursive
+from app.resources.helpers import walk_folder_files
 
 router = APIRouter()
 
@@ -58,55 +64,109 @@ class APIObjectGet:
         zip_list = []
         query = {'global_entity_id': obj_geid}
         entity_type = 'File'
-        with httpx.Client() as client:
-            resp = client.post(ConfigClass.NEO4J_SERVICE + 'nodes/File/query', json=query)
+        resp = await get_upstream_client('neo4j').apost(
+            ConfigClass.NEO4J_SERVICE + 'nodes/File/query', json=query, retry=True
+        )
         # if not resp, consider it as a Folder
         json_respon = resp.json()
         if not json_respon:
             entity_type = 'Folder'
         # handle file stream
         if entity_type == 'Folder':
-            zip_list = pack_zip_list(self.__logger, obj_geid)
-            return folder_stream(self.__logger, zip_list, obj_geid, auth_token)
+            zip_list = await pack_zip_list(self.__logger, obj_geid)
+            return await folder_stream(self.__logger, zip_list, obj_geid, auth_token)
         elif entity_type == 'File':
             file_node = json_respon[0]
-            return file_stream(self.__logger, file_node, auth_token)
+            return await file_stream(self.__logger, file_node, auth_token)
 
 
-def file_stream(__logger, file_node, auth_token):
+async def file_stream(__logger, file_node, auth_token):
     try:
         location = file_node['location']
         minio_path = location.split('//')[-1]
         _, bucket, file_path = tuple(minio_path.split('/', 2))
         filename = file_path.split('/')[-1]
         mc = Minio_Client_(auth_token['at'], auth_token['rt'])
-        result = mc.client.stat_object(bucket, file_path)
+        if ConfigClass.ASYNC_OBJECT_STREAMING:
+            reader = AsyncObjectReader(mc.client, bucket, file_path, chunk_size=ConfigClass.ASYNC_STREAM_CHUNK_SIZE)
+            result = await reader.stat()
+            content = reader.read_range(0, result.size)
+        else:
+            result = mc.client.stat_object(bucket, file_path)
+            content = _iter_object_chunks(mc.client.get_object(bucket, file_path), ConfigClass.DOWNLOAD_CHUNK_SIZE)
         headers = {'Content-Length': str(result.size), 'Content-Disposition': f'attachment; filename={filename}'}
-        response = mc.client.get_object(bucket, file_path)
     except Exception as e:
         api_response = APIResponse()
         error_msg = f'Error getting file from minio: {str(e)}'
         __logger.error(error_msg)
         api_response.error_msg = error_msg
         return api_response.json_response()
-    return StreamingResponse(response.stream(), headers=headers)
+    return StreamingResponse(content, headers=headers)
 
 
-def folder_stream(__logger, zip_list, folder_name, auth_token):
-    tmp_folder = ConfigClass.MINIO_TMP_PATH + folder_name + '_' + str(time.time())
+async def folder_stream(__logger, zip_list, folder_name, auth_token):
     zip_name = folder_name + '.zip'
-    zipped_path = zip_worker(__logger, zip_list, tmp_folder, auth_token)
+    if ConfigClass.OBJECT_ZIP_STREAMING:
+        headers = {'Content-Disposition': f'attachment; filename={zip_name}'}
+        # the minio login and the first object are blocking calls, kept off the event loop
+        entries = await run_in_threadpool(open_zip_entries, __logger, zip_list, auth_token)
+        return StreamingResponse(
+            stream_zip(entries, chunk_size=ConfigClass.ZIP_STREAM_CHUNK_SIZE),
+            media_type='application/zip',
+            headers=headers,
+        )
+
+    tmp_folder = ConfigClass.MINIO_TMP_PATH + folder_name + '_' + str(time.time())
+    zipped_path = await run_in_threadpool(zip_worker, __logger, zip_list, tmp_folder, auth_token)
     return FileResponse(path=zipped_path, filename=zip_name)
 
 
-def pack_zip_list(__logger, obj_geid):
+def open_zip_entries(_logger, zip_list, auth_token):
+    """zip entries of the list with the first object already opened.
+
+    Opening it before the response starts lets minio errors still be reported with a proper status code.
+    """
+    mc = Minio_Client_(auth_token['at'], auth_token['rt'])
+    entries = iter_zip_entries(_logger, zip_list, mc)
+    first_entry = next(entries, None)
+    if first_entry is not None:
+        entries = itertools.chain([first_entry], entries)
+    return entries
+
+
+def iter_zip_entries(_logger, zip_list, mc):
+    """yield (arcname, size, chunks) for every object in the list, objects are opened one at a time."""
+    for obj in zip_list:
+        # minio location is minio://http://<end_point>/bucket/user/object_path
+        minio_path = obj['location'].split('//')[-1]
+        _, bucket, obj_path = tuple(minio_path.split('/', 2))
+        try:
+            response = mc.client.get_object(bucket, obj_path)
+        except minio.error.S3Error as e:
+            if e.code == 'NoSuchKey':
+                _logger.info('File not found, skipping: ' + str(e))
+                continue
+            else:
+                raise e
+        content_length = response.headers.get('Content-Length')
+        size = int(content_length) if content_length else None
+        yield obj_path, size, _iter_object_chunks(response)
+
+
+def _iter_object_chunks(response, chunk_size: Optional[int] = None):
+    """body of a minio response, the connection goes back to the pool however the iteration ends."""
+    try:
+        for chunk in response.stream(chunk_size or ConfigClass.ZIP_STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
+
+async def pack_zip_list(__logger, obj_geid):
     cache = []
     __logger.info('Getting folder from geid: ' + str(obj_geid))
-    all_files = []
-    __logger.info('Got files from folder:' + str(all_files))
-    all_files = get_files_recursive(obj_geid)
-    __logger.info(f'Got files from folder after filter: {all_files}')
-    for node in all_files:
+    async for node in walk_folder_files(obj_geid, ConfigClass.NEO4J_WALK_CONCURRENCY):
         __logger.info('file node archived: ' + str(node.get('archived', False)))
         if node.get('archived', False):
             __logger.info('file node archived skipped' + str(node))
@@ -117,6 +177,7 @@ def pack_zip_list(__logger, obj_geid):
                 'geid': node['global_entity_id'],
                 'project_code': node.get('project_code', ''),
                 'parent_folder': obj_geid,
+                'file_size': node.get('file_size'),
             }
         )
     return cache
@@ -126,21 +187,26 @@ def zip_worker(_logger, zip_list, tmp_folder, auth_token):
     """async zip worker."""
     try:
         mc = Minio_Client_(auth_token['at'], auth_token['rt'])
+        downloader = get_segmented_downloader(mc.client, _logger)
         # download all file to tmp folder
         for obj in zip_list:
             # minio location is minio://http://<end_point>/bucket/user/object_path
             minio_path = obj['location'].split('//')[-1]
             _, bucket, obj_path = tuple(minio_path.split('/', 2))
             try:
-                mc.client.fget_object(bucket, obj_path, tmp_folder + '/' + obj_path)
+                downloader.download(bucket, obj_path, tmp_folder + '/' + obj_path, size=obj.get('file_size'))
             except minio.error.S3Error as e:
                 if e.code == 'NoSuchKey':
                     _logger.info('File not found, skipping: ' + str(e))
                     continue
                 else:
                     raise e
-        shutil.make_archive(tmp_folder, 'zip', tmp_folder)
-        disk_full_path = tmp_folder + '.zip'
+        disk_full_path = make_zip_archive(
+            tmp_folder,
+            tmp_folder,
+            workers=ConfigClass.ZIP_COMPRESSION_WORKERS,
+            chunk_size=ConfigClass.ZIP_STREAM_CHUNK_SIZE,
+        )
         return disk_full_path
     except Exception:
         raise
@@ -0,0 +1,111 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+from typing import Optional
+
+import minio
+from fastapi import APIRouter
+from fastapi import Header
+from fastapi.responses import JSONResponse
+from fastapi_utils import cbv
+from starlette.concurrency import run_in_threadpool
+
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.presigned_url import get_presigned_url_issuer
+from app.commons.service_connection.minio_client import Minio_Client_
+from app.config import ConfigClass
+from app.models.base_models import APIResponse
+from app.models.base_models import EAPIResponseCode
+from app.models.models_data_download import PreSignedBatchDownload
+from app.models.models_data_download import PreSignedDownload
+from app.resources.error_handler import catch_internal
+
+router = APIRouter()
+
+_API_TAG = 'v2/data-download'
+_API_NAMESPACE = 'api_data_download'
+
+
+@cbv.cbv(router)
+class APIPresignedDownload:
+    """Hand out presigned minio urls so the file content does not go through this service."""
+
+    def __init__(self):
+        self.__logger = SrvLoggerFactory('api_data_download').get_logger()
+
+    @router.post('/object/presigned', tags=[_API_TAG], summary='Presigned download url for one object')
+    @catch_internal(_API_NAMESPACE)
+    async def presigned_download(
+        self,
+        data: PreSignedDownload,
+        authorization: Optional[str] = Header(None),
+        refresh_token: Optional[str] = Header(None),
+    ) -> JSONResponse:
+        """Check the user can read the object and return a time limited url for it."""
+
+        api_response = APIResponse()
+        issuer = get_presigned_url_issuer(authorization, lambda: Minio_Client_(authorization, refresh_token))
+        try:
+            # redis, keycloak and minio are all blocking calls
+            api_response.result = await run_in_threadpool(issuer.get_url, data.object_path)
+        except ValueError as e:
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = str(e)
+        except minio.error.S3Error as e:
+            self.__logger.error(f'Error presigning {data.object_path}: {str(e)}')
+            if e.code in ('NoSuchKey', 'NoSuchBucket'):
+                api_response.code = EAPIResponseCode.not_found
+            elif e.code == 'AccessDenied':
+                api_response.code = EAPIResponseCode.forbidden
+            else:
+                api_response.code = EAPIResponseCode.internal_error
+            api_response.error_msg = f'Error getting file from minio: {str(e)}'
+        return api_response.json_response()
+
+    @router.post('/object/presigned/batch', tags=[_API_TAG], summary='Presigned download urls for many objects')
+    @catch_internal(_API_NAMESPACE)
+    async def presigned_batch_download(
+        self,
+        data: PreSignedBatchDownload,
+        authorization: Optional[str] = Header(None),
+        refresh_token: Optional[str] = Header(None),
+    ) -> JSONResponse:
+        """Return a time limited url for every object path.
+
+        The objects are not checked one by one, the urls are signed with the user's credentials so minio refuses
+        the ones they cannot read.
+        """
+
+        api_response = APIResponse()
+        if len(data.object_path) > ConfigClass.PRESIGNED_URL_BATCH_LIMIT:
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = f'At most {ConfigClass.PRESIGNED_URL_BATCH_LIMIT} objects per request'
+            return api_response.json_response()
+
+        issuer = get_presigned_url_issuer(authorization, lambda: Minio_Client_(authorization, refresh_token))
+        try:
+            urls = await run_in_threadpool(issuer.get_urls, [str(path) for path in data.object_path])
+        except ValueError as e:
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = str(e)
+            return api_response.json_response()
+        api_response.result = list(urls.values())
+        api_response.total = len(urls)
+        return api_response.json_response()
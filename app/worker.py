@@ -0,0 +1,71 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import argparse
+import signal
+
+from app.commons.data_providers.redis import close_redis_client
+from app.commons.job_queue import JobWorker
+from app.commons.locks import start_lease_sweeper
+from app.commons.locks import stop_lease_sweeper
+from app.commons.logger_services.logger_factory_service import SrvLoggerFactory
+from app.commons.service_connection.upstream import reset_upstream_clients
+from app.config import ConfigClass
+
+_logger = SrvLoggerFactory('job_worker').get_logger()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the zip jobs queued by the download api.')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=ConfigClass.JOB_WORKER_CONCURRENCY,
+        help='jobs run at the same time by this process',
+    )
+    args = parser.parse_args(argv)
+
+    worker = JobWorker(
+        args.concurrency,
+        ConfigClass.JOB_LEASE_TTL,
+        ConfigClass.JOB_HEARTBEAT_INTERVAL,
+        ConfigClass.JOB_POLL_INTERVAL,
+        ConfigClass.JOB_MAX_ATTEMPTS,
+        ConfigClass.JOB_MAX_AGE,
+    )
+
+    def stop(signum, frame):
+        _logger.info(f'Received signal {signum}, no new job is claimed')
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    start_lease_sweeper()
+    try:
+        worker.run()
+    finally:
+        stop_lease_sweeper()
+        reset_upstream_clients()
+        close_redis_client()
+
+
+if __name__ == '__main__':
+    main()
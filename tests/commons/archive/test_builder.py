@@ -0,0 +1,162 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import hashlib
+import os
+import tarfile
+import zipfile
+from io import BytesIO
+
+import minio
+import pytest
+from urllib3 import HTTPResponse
+
+from app.commons.archive.builder import ArchiveBuilder
+
+
+class FakeMinio:
+    def __init__(self, objects):
+        self.objects = objects
+        self.breaks = {}
+        self.requests = []
+
+    def get_object(self, bucket, object_name, offset=0, request_headers=None):
+        content = self.objects[object_name]
+        if isinstance(content, Exception):
+            raise content
+        self.requests.append((object_name, offset, request_headers))
+        body = BrokenBody(content, self.breaks.pop(object_name)) if object_name in self.breaks else BytesIO(content)
+        body.seek(offset)
+        headers = {'Content-Length': str(len(content) - offset), 'ETag': '"etag"'}
+        return HTTPResponse(body=body, headers=headers, preload_content=False)
+
+
+class BrokenBody(BytesIO):
+    """body failing once it was read up to position."""
+
+    def __init__(self, content, position):
+        super().__init__(content)
+        self.position = position
+
+    def read(self, size=-1):
+        if self.tell() >= self.position:
+            raise ConnectionResetError('connection reset')
+        size = self.position - self.tell() if size is None or size < 0 else min(size, self.position - self.tell())
+        return super().read(size)
+
+
+class FakeMinioClient:
+    def __init__(self, objects):
+        self.client = FakeMinio(objects)
+
+
+def s3_error(code):
+    return minio.error.S3Error(
+        code=code, message='any msg', resource='any', request_id='any', host_id='any', response='error'
+    )
+
+
+def test_archive_builder_should_write_objects_in_order_and_skip_missing(tmp_path):
+    objects = {f'folder/file_{i}': b'%d' % i * 1000 for i in range(20)}
+    objects['folder/missing'] = s3_error('NoSuchKey')
+    path = str(tmp_path / 'result.zip')
+
+    with ArchiveBuilder(path, FakeMinioClient(objects), workers=3, read_ahead=2, chunk_size=100) as archive:
+        stats = archive.add_objects((name, 'bucket', name) for name in objects)
+        archive.add_bytes('schema.json', b'{}')
+
+    assert stats.files == 20
+    assert stats.skipped == 1
+    result = zipfile.ZipFile(path)
+    assert result.namelist() == [f'folder/file_{i}' for i in range(20)] + ['schema.json']
+    assert result.read('folder/file_7') == b'7' * 1000
+    assert not os.path.exists(path + '.part')
+
+
+def test_archive_builder_should_shrink_read_ahead_window_to_byte_budget(tmp_path):
+    objects = {f'file_{i}': b'x' * 250 for i in range(5)}
+    path = str(tmp_path / 'result.zip')
+
+    builder = ArchiveBuilder(path, FakeMinioClient(objects), workers=4, read_ahead=2, chunk_size=100, byte_budget=450)
+    with builder as archive:
+        stats = archive.add_objects((name, 'bucket', name) for name in objects)
+
+    assert builder.window == 2
+    assert stats.files == 5
+    assert zipfile.ZipFile(path).namelist() == list(objects)
+
+
+def test_archive_builder_should_remove_partial_archive_when_minio_fails(tmp_path):
+    objects = {'file_1': b'content', 'file_2': s3_error('AccessDenied')}
+    path = str(tmp_path / 'result.zip')
+
+    with pytest.raises(minio.error.S3Error):
+        with ArchiveBuilder(path, FakeMinioClient(objects), workers=2) as archive:
+            archive.add_objects((name, 'bucket', name) for name in objects)
+
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.part')
+
+
+@pytest.mark.parametrize('archive_format,mode', [('tar', 'r:'), ('tar.gz', 'r:gz')])
+def test_archive_builder_should_write_tar_archive(tmp_path, archive_format, mode):
+    objects = {'folder/file_1': b'content', 'folder/missing': s3_error('NoSuchKey')}
+    path = str(tmp_path / f'result.{archive_format}')
+
+    with ArchiveBuilder(path, FakeMinioClient(objects), archive_format=archive_format) as archive:
+        archive.add_objects((name, 'bucket', name) for name in objects)
+        archive.add_bytes('schema.json', b'{}')
+
+    result = tarfile.open(path, mode=mode)
+    assert result.getnames() == ['folder/file_1', 'schema.json']
+    assert result.extractfile('folder/file_1').read() == b'content'
+
+
+def test_archive_builder_should_write_checksum_manifest_and_archive_digest(tmp_path):
+    objects = {'folder/file_1': b'content', 'folder/file_2': b'other content'}
+    path = str(tmp_path / 'result.zip')
+
+    with ArchiveBuilder(path, FakeMinioClient(objects), chunk_size=3, checksums=True) as archive:
+        archive.add_objects((name, 'bucket', name) for name in objects)
+        archive.add_bytes('schema.json', b'{}')
+
+    with open(path, 'rb') as file:
+        assert archive.sha256 == hashlib.sha256(file.read()).hexdigest()
+    result = zipfile.ZipFile(path)
+    assert result.read('MANIFEST.sha256').decode() == ''.join(
+        f'{hashlib.sha256(content).hexdigest()}  {name}\n'
+        for name, content in [('folder/file_1', b'content'), ('folder/file_2', b'other content'), ('schema.json', b'{}')]
+    )
+    assert result.read('MANIFEST.md5').decode().splitlines()[0] == f'{hashlib.md5(b"content").hexdigest()}  folder/file_1'
+
+
+def test_archive_builder_should_resume_object_when_read_fails_midway(tmp_path):
+    content = os.urandom(1000)
+    minio_client = FakeMinioClient({'a.bin': content})
+    minio_client.client.breaks['a.bin'] = 300
+    path = str(tmp_path / 'result.zip')
+
+    with ArchiveBuilder(path, minio_client, chunk_size=100, retries=1, retry_backoff=0) as archive:
+        stats = archive.add_objects([('a.bin', 'bucket', 'a.bin')])
+
+    assert stats.retries == 1
+    assert minio_client.client.requests == [('a.bin', 0, None), ('a.bin', 300, {'If-Match': '"etag"'})]
+    with zipfile.ZipFile(path) as archive_file:
+        assert archive_file.read('a.bin') == content
@@ -0,0 +1,55 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+
+import pytest
+
+from app.commons.archive.compression_policy import CompressionPolicy
+from app.commons.archive.zip_writer import ZIP_DEFLATED
+from app.commons.archive.zip_writer import ZIP_STORED
+
+
+@pytest.mark.parametrize(
+    'arcname,size,sample,expected',
+    [
+        ('scan.nii.gz', 10000, b'a' * 4096, (ZIP_STORED, 'extension')),
+        ('PHOTO.JPG', 10000, b'a' * 4096, (ZIP_STORED, 'extension')),
+        ('tiny.txt', 10, b'a' * 10, (ZIP_STORED, 'size')),
+        ('random.bin', 10000, os.urandom(4096), (ZIP_STORED, 'probe')),
+        ('table.csv', 10000, b'1,2,3\n' * 1000, (ZIP_DEFLATED, 'probe')),
+        ('empty_sample.csv', None, b'', (ZIP_DEFLATED, 'default')),
+    ],
+)
+def test_compression_policy_should_decide_by_extension_size_and_probe(arcname, size, sample, expected):
+    policy = CompressionPolicy(stored_extensions=['.gz', '.jpg'], store_below_size=128)
+    assert policy.decide(arcname, size, sample) == expected
+
+
+def test_compression_policy_should_record_decisions():
+    policy = CompressionPolicy(stored_extensions=['.gz'], store_below_size=128)
+    policy.decide('a.gz', 1000, b'')
+    policy.decide('b.txt', 2000, b'text ' * 100)
+
+    assert policy.stats.to_dict() == {
+        'stored': {'files': 1, 'bytes': 1000},
+        'deflated': {'files': 1, 'bytes': 2000},
+        'reasons': {'extension': 1, 'probe': 1},
+    }
@@ -0,0 +1,65 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import io
+import os
+import zipfile
+
+from app.commons.archive.parallel import ParallelZipWriter
+from app.commons.archive.parallel import deflate_chunk
+from app.commons.archive.parallel import get_compression_executor
+from app.commons.archive.parallel import make_zip_archive
+from app.commons.archive.zip_writer import ZIP_STORED
+
+
+def test_parallel_zip_writer_should_stitch_chunks_into_valid_members():
+    content = os.urandom(10000) * 20 + b'text ' * 50000
+    output = io.BytesIO()
+    writer = ParallelZipWriter(output, get_compression_executor(2), chunk_size=30000, window=3)
+    writer.write_entry('big', [content[i : i + 7000] for i in range(0, len(content), 7000)], size=len(content))
+    writer.write_entry('empty', [], size=0)
+    writer.write_entry('stored', [b'raw'], size=3, compress_type=ZIP_STORED)
+    writer.close()
+
+    archive = zipfile.ZipFile(io.BytesIO(output.getvalue()))
+    assert archive.testzip() is None
+    assert archive.read('big') == content
+    assert archive.getinfo('big').compress_size < len(content)
+    assert archive.read('empty') == b''
+    assert archive.read('stored') == b'raw'
+
+
+def test_deflate_chunk_should_use_previous_tail_as_dictionary():
+    chunk = os.urandom(20000)
+    assert len(deflate_chunk(chunk, 6, zdict=chunk)) < len(deflate_chunk(chunk, 6))
+
+
+def test_make_zip_archive_should_zip_folder_with_relative_names(tmp_path):
+    root = tmp_path / 'folder'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'a.txt').write_bytes(b'a')
+    (root / 'sub' / 'b.txt').write_bytes(b'b' * 5000)
+
+    archive_name = make_zip_archive(str(tmp_path / 'result'), str(root), workers=2, chunk_size=1000)
+
+    archive = zipfile.ZipFile(archive_name)
+    assert archive_name.endswith('result.zip')
+    assert sorted(archive.namelist()) == ['a.txt', 'sub/b.txt']
+    assert archive.read('sub/b.txt') == b'b' * 5000
@@ -0,0 +1,65 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import io
+import tarfile
+
+import pytest
+
+from app.commons.archive.tar_writer import TarWriter
+
+
+@pytest.mark.parametrize('compression,mode', [('', 'r:'), ('gz', 'r:gz')])
+def test_tar_writer_should_produce_archive_readable_by_tarfile(compression, mode):
+    output = io.BytesIO()
+    writer = TarWriter(output, compression)
+    long_name = 'folder/' + 'a' * 150 + '/file.txt'
+    writer.write_entry(long_name, [b'hello ' * 100, b'world'], size=605)
+    writer.write_entry('unknown_size', iter([b'b' * 1000]))
+    writer.close()
+
+    archive = tarfile.open(fileobj=io.BytesIO(output.getvalue()), mode=mode)
+    assert archive.getnames() == [long_name, 'unknown_size']
+    assert archive.extractfile(long_name).read() == b'hello ' * 100 + b'world'
+    assert archive.extractfile('unknown_size').read() == b'b' * 1000
+
+
+def test_tar_writer_should_produce_zstd_compressed_archive():
+    zstandard = pytest.importorskip('zstandard')
+    output = io.BytesIO()
+    writer = TarWriter(output, 'zst', zstd_threads=0)
+    writer.write_entry('file.txt', [b'content'], size=7)
+    writer.close()
+
+    data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(output.getvalue())).read()
+    archive = tarfile.open(fileobj=io.BytesIO(data), mode='r:')
+    assert archive.extractfile('file.txt').read() == b'content'
+
+
+def test_tar_writer_should_raise_exception_when_size_does_not_match():
+    writer = TarWriter(io.BytesIO())
+    writer.start_entry('any', size=3)
+    with pytest.raises(ValueError):
+        writer.write(b'too long')
+    writer = TarWriter(io.BytesIO())
+    writer.start_entry('any', size=3)
+    writer.write(b'a')
+    with pytest.raises(ValueError):
+        writer.finish_entry()
@@ -0,0 +1,73 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import io
+import zipfile
+
+import pytest
+
+from app.commons.archive.zip_writer import ZIP_STORED
+from app.commons.archive.zip_writer import ZipWriter
+from app.commons.archive.zip_writer import stream_zip
+
+
+def test_zip_writer_should_produce_archive_readable_by_zipfile():
+    output = io.BytesIO()
+    writer = ZipWriter(output)
+    writer.write_entry('folder/file.txt', [b'hello ' * 100, b'world'], size=605)
+    writer.write_entry('stored', [b'raw'], size=3, compress_type=ZIP_STORED)
+    writer.close()
+
+    archive = zipfile.ZipFile(io.BytesIO(output.getvalue()))
+    assert archive.testzip() is None
+    assert archive.read('folder/file.txt') == b'hello ' * 100 + b'world'
+    assert archive.getinfo('stored').compress_type == ZIP_STORED
+
+
+def test_zip_writer_should_use_zip64_when_size_is_unknown():
+    output = io.BytesIO()
+    writer = ZipWriter(output)
+    entry = writer.write_entry('unknown_size', iter([b'a' * 1000]))
+    writer.close()
+
+    assert entry.zip64
+    assert zipfile.ZipFile(io.BytesIO(output.getvalue())).read('unknown_size') == b'a' * 1000
+
+
+def test_zip_writer_should_raise_exception_when_entry_not_finished():
+    writer = ZipWriter(io.BytesIO())
+    writer.start_entry('any')
+    with pytest.raises(ValueError):
+        writer.start_entry('other')
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_stream_zip_should_return_empty_archive_when_no_entries():
+    assert b''.join(stream_zip([])) == b'PK\x05\x06' + b'\x00' * 18
+
+
+def test_stream_zip_should_yield_pieces_while_entry_is_written():
+    chunks = (b'%d' % i * 1000 for i in range(100))
+    pieces = list(stream_zip([('big', None, chunks)], chunk_size=1024, compress_type=ZIP_STORED))
+
+    assert len(pieces) > 1
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(pieces)))
+    assert archive.read('big') == b''.join(b'%d' % i * 1000 for i in range(100))
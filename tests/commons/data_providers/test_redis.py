@@ -0,0 +1,41 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.data_providers.redis import close_redis_client
+from app.commons.data_providers.redis import get_redis_client
+
+
+def test_srv_redis_singleton_should_share_one_connection_pool():
+    close_redis_client()
+    first, second = SrvRedisSingleton(), SrvRedisSingleton()
+    first.set_by_key('key', 'value')
+
+    assert second.get_by_key('key') == b'value'
+    assert first._SrvRedisSingleton__instance is second._SrvRedisSingleton__instance is get_redis_client()
+
+
+def test_claim_from_sorted_set_should_claim_due_members_once():
+    redis = SrvRedisSingleton()
+    redis.add_to_sorted_set('queue', {'first': 1, 'second': 2, 'later': 50})
+
+    assert redis.claim_from_sorted_set('queue', 10, 100) == 'first'
+    assert redis.claim_from_sorted_set('queue', 10, 100) == 'second'
+    assert redis.claim_from_sorted_set('queue', 10, 100) is None
+    assert redis.get_sorted_set_size('queue') == 3
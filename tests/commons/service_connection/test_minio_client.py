@@ -0,0 +1,53 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+from datetime import datetime
+from datetime import timedelta
+
+from app.commons.service_connection.minio_client import Minio_Client
+from app.commons.service_connection.minio_client import parse_sts_expiration
+from app.config import ConfigClass
+
+
+def test_minio_client_should_presign_without_asking_for_bucket_location_when_region_is_set(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'MINIO_REGION', 'us-east-1')
+    client = Minio_Client().client
+
+    def urlopen(*args, **kwargs):
+        raise AssertionError('presigning must not send a request')
+
+    monkeypatch.setattr(client._http, 'urlopen', urlopen)
+
+    url = client.get_presigned_url('GET', 'bucket', 'obj/path', expires=timedelta(seconds=60))
+
+    assert 'bucket/obj/path' in url
+    assert 'us-east-1' in url
+
+
+def test_parse_sts_expiration_should_read_expiry_of_credentials():
+    body = (
+        b'<AssumeRoleWithClientGrantsResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">'
+        b'<AssumeRoleWithClientGrantsResult><Credentials><AccessKeyId>key</AccessKeyId>'
+        b'<Expiration>2022-01-01T10:00:00Z</Expiration></Credentials></AssumeRoleWithClientGrantsResult>'
+        b'</AssumeRoleWithClientGrantsResponse>'
+    )
+
+    assert parse_sts_expiration(body) == datetime(2022, 1, 1, 10, 0, 0)
+    assert parse_sts_expiration(b'not xml') is None
@@ -0,0 +1,94 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import httpx
+import pytest
+
+from app.commons.service_connection.upstream import CircuitBreaker
+from app.commons.service_connection.upstream import CircuitOpenError
+from app.commons.service_connection.upstream import UpstreamClient
+from app.commons.service_connection.upstream import get_upstream_client
+
+
+def test_upstream_client_should_retry_unavailable_service(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://service/node', status_code=503)
+    httpx_mock.add_response(method='GET', url='http://service/node', json={'code': 200})
+    client = UpstreamClient('neo4j', retries=2, backoff=0)
+
+    response = client.get('http://service/node')
+
+    assert response.json() == {'code': 200}
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_upstream_client_should_not_retry_post_unless_asked(httpx_mock):
+    httpx_mock.add_response(method='POST', url='http://service/lock', status_code=503)
+    client = UpstreamClient('data_ops', retries=2, backoff=0)
+
+    response = client.post('http://service/lock', json={})
+
+    assert response.status_code == 503
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_upstream_client_should_open_circuit_after_failures(httpx_mock):
+    httpx_mock.add_response(method='GET', url='http://service/node', status_code=500)
+    client = UpstreamClient('neo4j', retries=0, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+
+    client.get('http://service/node')
+    client.get('http://service/node')
+    with pytest.raises(CircuitOpenError):
+        client.get('http://service/node')
+
+    assert client.breaker.state == 'open'
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_circuit_breaker_should_close_after_successful_trial():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == 'closed'
+
+
+def test_circuit_open_error_should_be_handled_as_http_error():
+    assert issubclass(CircuitOpenError, httpx.HTTPError)
+
+
+def test_get_upstream_client_should_reuse_the_pool():
+    client = get_upstream_client('neo4j')
+
+    assert get_upstream_client('neo4j') is client
+    assert client.client is client.client
+    with pytest.raises(ValueError):
+        get_upstream_client('unknown')
+
+
+async def test_upstream_client_should_retry_transport_errors_async(httpx_mock, anyio_backend):
+    httpx_mock.add_exception(httpx.ConnectError('refused'), method='POST', url='http://service/query')
+    httpx_mock.add_response(method='POST', url='http://service/query', json={'results': []})
+    client = UpstreamClient('neo4j', retries=1, backoff=0)
+
+    response = await client.apost('http://service/query', json={}, retry=True)
+
+    assert response.json() == {'results': []}
+    await client.aclose()
@@ -18,12 +18,15 @@
 # permissions and limitations under the Licence.
 # 
 
+import json
+import threading
 from unittest import mock
 
 import minio
 import pytest
 
 from app.commons.download_manager import DownloadClient
+from app.config import ConfigClass
 from app.resources.error_handler import APIException
 
 
@@ -71,7 +74,7 @@ def test_zip_worker_set_status_READY_FOR_DOWNLOADING_when_success(httpx_mock, mo
     )
     with mock.patch.object(DownloadClient, 'set_status') as fake_set:
         download_client.zip_worker('fake_hash')
-    fake_set.assert_called_once_with('READY_FOR_DOWNLOADING', payload={'hash_code': 'fake_hash'})
+    fake_set.assert_called_once_with('READY_FOR_DOWNLOADING', payload={'hash_code': 'fake_hash'}, progress=100)
 
 
 def test_zip_worker_set_status_CANCELLED_when_success(httpx_mock):
@@ -119,7 +122,7 @@ def test_zip_worker_set_status_CANCELLED_when_success(httpx_mock):
                 },
             },
         ),
-        ('NoSuchKey', {'status': 'READY_FOR_DOWNLOADING', 'payload': {'hash_code': 'fake_hash'}}),
+        ('NoSuchKey', {'status': 'READY_FOR_DOWNLOADING', 'payload': {'hash_code': 'fake_hash'}, 'progress': 100}),
     ],
 )
 def test_zip_worker_raise_exception_when_minio_return_error(mock_minio, httpx_mock, exception_code, result):
@@ -153,7 +156,8 @@ def test_zip_worker_raise_exception_when_minio_return_error(mock_minio, httpx_mo
     )
     with mock.patch.object(DownloadClient, 'set_status') as fake_set:
         download_client.zip_worker('fake_hash')
-    fake_set.assert_called_once_with(result['status'], payload=result['payload'])
+    kwargs = {'progress': result['progress']} if 'progress' in result else {}
+    fake_set.assert_called_once_with(result['status'], payload=result['payload'], **kwargs)
 
 
 def test_zip_worker_full_dataset_set_status_READY_FOR_DOWNLOADING_when_success(httpx_mock, mock_minio):
@@ -189,4 +193,232 @@ def test_zip_worker_full_dataset_set_status_READY_FOR_DOWNLOADING_when_success(h
     )
     with mock.patch.object(DownloadClient, 'set_status') as fake_set:
         download_client.zip_worker('fake_hash')
-    fake_set.assert_called_once_with('READY_FOR_DOWNLOADING', payload={'hash_code': 'fake_hash'})
+    fake_set.assert_called_once_with(
+        'READY_FOR_DOWNLOADING',
+        payload={
+            'hash_code': 'fake_hash',
+            'compression': {
+                'stored': {'files': 3, 'bytes': 18},
+                'deflated': {'files': 2, 'bytes': 374},
+                'reasons': {'probe': 3, 'size': 2},
+            },
+            'sha256': mock.ANY,
+        },
+        progress=100,
+    )
+
+
+def test_zip_worker_should_report_zipping_progress(httpx_mock, mock_minio, monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'PROGRESS_UPDATE_INTERVAL', 0)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://neo4j_service/v1/neo4j/nodes/geid/geid_1',
+        json=[
+            {
+                'labels': ['File'],
+                'global_entity_id': 'geid_2',
+                'location': 'http://anything.com/bucket/obj/path',
+                'display_path': 'display_path',
+                'uploader': 'test',
+            }
+        ],
+    )
+    httpx_mock.add_response(
+        method='POST',
+        url='http://dataset_service/v1/schema/list',
+        status_code=200,
+        json={'result': []},
+    )
+    httpx_mock.add_response(method='POST', url='http://data_ops_util/v2/resource/lock/', status_code=200, json={})
+    httpx_mock.add_response(method='DELETE', url='http://data_ops_util/v2/resource/lock/', status_code=200, json={})
+    download_client = DownloadClient(
+        files=[{'geid': 'geid_1'}],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+        download_type='full_dataset',
+    )
+    with mock.patch.object(DownloadClient, 'set_status') as fake_set:
+        download_client.zip_worker('fake_hash')
+
+    zipping = [call for call in fake_set.call_args_list if call.args[0] == 'ZIPPING']
+    assert zipping
+    payload = zipping[-1].kwargs['payload']
+    assert payload['hash_code'] == 'fake_hash'
+    assert payload['bytes_total'] == payload['bytes_done'] == 16
+    assert zipping[-1].kwargs['progress'] == 100.0
+    assert fake_set.call_args.args[0] == 'READY_FOR_DOWNLOADING'
+    assert fake_set.call_args.kwargs['progress'] == 100
+
+
+def test_generate_hash_code_should_use_archive_format_in_result_file_name(httpx_mock, mock_minio):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://neo4j_service/v1/neo4j/nodes/geid/geid_1',
+        json=[
+            {
+                'labels': ['File'],
+                'global_entity_id': 'geid_2',
+                'location': 'http://anything.com/bucket/obj/path',
+                'display_path': 'display_path',
+                'uploader': 'test',
+            }
+        ],
+    )
+    download_client = DownloadClient(
+        files=[{'geid': 'geid_1'}],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+        download_type='full_dataset',
+        archive_format='tar.gz',
+    )
+    download_client.generate_hash_code()
+
+    assert download_client.result_file_name == download_client.tmp_folder + '.tar.gz'
+
+
+def test_download_client_should_resolve_geids_with_one_batch_query(httpx_mock, mock_minio):
+    httpx_mock.add_response(
+        method='POST',
+        url='http://neo4j_service/v1/neo4j/nodes/query/geids',
+        match_content=b'{"geids": ["geid_1", "geid_2"]}',
+        json={
+            'result': [
+                {
+                    'labels': ['File'],
+                    'global_entity_id': f'geid_{i}',
+                    'location': f'http://anything.com/bucket/obj/path_{i}',
+                    'file_size': i,
+                }
+                for i in (2, 1)
+            ]
+        },
+    )
+    download_client = DownloadClient(
+        files=[{'geid': 'geid_1'}, {'geid': 'geid_2'}],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+    )
+
+    assert [file['geid'] for file in download_client.files_to_zip] == ['geid_1', 'geid_2']
+    assert [file['file_size'] for file in download_client.files_to_zip] == [1, 2]
+
+
+def test_download_client_should_fetch_nodes_one_by_one_when_batch_query_fails(httpx_mock, mock_minio):
+    httpx_mock.add_response(method='POST', url='http://neo4j_service/v1/neo4j/nodes/query/geids', status_code=404)
+    for i in (1, 2):
+        httpx_mock.add_response(
+            method='GET',
+            url=f'http://neo4j_service/v1/neo4j/nodes/geid/geid_{i}',
+            json=[
+                {
+                    'labels': ['File'],
+                    'global_entity_id': f'geid_{i}',
+                    'location': f'http://anything.com/bucket/obj/path_{i}',
+                }
+            ],
+        )
+    download_client = DownloadClient(
+        files=[{'geid': 'geid_1'}, {'geid': 'geid_2'}],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+    )
+
+    assert [file['geid'] for file in download_client.files_to_zip] == ['geid_1', 'geid_2']
+
+
+def test_download_client_should_keep_folder_tree_to_lock(httpx_mock, mock_minio):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://neo4j_service/v1/neo4j/nodes/geid/geid_1',
+        json=[{'labels': ['Folder'], 'global_entity_id': 'geid_1', 'display_path': 'folder', 'uploader': 'test'}],
+    )
+    for folder_geid, results in (
+        (
+            'geid_1',
+            [
+                {'labels': ['Folder'], 'global_entity_id': 'sub', 'display_path': 'folder/sub'},
+                {'labels': ['File'], 'global_entity_id': 'file_1', 'location': 'http://anything.com/bucket/file_1'},
+            ],
+        ),
+        ('sub', [{'labels': ['File'], 'global_entity_id': 'file_2', 'location': 'http://anything.com/bucket/file_2'}]),
+    ):
+        query = {
+            'start_label': 'Folder',
+            'end_labels': ['File', 'Folder'],
+            'query': {'start_params': {'global_entity_id': folder_geid}, 'end_params': {'archived': False}},
+        }
+        httpx_mock.add_response(
+            method='POST',
+            url=ConfigClass.NEO4J_SERVICE_V2 + 'relations/query',
+            match_content=json.dumps(query).encode(),
+            json={'results': results},
+        )
+
+    download_client = DownloadClient(
+        files=[{'geid': 'geid_1'}],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+    )
+
+    assert [file['geid'] for file in download_client.files_to_zip] == ['file_1', 'file_2']
+    assert [node['global_entity_id'] for node in download_client.lock_nodes] == ['geid_1', 'sub', 'file_1', 'file_2']
+
+
+def test_total_bytes_should_stat_only_the_objects_without_a_size():
+    download_client = DownloadClient(
+        files=[],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+        download_type='full_dataset',
+    )
+    download_client.files_to_zip = [
+        {'location': f'http://anything.com/bucket/obj/path_{i}', 'file_size': size}
+        for i, size in enumerate([0, 5, None, None])
+    ]
+    minio_client = mock.MagicMock()
+    minio_client.client.stat_object.return_value.size = 7
+
+    assert download_client.total_bytes(minio_client) == 19
+    assert sorted(call.args for call in minio_client.client.stat_object.call_args_list) == [
+        ('bucket', 'obj/path_2'),
+        ('bucket', 'obj/path_3'),
+    ]
+    assert [file['file_size'] for file in download_client.files_to_zip] == [0, 5, 7, 7]
+
+
+def test_zip_worker_should_set_no_status_when_stopped(httpx_mock, mock_minio):
+    download_client = DownloadClient(
+        files=[],
+        auth_token={'at': 'token', 'rt': 'refresh_token'},
+        operator='me',
+        project_code='any_code',
+        geid='geid_1',
+        session_id='1234',
+        download_type='full_dataset',
+    )
+    download_client.files_to_zip = [{'location': 'http://anything.com/bucket/obj/path', 'file_size': 1}]
+    stop_event = threading.Event()
+    stop_event.set()
+
+    with mock.patch.object(DownloadClient, 'set_status') as fake_set:
+        download_client.zip_worker('fake_hash', stop_event=stop_event)
+
+    fake_set.assert_not_called()
@@ -0,0 +1,192 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import json
+import threading
+from unittest import mock
+
+from app.commons import job_queue
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.data_providers.redis import get_redis_client
+from app.commons.download_manager import DownloadClient
+from app.commons.job_queue import QUEUE_KEY
+from app.commons.job_queue import JobWorker
+from app.commons.job_queue import enqueue_download_job
+from app.commons.job_queue import job_key
+from app.config import ConfigClass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def make_client():
+    return DownloadClient.from_job_spec(
+        {
+            'job_id': 'data-download-1',
+            'files': [{'geid': 'geid_1'}],
+            'file_nodes': [],
+            'files_to_zip': [{'geid': 'geid_1', 'location': 'http://anything.com/bucket/obj/path'}],
+            'lock_nodes': [],
+            'operator': 'me',
+            'project_code': 'any_code',
+            'tmp_folder': './tests/tmp/any_code_1',
+            'result_file_name': './tests/tmp/any_code_1/obj/path',
+            'auth_token': {'at': 'token', 'rt': 'refresh_token'},
+            'session_id': '1234',
+            'download_type': 'project_files',
+            'file_geids_to_include': ['geid_1'],
+            'geid': '',
+            'archive_format': 'zip',
+            'contains_folder': False,
+        }
+    )
+
+
+def test_download_client_job_spec_should_round_trip():
+    client = make_client()
+    spec = json.loads(json.dumps(client.to_job_spec()))
+
+    restored = DownloadClient.from_job_spec(spec)
+    assert restored.to_job_spec() == client.to_job_spec()
+    assert restored.file_geids_to_include == {'geid_1'}
+
+
+def test_job_worker_should_run_and_complete_queued_job():
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    worker = JobWorker(ttl=60)
+
+    assert worker.claim() == job_id
+    assert worker.claim() is None
+    with mock.patch.object(DownloadClient, 'zip_worker') as fake_zip:
+        worker.process(job_id)
+
+    fake_zip.assert_called_once_with('fake_hash', stop_event=mock.ANY)
+    redis = SrvRedisSingleton()
+    assert redis.get_sorted_set_size(QUEUE_KEY) == 0
+    assert redis.get_by_key(job_key(job_id)) is None
+
+
+def test_job_worker_should_take_over_job_of_expired_lease(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(job_queue, 'time', clock)
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    crashed, worker = JobWorker(ttl=60), JobWorker(ttl=60)
+
+    assert crashed.claim() == job_id
+    clock.now += 30
+    assert worker.claim() is None
+    clock.now += 31
+    assert worker.claim() == job_id
+    with mock.patch.object(DownloadClient, 'zip_worker') as fake_zip:
+        worker.process(job_id)
+    fake_zip.assert_called_once_with('fake_hash', stop_event=mock.ANY)
+
+
+def test_enqueue_download_job_should_expire_the_record_holding_the_tokens(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'JOB_MAX_AGE', 600)
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    redis = get_redis_client()
+
+    assert 0 < redis.ttl(job_key(job_id)) <= 600
+    worker = JobWorker(max_age=600)
+    assert worker.claim() == job_id
+    ttls = []
+    with mock.patch.object(
+        DownloadClient, 'zip_worker', side_effect=lambda *args, **kwargs: ttls.append(redis.ttl(job_key(job_id)))
+    ):
+        worker.process(job_id)
+    assert 0 < ttls[0] <= 600
+
+
+def test_job_worker_should_stop_job_taken_over_by_another_worker():
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    worker = JobWorker(ttl=60)
+    assert worker.claim() == job_id
+    redis = SrvRedisSingleton()
+
+    def zip_worker(client, hash_code, stop_event=None):
+        redis.set_with_expire(job_queue.owner_key(job_id), 'other-worker', 60)
+        worker.renew()
+        assert stop_event.is_set()
+
+    with mock.patch.object(DownloadClient, 'zip_worker', autospec=True, side_effect=zip_worker):
+        worker.process(job_id)
+
+    assert redis.get_by_key(job_key(job_id)) is not None
+    assert redis.get_sorted_set_size(QUEUE_KEY) == 1
+
+
+def test_job_worker_should_renew_lease_of_running_jobs(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(job_queue, 'time', clock)
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    worker, other = JobWorker(ttl=60), JobWorker(ttl=60)
+    assert worker.claim() == job_id
+
+    clock.now += 50
+    worker.renew()
+    clock.now += 50
+    assert other.claim() is None
+
+
+def test_job_worker_should_cancel_job_after_max_attempts():
+    job_id = enqueue_download_job(make_client(), 'fake_hash')
+    redis = SrvRedisSingleton()
+    record = json.loads(redis.get_by_key(job_key(job_id)))
+    redis.set_with_expire(job_key(job_id), json.dumps({**record, 'attempts': 3}), None)
+    worker = JobWorker(max_attempts=3)
+
+    assert worker.claim() == job_id
+    with mock.patch.object(DownloadClient, 'zip_worker') as fake_zip, mock.patch.object(
+        DownloadClient, 'set_status'
+    ) as fake_set:
+        worker.process(job_id)
+
+    fake_zip.assert_not_called()
+    fake_set.assert_called_once_with('CANCELLED', payload={'error_msg': f'Job {job_id} was given up after 3 attempts'})
+    assert redis.get_sorted_set_size(QUEUE_KEY) == 0
+
+
+def test_job_worker_should_run_jobs_until_stopped():
+    enqueue_download_job(make_client(), 'first_hash')
+    enqueue_download_job(make_client(), 'second_hash')
+    worker = JobWorker(concurrency=2, poll_interval=0.01)
+    done = threading.Event()
+    ran = []
+
+    def zip_worker(client, hash_code, stop_event=None):
+        ran.append(hash_code)
+        if len(ran) == 2:
+            done.set()
+
+    with mock.patch.object(DownloadClient, 'zip_worker', autospec=True, side_effect=zip_worker):
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+        assert done.wait(5)
+        worker.stop()
+        thread.join(5)
+
+    assert sorted(ran) == ['first_hash', 'second_hash']
+    assert not thread.is_alive()
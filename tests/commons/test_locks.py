@@ -18,10 +18,18 @@
 # permissions and limitations under the Licence.
 # 
 
+import json
+
+import httpx
 import pytest
 
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.locks import LEASES_KEY
+from app.commons.locks import LockLease
+from app.commons.locks import LockManager
 from app.commons.locks import lock_resource
 from app.commons.locks import recursive_lock
+from app.commons.locks import sweep_expired_leases
 from app.commons.locks import unlock_resource
 
 
@@ -105,3 +113,126 @@ def test_recursive_lock_when_node_is_Folder(httpx_mock):
     locked_node, error = recursive_lock('any_code', [{'geid': 'geid_1'}])
     assert not error
     assert locked_node[0] == ('any_code/display_path', 'read')
+
+
+def _lock_node(path: str, **kwargs) -> dict:
+    return {'labels': ['File'], 'display_path': path, 'uploader': 'test', **kwargs}
+
+
+def test_lock_manager_should_lock_snapshot_without_walking_the_tree(httpx_mock):
+    requests = []
+
+    def lock_callback(request: httpx.Request):
+        requests.append((request.method, json.loads(request.content)['resource_key']))
+        return httpx.Response(status_code=200, json={})
+
+    httpx_mock.add_callback(lock_callback, url='http://data_ops_util/v2/resource/lock/')
+    nodes = [
+        _lock_node('folder', labels=['Folder']),
+        _lock_node('folder/a'),
+        _lock_node('folder/a'),
+        _lock_node('folder/archived', archived=True),
+        _lock_node('test'),
+    ]
+    locks = LockManager('any_code', nodes, concurrency=4)
+
+    locks.acquire()
+    locks.release()
+
+    assert sorted(requests) == [
+        ('DELETE', 'any_code/folder'),
+        ('DELETE', 'any_code/folder/a'),
+        ('POST', 'any_code/folder'),
+        ('POST', 'any_code/folder/a'),
+    ]
+
+
+def test_lock_manager_should_release_only_the_locks_taken_when_one_fails(httpx_mock):
+    requests = []
+
+    def lock_callback(request: httpx.Request):
+        key = json.loads(request.content)['resource_key']
+        requests.append((request.method, key))
+        status_code = 409 if request.method == 'POST' and key == 'any_code/b' else 200
+        return httpx.Response(status_code=status_code, json={})
+
+    httpx_mock.add_callback(lock_callback, url='http://data_ops_util/v2/resource/lock/')
+    locks = LockManager('any_code', [_lock_node('a'), _lock_node('b'), _lock_node('c')], concurrency=1)
+
+    with pytest.raises(Exception, match='any_code/b'):
+        locks.acquire()
+
+    assert requests == [('POST', 'any_code/a'), ('POST', 'any_code/b'), ('DELETE', 'any_code/a')]
+    assert locks.locked == []
+
+
+def test_lock_lease_should_record_locks_while_they_are_held(httpx_mock):
+    httpx_mock.add_response(method='POST', url='http://data_ops_util/v2/resource/lock/', json={})
+    httpx_mock.add_response(method='DELETE', url='http://data_ops_util/v2/resource/lock/', json={})
+    redis = SrvRedisSingleton()
+    lease = LockLease('job', ttl=30, interval=10)
+    locks = LockManager('any_code', [_lock_node('a')], lease=lease)
+
+    lease.start()
+    locks.acquire()
+
+    assert redis.get_set_members(lease.locks_key) == {b'["any_code/a", "read"]'}
+    assert redis.get_set_members(LEASES_KEY) == {lease.lease_id.encode()}
+
+    locks.release()
+    lease.stop()
+
+    assert redis.get_set_members(lease.locks_key) == set()
+    assert redis.get_set_members(LEASES_KEY) == set()
+    assert not redis.check_by_key(lease.heartbeat_key)
+
+
+def test_sweep_expired_leases_should_release_locks_of_dead_jobs(httpx_mock):
+    httpx_mock.add_response(
+        method='DELETE',
+        url='http://data_ops_util/v2/resource/lock/',
+        match_content=b'{"resource_key": "any_code/a", "operation": "read"}',
+        json={},
+    )
+    redis = SrvRedisSingleton()
+    dead = LockLease('dead', ttl=30, interval=10)
+    dead.start()
+    dead.add('any_code/a', 'read')
+    # the process running the job died, its heartbeat expires
+    dead._stop.set()
+    redis.delete_by_key(dead.heartbeat_key)
+    alive = LockLease('alive', ttl=30, interval=10)
+    alive.start()
+    alive.add('any_code/b', 'read')
+
+    assert sweep_expired_leases() == 1
+
+    assert redis.get_set_members(LEASES_KEY) == {alive.lease_id.encode()}
+    assert redis.get_set_members(dead.locks_key) == set()
+    assert redis.get_set_members(alive.locks_key) == {b'["any_code/b", "read"]'}
+    alive._stop.set()
+
+
+def test_lock_manager_should_lock_folder_prefix_and_intent_on_ancestors(httpx_mock):
+    requests = []
+
+    def lock_callback(request: httpx.Request):
+        body = json.loads(request.content)
+        requests.append((request.method, body['resource_key'], body['operation']))
+        return httpx.Response(status_code=200, json={})
+
+    httpx_mock.add_callback(lock_callback, url='http://data_ops_util/v2/resource/lock/')
+    nodes = [
+        {'labels': ['Folder'], 'display_path': 'test/project/folder', 'uploader': 'test'},
+        {'labels': ['Greenroom', 'File'], 'display_path': 'test/project/file.txt', 'uploader': 'test'},
+    ]
+    locks = LockManager('any_code', nodes, concurrency=1, hierarchical=True)
+
+    locks.acquire()
+
+    assert requests == [
+        ('POST', 'any_code/test/project/', 'intent_read'),
+        ('POST', 'gr-any_code/test/project/', 'intent_read'),
+        ('POST', 'any_code/test/project/folder/', 'read'),
+        ('POST', 'gr-any_code/test/project/file.txt', 'read'),
+    ]
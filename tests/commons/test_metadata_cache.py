@@ -0,0 +1,83 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+from app.commons.metadata_cache import FOLDER
+from app.commons.metadata_cache import NODE
+from app.commons.metadata_cache import MetadataCache
+from app.config import ConfigClass
+from app.resources.helpers import get_nodes_by_geids
+
+
+def test_metadata_cache_should_answer_from_redis_when_local_entry_is_gone():
+    cache = MetadataCache(ttl=60, local_ttl=10, local_size=10)
+    cache.set(NODE, 'geid_1', [{'global_entity_id': 'geid_1'}])
+
+    assert cache.get(NODE, 'geid_1') == [{'global_entity_id': 'geid_1'}]
+    cache.clear_local()
+    assert cache.get(NODE, 'geid_1') == [{'global_entity_id': 'geid_1'}]
+    assert cache.get(NODE, 'geid_2') is None
+    assert cache.stats.to_dict() == {
+        'local_hits': 1,
+        'redis_hits': 1,
+        'misses': 1,
+        'evictions': 0,
+        'invalidations': 0,
+        'hit_ratio': 0.6667,
+    }
+
+
+def test_metadata_cache_should_evict_least_recently_used_local_entries():
+    cache = MetadataCache(ttl=60, local_ttl=10, local_size=2)
+    cache.set(NODE, 'geid_1', [1])
+    cache.set(NODE, 'geid_2', [2])
+    cache.get(NODE, 'geid_1')
+    cache.set(NODE, 'geid_3', [3])
+
+    assert list(cache._local) == ['neo4j_cache:node:geid_1', 'neo4j_cache:node:geid_3']
+    assert cache.stats.evictions == 1
+
+
+def test_metadata_cache_should_drop_every_kind_when_invalidated():
+    cache = MetadataCache(ttl=60, local_ttl=10, local_size=10)
+    cache.set(NODE, 'geid_1', [1])
+    cache.set(FOLDER, 'geid_1', [])
+
+    assert cache.invalidate(['geid_1', 'geid_1']) == ['geid_1']
+    assert cache.get(NODE, 'geid_1') is None
+    assert cache.get(FOLDER, 'geid_1') is None
+    assert cache.stats.invalidations == 1
+
+
+def test_get_nodes_by_geids_should_only_query_geids_not_cached(httpx_mock):
+    httpx_mock.add_response(
+        method='GET',
+        url=ConfigClass.NEO4J_SERVICE + 'nodes/geid/geid_1',
+        json=[{'global_entity_id': 'geid_1', 'labels': ['File']}],
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url=ConfigClass.NEO4J_SERVICE + 'nodes/geid/geid_2',
+        json=[{'global_entity_id': 'geid_2', 'labels': ['File']}],
+    )
+
+    assert get_nodes_by_geids(['geid_1'])['geid_1'][0]['global_entity_id'] == 'geid_1'
+    nodes = get_nodes_by_geids(['geid_1', 'geid_2'])
+
+    assert set(nodes) == {'geid_1', 'geid_2'}
+    assert len(httpx_mock.get_requests()) == 2
@@ -0,0 +1,100 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import threading
+
+import minio
+import pytest
+
+from app.commons.object_fetcher import ByteBudget
+from app.commons.object_fetcher import ObjectFetcher
+
+
+def s3_error(code):
+    return minio.error.S3Error(
+        code=code, message='any msg', resource='any', request_id='any', host_id='any', response='error'
+    )
+
+
+def test_object_fetcher_should_aggregate_bytes_and_skipped_files():
+    objects = [{'location': str(i), 'file_size': i} for i in range(10)]
+    fetcher = ObjectFetcher(lambda obj: None if obj['file_size'] == 0 else obj['file_size'], workers=4, byte_budget=5)
+
+    stats = fetcher.run(objects)
+
+    assert stats.files == 9
+    assert stats.skipped == 1
+    assert stats.bytes == sum(range(10))
+
+
+def test_object_fetcher_should_retry_transient_errors():
+    attempts = []
+
+    def fetch(obj):
+        attempts.append(obj)
+        if len(attempts) < 3:
+            raise s3_error('SlowDown')
+        return 1
+
+    stats = ObjectFetcher(fetch, workers=1, byte_budget=1, retries=3, retry_backoff=0).run([{'location': 'a'}])
+
+    assert len(attempts) == 3
+    assert stats.retries == 2
+    assert stats.files == 1
+
+
+def test_object_fetcher_should_raise_without_retry_when_error_is_not_retryable():
+    attempts = []
+
+    def fetch(obj):
+        attempts.append(obj)
+        raise s3_error('AccessDenied')
+
+    with pytest.raises(minio.error.S3Error):
+        ObjectFetcher(fetch, workers=1, byte_budget=1, retries=3, retry_backoff=0).run([{'location': 'a'}])
+    assert len(attempts) == 1
+
+
+def test_object_fetcher_should_keep_bytes_in_flight_under_budget():
+    budget_limit = 10
+    in_flight = []
+    lock = threading.Lock()
+    current = [0]
+
+    def fetch(obj):
+        with lock:
+            current[0] += obj['file_size']
+            in_flight.append(current[0])
+        with lock:
+            current[0] -= obj['file_size']
+        return obj['file_size']
+
+    ObjectFetcher(fetch, workers=8, byte_budget=budget_limit).run([{'file_size': 4} for _ in range(50)])
+
+    assert max(in_flight) <= budget_limit
+
+
+def test_byte_budget_should_let_object_bigger_than_budget_run_alone():
+    budget = ByteBudget(10)
+    reserved = budget.acquire(100)
+    assert reserved == 10
+    assert budget.in_use == 10
+    budget.release(reserved)
+    assert budget.in_use == 0
@@ -0,0 +1,79 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+from app.commons import progress as progress_module
+from app.commons.progress import ProgressTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+
+def test_progress_tracker_should_report_at_most_once_per_interval(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(progress_module, 'time', clock)
+    reports = []
+    tracker = ProgressTracker(1000, reports.append, interval=1)
+
+    tracker.add(100)
+    clock.now += 1
+    tracker.add(100)
+    clock.now += 0.5
+    tracker.add(100)
+
+    assert reports == [{'percent': 20.0, 'bytes_done': 200, 'bytes_total': 1000, 'throughput': 200, 'eta': 4}]
+    assert tracker.snapshot()['bytes_done'] == 300
+
+
+def test_progress_tracker_should_not_raise_when_report_fails(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(progress_module, 'time', clock)
+
+    def report(snapshot):
+        raise ConnectionError('redis is down')
+
+    tracker = ProgressTracker(10, report, interval=0)
+    clock.now += 1
+    tracker.add(5)
+
+    assert tracker.snapshot()['percent'] == 50.0
+
+
+def test_progress_tracker_should_have_no_eta_before_any_transfer():
+    tracker = ProgressTracker(0, lambda snapshot: None)
+
+    assert tracker.snapshot()['eta'] is None
+    assert tracker.snapshot()['percent'] == 0.0
+
+
+def test_object_progress_should_take_back_its_bytes_on_rollback():
+    tracker = ProgressTracker(100, lambda snapshot: None, interval=60)
+    counter = tracker.counter()
+    counter.add(30)
+    tracker.counter().add(10)
+
+    counter.rollback()
+    counter.rollback()
+
+    assert tracker.done == 10
@@ -0,0 +1,143 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+from io import BytesIO
+
+import minio
+import pytest
+from urllib3 import HTTPResponse
+
+from app.commons.segmented_download import ObjectChangedError
+from app.commons.segmented_download import SegmentedDownloader
+from app.commons.segmented_download import split_ranges
+
+
+class FakeStat:
+    def __init__(self, size, etag):
+        self.size = size
+        self.etag = etag
+
+
+class FakeMinio:
+    def __init__(self, content, etags=('etag',)):
+        self.content = content
+        self.etags = list(etags)
+        self.ranges = []
+        self.request_headers = []
+        self.fget_calls = []
+        self.failures = 0
+
+    def stat_object(self, bucket, object_name):
+        etag = self.etags.pop(0) if len(self.etags) > 1 else self.etags[0]
+        return FakeStat(len(self.content), etag)
+
+    def get_object(self, bucket, object_name, offset=0, length=0, request_headers=None):
+        if self.failures:
+            self.failures -= 1
+            raise minio.error.S3Error(
+                code='SlowDown', message='any', resource='any', request_id='any', host_id='any', response='error'
+            )
+        self.ranges.append((offset, length))
+        self.request_headers.append(request_headers)
+        body = self.content[offset : offset + length]
+        return HTTPResponse(body=BytesIO(body), preload_content=False)
+
+    def fget_object(self, bucket, object_name, file_path):
+        self.fget_calls.append(object_name)
+        with open(file_path, 'wb') as file:
+            file.write(self.content)
+
+
+def test_split_ranges_should_cover_whole_object():
+    assert split_ranges(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert split_ranges(0, 4) == []
+
+
+def test_segmented_downloader_should_fetch_ranges_into_file(tmp_path):
+    content = os.urandom(1000)
+    client = FakeMinio(content)
+    downloader = SegmentedDownloader(client, part_size=128, workers=4, threshold=256, chunk_size=50)
+    path = str(tmp_path / 'folder' / 'file')
+
+    assert downloader.download('bucket', 'file', path) == 1000
+    with open(path, 'rb') as file:
+        assert file.read() == content
+    assert sorted(client.ranges) == split_ranges(1000, 128)
+    assert all(headers == {'If-Match': '"etag"'} for headers in client.request_headers)
+    assert not os.path.exists(path + '.part')
+
+
+def test_segmented_downloader_should_use_fget_object_for_small_objects(tmp_path):
+    client = FakeMinio(b'small')
+    downloader = SegmentedDownloader(client, part_size=1, threshold=256)
+
+    assert downloader.download('bucket', 'file', str(tmp_path / 'file'), size=5) == 5
+    assert client.fget_calls == ['file']
+    assert client.ranges == []
+
+
+def test_segmented_downloader_should_retry_failed_ranges(tmp_path):
+    content = os.urandom(300)
+    client = FakeMinio(content)
+    client.failures = 1
+    downloader = SegmentedDownloader(client, part_size=100, workers=2, threshold=0, retries=1, retry_backoff=0)
+    path = str(tmp_path / 'file')
+
+    downloader.download('bucket', 'file', path)
+    with open(path, 'rb') as file:
+        assert file.read() == content
+
+
+def test_segmented_downloader_should_raise_exception_when_object_changed(tmp_path):
+    client = FakeMinio(os.urandom(300), etags=['etag', 'other_etag'])
+    downloader = SegmentedDownloader(client, part_size=100, workers=2, threshold=0)
+    path = str(tmp_path / 'file')
+
+    with pytest.raises(ObjectChangedError):
+        downloader.download('bucket', 'file', path)
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + '.part')
+
+
+def test_segmented_downloader_should_stop_remaining_ranges_when_one_fails(tmp_path):
+    client = FakeMinio(os.urandom(1000))
+    client.failures = 1
+    downloader = SegmentedDownloader(client, part_size=100, workers=2, threshold=0, retries=0)
+    path = str(tmp_path / 'file')
+
+    with pytest.raises(minio.error.S3Error):
+        downloader.download('bucket', 'file', path)
+    # ranges already picked up by the workers may finish, the queued ones are not fetched
+    assert len(client.ranges) < 9
+    assert not os.path.exists(path + '.part')
+
+
+def test_segmented_downloader_should_report_every_written_chunk(tmp_path):
+    client = FakeMinio(os.urandom(1000))
+    client.failures = 1
+    downloader = SegmentedDownloader(
+        client, part_size=128, workers=4, threshold=256, chunk_size=50, retries=1, retry_backoff=0
+    )
+    written = []
+
+    downloader.download('bucket', 'file', str(tmp_path / 'file'), progress=written.append)
+    assert sum(written) == 1000
+    assert max(written) <= 50
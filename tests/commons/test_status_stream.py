@@ -0,0 +1,58 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+from app.commons.status_stream import StatusQueue
+from app.commons.status_stream import get_status_broadcaster
+from app.resources.helpers import set_status
+
+
+def _set_status(session_id, status):
+    return set_status(session_id, 'job_1', 'file_1', 'data_download', status, 'any', 'me', 'geid')
+
+
+async def test_status_broadcaster_should_send_published_records_to_the_session_queue(anyio_backend):
+    broadcaster = get_status_broadcaster()
+    queue = broadcaster.subscribe('1234')
+    other = broadcaster.subscribe('5678')
+    assert await run_in_threadpool(broadcaster.wait_subscribed, 5)
+
+    await run_in_threadpool(_set_status, '1234', 'ZIPPING')
+    await run_in_threadpool(_set_status, '1234', 'READY_FOR_DOWNLOADING')
+
+    first = await asyncio.wait_for(queue.get(), 5)
+    second = await asyncio.wait_for(queue.get(), 5)
+    assert [first['status'], second['status']] == ['ZIPPING', 'READY_FOR_DOWNLOADING']
+    assert other.empty()
+
+    broadcaster.unsubscribe('1234', queue)
+    broadcaster.unsubscribe('5678', other)
+
+
+async def test_status_queue_should_keep_the_latest_record_of_a_job_once_full(anyio_backend):
+    queue = StatusQueue(2)
+    for job_id, status in [('job_1', 'ZIPPING'), ('job_2', 'ZIPPING'), ('job_1', 'SUCCEED'), ('job_2', 'SUCCEED')]:
+        queue.put_latest({'session_id': '1234', 'job_id': job_id, 'source': 'file_1', 'status': status})
+
+    records = [queue.get_nowait(), queue.get_nowait()]
+    assert [(record['job_id'], record['status']) for record in records] == [('job_1', 'SUCCEED'), ('job_2', 'SUCCEED')]
+    assert queue.empty()
@@ -65,6 +65,29 @@ def clean_up_redis():
     cache.flushall()
 
 
+@pytest.fixture(autouse=True)
+def reset_metadata_cache():
+    from app.commons.metadata_cache import reset_metadata_cache
+
+    reset_metadata_cache()
+
+
+@pytest.fixture(autouse=True)
+def reset_upstream_clients():
+    from app.commons.service_connection.upstream import reset_upstream_clients
+
+    yield
+    reset_upstream_clients()
+
+
+@pytest.fixture(autouse=True)
+def stop_status_broadcaster():
+    from app.commons.status_stream import stop_status_broadcaster
+
+    yield
+    stop_status_broadcaster()
+
+
 @pytest.fixture(scope='session', autouse=True)
 def create_folders():
     folder_path = './tests/tmp/'
@@ -115,17 +138,27 @@ async def client(app):
 @pytest.fixture
 def mock_minio(monkeypatch):
     from app.commons.service_connection.minio_client import Minio
+    from app.config import ConfigClass
+
+    # the sdk calls are mocked, keep responses on the sync minio path
+    monkeypatch.setattr(ConfigClass, 'ASYNC_OBJECT_STREAMING', False)
+
+    content = b'File like object'
 
     class FakeObject:
-        size = b'a'
+        size = len(content)
+        etag = 'fake_etag'
+        last_modified = None
 
-    http_response = HTTPResponse()
-    response = Response(status_code=200)
-    response.raw = http_response
-    response.raw._fp = BytesIO(b'File like object')
+    def get_object(self, bucket, object_name, offset=0, length=0, request_headers=None):
+        http_response = HTTPResponse()
+        response = Response(status_code=200)
+        response.raw = http_response
+        response.raw._fp = BytesIO(content[offset : offset + length] if length else content[offset:])
+        return http_response
 
     monkeypatch.setattr(Minio, 'stat_object', lambda x, y, z: FakeObject())
-    monkeypatch.setattr(Minio, 'get_object', lambda x, y, z: http_response)
+    monkeypatch.setattr(Minio, 'get_object', get_object)
     monkeypatch.setattr(Minio, 'list_buckets', lambda x: [])
     monkeypatch.setattr(Minio, 'fget_object', lambda *x: [])
 
@@ -150,4 +183,6 @@ async def fake_job(monkeypatch):
         },
         'update_timestamp': '1643041439',
     }
-    monkeypatch.setattr(SrvRedisSingleton, 'mget_by_prefix', lambda x, y: [bytes(json.dumps(fake_job), 'utf-8')])
+    monkeypatch.setattr(
+        SrvRedisSingleton, 'mget_by_indexes', lambda x, y, z=None: [bytes(json.dumps(fake_job), 'utf-8')]
+    )
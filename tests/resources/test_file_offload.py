@@ -0,0 +1,58 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import os
+
+import pytest
+from pydantic import ValidationError
+
+from app.config import ConfigClass
+from app.config import Settings
+from app.resources.file_offload import offload_headers
+
+
+def test_offload_headers_should_return_none_when_disabled(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_MODE', '')
+    assert offload_headers('/data/tmp/file.zip') is None
+
+
+def test_offload_headers_should_return_absolute_path_for_x_sendfile(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_MODE', 'x-sendfile')
+    assert offload_headers('tests/file.zip') == {'X-Sendfile': os.path.abspath('tests/file.zip')}
+
+
+def test_offload_headers_should_map_path_below_root_for_x_accel_redirect(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_MODE', 'x-accel-redirect')
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_ROOT', '/data/tmp/')
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_PREFIX', '/protected/')
+
+    assert offload_headers('/data/tmp/project 1.zip') == {'X-Accel-Redirect': '/protected/project%201.zip'}
+    assert offload_headers('/data/other/file.zip') is None
+
+
+def test_settings_should_normalize_download_offload_mode(monkeypatch):
+    monkeypatch.setenv('DOWNLOAD_OFFLOAD_MODE', 'X-Sendfile')
+    assert Settings().DOWNLOAD_OFFLOAD_MODE == 'x-sendfile'
+
+
+def test_settings_should_raise_exception_when_download_offload_mode_unknown(monkeypatch):
+    monkeypatch.setenv('DOWNLOAD_OFFLOAD_MODE', 'any')
+    with pytest.raises(ValidationError):
+        Settings()
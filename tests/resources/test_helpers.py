@@ -0,0 +1,122 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+import json
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.service_connection.upstream import get_upstream_client
+from app.config import ConfigClass
+from app.resources.helpers import delete_by_session_id
+from app.resources.helpers import get_files_recursive
+from app.resources.helpers import get_status
+from app.resources.helpers import index_status_records
+from app.resources.helpers import set_status
+from app.resources.helpers import walk_folder_files
+
+
+def _mock_folder(httpx_mock, folder_geid, results):
+    httpx_mock.add_response(
+        method='POST',
+        url=ConfigClass.NEO4J_SERVICE_V2 + 'relations/query',
+        match_content=json.dumps(
+            {
+                'start_label': 'Folder',
+                'end_labels': ['File', 'Folder'],
+                'query': {'start_params': {'global_entity_id': folder_geid}, 'end_params': {'archived': False}},
+            }
+        ).encode(),
+        json={'results': results},
+    )
+
+
+def test_get_files_recursive_should_walk_nested_folder_chain_in_order(httpx_mock):
+    depth = 50
+    for level in range(depth):
+        results = [{'labels': ['File'], 'global_entity_id': f'file-{level}'}]
+        if level + 1 < depth:
+            results.append({'labels': ['Folder'], 'global_entity_id': f'folder-{level + 1}'})
+        _mock_folder(httpx_mock, f'folder-{level}', results)
+
+    files = get_files_recursive('folder-0')
+
+    assert [node['global_entity_id'] for node in files] == [f'file-{level}' for level in range(depth)]
+
+
+def test_get_files_recursive_should_close_the_async_client_of_its_loop(httpx_mock):
+    _mock_folder(httpx_mock, 'folder-0', [{'labels': ['File'], 'global_entity_id': 'file-0'}])
+
+    get_files_recursive('folder-0')
+
+    assert len(get_upstream_client('neo4j')._async_clients) == 0
+
+
+async def test_walk_folder_files_should_yield_files_breadth_first_in_folder_order(httpx_mock, anyio_backend):
+    _mock_folder(
+        httpx_mock,
+        'root',
+        [
+            {'labels': ['Folder'], 'global_entity_id': 'a'},
+            {'labels': ['File'], 'global_entity_id': 'root-file'},
+            {'labels': ['Folder'], 'global_entity_id': 'b'},
+        ],
+    )
+    _mock_folder(httpx_mock, 'a', [{'labels': ['File'], 'global_entity_id': 'a-file'}])
+    _mock_folder(httpx_mock, 'b', [{'labels': ['File'], 'global_entity_id': 'b-file'}])
+
+    files = [node['global_entity_id'] async for node in walk_folder_files('root', concurrency=2)]
+
+    assert files == ['root-file', 'a-file', 'b-file']
+
+
+def _set_status(session_id, job_id, source, operator='me'):
+    set_status(session_id, job_id, source, 'data_download', 'ZIPPING', 'any', operator, 'geid')
+
+
+def test_get_status_should_read_the_indexed_records_of_the_session():
+    _set_status('1234', 'job_1', 'file_1')
+    _set_status('1234', 'job_2', 'file_2')
+    _set_status('1234', 'job_3', 'file_3', operator='other')
+    _set_status('5678', 'job_1', 'file_4')
+
+    records = get_status('1234', '*', 'any', 'data_download', 'me')
+
+    assert sorted(record['source'] for record in records) == ['file_1', 'file_2']
+    assert [record['source'] for record in get_status('1234', 'job_2', 'any', 'data_download')] == ['file_2']
+
+
+def test_delete_by_session_id_should_remove_records_and_index_entries():
+    _set_status('1234', 'job_1', 'file_1')
+    _set_status('5678', 'job_1', 'file_2')
+
+    delete_by_session_id('1234', action='data_download')
+
+    redis = SrvRedisSingleton()
+    assert get_status('1234', '*', 'any', 'data_download') == []
+    assert redis.get_set_members('dataaction:index:session:1234') == set()
+    assert redis.get_set_members('dataaction:index:job:job_1') == {b'dataaction:5678:job_1:data_download:any:me:file_2'}
+
+
+def test_index_status_records_should_index_records_written_before_the_indexes_once():
+    redis = SrvRedisSingleton()
+    redis.set_by_key('dataaction:1234:job_1:data_download:any:me:file_1', json.dumps({'source': 'file_1'}))
+
+    assert index_status_records() == 1
+    assert index_status_records() == 0
+
+    assert get_status('1234', '*', 'any', 'data_download', 'me') == [{'source': 'file_1'}]
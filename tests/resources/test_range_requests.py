@@ -0,0 +1,112 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import pytest
+
+from app.resources.range_requests import FileRangeResponse
+from app.resources.range_requests import RangeNotSatisfiable
+from app.resources.range_requests import if_range_matches
+from app.resources.range_requests import parse_range_header
+from app.resources.range_requests import range_response
+from app.resources.range_requests import requests_first_byte
+
+
+@pytest.mark.parametrize(
+    'header,expected',
+    [
+        ('bytes=0-9', [(0, 9)]),
+        ('bytes=90-', [(90, 99)]),
+        ('bytes=-10', [(90, 99)]),
+        ('bytes=-500', [(0, 99)]),
+        ('bytes=50-500', [(50, 99)]),
+        ('bytes=20-29, 0-9', [(0, 9), (20, 29)]),
+        ('bytes=0-9,5-19,20-29', [(0, 29)]),
+        ('bytes=0-9,200-300', [(0, 9)]),
+    ],
+)
+def test_parse_range_header_should_return_sorted_inclusive_ranges(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', [None, '', 'items=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-b', 'bytes=-', 'bytes=1'])
+def test_parse_range_header_should_ignore_missing_or_malformed_header(header):
+    assert parse_range_header(header, 100) is None
+
+
+@pytest.mark.parametrize('header,size', [('bytes=100-', 100), ('bytes=-0', 100), ('bytes=0-9', 0)])
+def test_parse_range_header_should_raise_exception_when_not_satisfiable(header, size):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, size)
+
+
+@pytest.mark.parametrize(
+    'if_range,expected',
+    [
+        (None, True),
+        ('"etag"', True),
+        ('"other"', False),
+        ('W/"etag"', False),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', True),
+        ('Thu, 22 Oct 2015 07:28:00 GMT', False),
+    ],
+)
+def test_if_range_matches_should_compare_etag_or_date(if_range, expected):
+    assert if_range_matches(if_range, '"etag"', 'Wed, 21 Oct 2015 07:28:00 GMT') is expected
+
+
+@pytest.mark.parametrize(
+    'header,expected',
+    [(None, True), ('bytes=0-99', True), ('bytes=100-,0-1', True), ('bytes=100-', False), ('bytes=-100', False)],
+)
+def test_requests_first_byte_should_only_count_ranges_from_start(header, expected):
+    assert requests_first_byte(header) is expected
+
+
+async def test_range_response_should_build_multipart_body_from_async_reader(anyio_backend):
+    content = b'0123456789'
+
+    async def read_range(start, length):
+        yield content[start : start + length]
+
+    response = range_response('bytes=0-1,8-', None, len(content), read_range, media_type='text/plain')
+    body = b''.join([chunk async for chunk in response.body_iterator])
+
+    assert response.status_code == 206
+    assert int(response.headers['Content-Length']) == len(body)
+    assert b'Content-Range: bytes 0-1/10\r\n\r\n01\r\n' in body
+    assert b'Content-Range: bytes 8-9/10\r\n\r\n89\r\n' in body
+
+
+async def test_file_range_response_should_use_zerocopysend_when_server_supports_it(anyio_backend, tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(b'0123456789')
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    response = FileRangeResponse(iter([b'unused']), str(path), 2, 5, status_code=206)
+    await response({'type': 'http', 'extensions': {'http.response.zerocopysend': {}}}, None, send)
+
+    assert messages[0]['status'] == 206
+    assert messages[1]['type'] == 'http.response.zerocopysend'
+    assert (messages[1]['offset'], messages[1]['count']) == (2, 5)
+    assert messages[1]['file'].name == str(path)
+    assert messages[1]['more_body'] is False
@@ -32,3 +32,4 @@ async def test_root_healthcheck_endpoint_returns_body_with_ok_in_status(client):
         'name': ConfigClass.APP_NAME,
         'version': ConfigClass.VERSION,
     }
+
@@ -17,6 +17,10 @@
 # See the Licence for the specific language governing
 # permissions and limitations under the Licence.
 # 
+import json
+
+from app.resources.helpers import set_status
+
 
 async def test_v1_downloads_status_should_return_404_when_job_not_found(client):
     resp = await client.get(
@@ -64,6 +68,34 @@ async def test_v1_download_status_should_return_401_when_when_token_not_verified
     }
 
 
+async def test_v1_download_status_stream_should_send_status_until_job_is_ready(client, jwt_token):
+    set_status(
+        123,
+        'fake_global_entity_id',
+        'tests/routers/v1/empty.txt',
+        'data_download',
+        'READY_FOR_DOWNLOADING',
+        'any',
+        'me',
+        'fake_global_entity_id',
+    )
+
+    resp = await client.get(f'/v1/download/status/{jwt_token}/stream')
+
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/event-stream')
+    event, data = resp.text.strip().split('\n')
+    assert event == 'event: status'
+    assert json.loads(data[len('data: ') :])['status'] == 'READY_FOR_DOWNLOADING'
+
+
+async def test_v1_download_status_stream_should_return_404_when_job_not_found(client, jwt_token):
+    resp = await client.get(f'/v1/download/status/{jwt_token}/stream')
+
+    assert resp.status_code == 404
+    assert resp.json()['error_msg'] == '[Invalid Job ID] Not Found'
+
+
 async def test_v1_download_status_should_return_404_when_job_not_found(client, jwt_token):
     resp = await client.get(
         f'/v1/download/status/{jwt_token}',
@@ -153,6 +185,47 @@ async def test_v1_download_should_return_200_when_success(
     assert resp.text == 'file content\n'
 
 
+async def test_v1_download_should_return_206_when_range_requested(
+    client,
+    jwt_token,
+    fake_job,
+    httpx_mock,
+):
+    with open('tests/routers/v1/empty.txt', 'rb') as file:
+        content = file.read()
+    resp = await client.get(f'/v1/download/{jwt_token}', headers={'Range': 'bytes=3-9'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == f'bytes 3-9/{len(content)}'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert 'ETag' in resp.headers
+    assert resp.content == content[3:10]
+    # a range after the first byte is part of a download that was already logged
+    assert httpx_mock.get_requests() == []
+
+
+async def test_v1_download_should_log_download_when_range_starts_at_first_byte(
+    client,
+    jwt_token,
+    fake_job,
+    httpx_mock,
+):
+    httpx_mock.add_response(method='POST', url='http://provenance_service/v1/audit-logs', json={}, status_code=200)
+    resp = await client.get(f'/v1/download/{jwt_token}', headers={'Range': 'bytes=0-3'})
+    assert resp.status_code == 206
+    assert len(httpx_mock.get_requests(url='http://provenance_service/v1/audit-logs')) == 1
+
+
+async def test_v1_download_should_not_log_download_when_range_not_satisfiable(
+    client,
+    jwt_token,
+    fake_job,
+    httpx_mock,
+):
+    resp = await client.get(f'/v1/download/{jwt_token}', headers={'Range': 'bytes=1000-'})
+    assert resp.status_code == 416
+    assert httpx_mock.get_requests() == []
+
+
 async def test_delete_downloads_status_should_return_200_when_success(client):
     resp = await client.delete(
         '/v1/download/status',
@@ -180,3 +253,47 @@ async def test_delete_downloads_status_should_return_401_when_session_id_not_in_
         'num_of_pages': 1,
         'result': {},
     }
+
+
+async def test_v1_download_should_stream_from_minio_when_token_has_minio_location(
+    client,
+    fake_job,
+    httpx_mock,
+    mock_minio,
+):
+    from app.resources.download_token_manager import generate_token
+
+    token = generate_token(
+        {
+            'geid': 'fake_global_entity_id',
+            'full_path': 'tmp/any_1/user/obj/path',
+            'minio_location': 'minio://http://anything.com/bucket/user/obj/path',
+            'operator': 'me',
+            'session_id': '1234',
+            'job_id': 'fake_global_entity_id',
+            'project_code': 'any',
+        }
+    )
+    resp = await client.get(f'/v1/download/{token}', headers={'Range': 'bytes=5-'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="path"'
+    assert resp.text == 'like object'
+
+
+async def test_v1_download_should_return_offload_header_when_offload_enabled(
+    client,
+    jwt_token,
+    fake_job,
+    httpx_mock,
+    monkeypatch,
+):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_MODE', 'x-accel-redirect')
+    monkeypatch.setattr(ConfigClass, 'DOWNLOAD_OFFLOAD_ROOT', 'tests/routers')
+    httpx_mock.add_response(method='POST', url='http://provenance_service/v1/audit-logs', json={}, status_code=200)
+    resp = await client.get(f'/v1/download/{jwt_token}')
+    assert resp.status_code == 200
+    assert resp.headers['X-Accel-Redirect'] == '/protected_downloads/v1/empty.txt'
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="empty.txt"'
+    assert resp.content == b''
@@ -0,0 +1,41 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+from app.commons.metadata_cache import NODE
+from app.commons.metadata_cache import get_metadata_cache
+
+
+async def test_v1_metadata_cache_invalidate_should_drop_cached_nodes(client):
+    cache = get_metadata_cache()
+    cache.set(NODE, 'geid_1', [{'global_entity_id': 'geid_1'}])
+
+    resp = await client.post('/v1/metadata-cache/invalidate', json={'geids': ['geid_1']})
+
+    assert resp.status_code == 200
+    assert resp.json()['result'] == ['geid_1']
+    assert cache.get(NODE, 'geid_1') is None
+
+
+async def test_v1_metadata_cache_stats_should_return_counters(client):
+    get_metadata_cache().get(NODE, 'geid_1')
+
+    resp = await client.get('/v1/metadata-cache/stats')
+
+    assert resp.status_code == 200
+    assert resp.json()['result']['misses'] == 1
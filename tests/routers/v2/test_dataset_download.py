@@ -18,6 +18,9 @@
 # permissions and limitations under the Licence.
 # 
 
+import pytest
+
+
 async def test_v2_dataset_download_should_return_401_when_wrong_token(
     client,
 ):
@@ -43,3 +46,79 @@ async def test_v2_dataset_download_should_return_200_when_minio_raise_error(clie
     assert resp.status_code == 200
     assert 'error_msg' in resp.json()
     assert 'Error getting file from minio' in resp.json()['error_msg']
+
+
+async def test_v2_dataset_download_should_return_206_when_range_requested(client, jwt_token, mock_minio):
+    resp = await client.get(f'/v2/dataset/download/{jwt_token}', headers={'Range': 'bytes=5-8'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 5-8/16'
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['ETag'] == '"fake_etag"'
+    assert resp.text == 'like'
+
+
+async def test_v2_dataset_download_should_return_multipart_when_several_ranges_requested(client, jwt_token, mock_minio):
+    resp = await client.get(f'/v2/dataset/download/{jwt_token}', headers={'Range': 'bytes=0-3,-6'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Type'].startswith('multipart/byteranges; boundary=')
+    assert int(resp.headers['Content-Length']) == len(resp.content)
+    assert 'Content-Range: bytes 0-3/16\r\n\r\nFile\r\n' in resp.text
+    assert 'Content-Range: bytes 10-15/16\r\n\r\nobject\r\n' in resp.text
+
+
+async def test_v2_dataset_download_should_return_full_content_when_if_range_does_not_match(
+    client, jwt_token, mock_minio
+):
+    resp = await client.get(
+        f'/v2/dataset/download/{jwt_token}', headers={'Range': 'bytes=5-8', 'If-Range': '"old_etag"'}
+    )
+    assert resp.status_code == 200
+    assert resp.text == 'File like object'
+
+
+async def test_v2_dataset_download_should_return_416_when_range_not_satisfiable(client, jwt_token, mock_minio):
+    resp = await client.get(f'/v2/dataset/download/{jwt_token}', headers={'Range': 'bytes=100-'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == 'bytes */16'
+
+
+@pytest.fixture
+def presigned_minio(monkeypatch):
+    from app.commons.service_connection.minio_client import Minio
+
+    def get_presigned_url(self, method, bucket, object_name, expires):
+        return f'http://minio/{bucket}/{object_name}?signature={method}'
+
+    monkeypatch.setattr(Minio, 'get_presigned_url', get_presigned_url)
+
+
+async def test_v2_dataset_download_should_stream_range_through_async_client(
+    client, jwt_token, httpx_mock, presigned_minio
+):
+    httpx_mock.add_response(
+        method='HEAD',
+        url='http://minio/bucket/obj/path?signature=HEAD',
+        headers={'Content-Length': '16', 'ETag': '"fake_etag"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://minio/bucket/obj/path?signature=GET',
+        match_headers={'Range': 'bytes=5-8'},
+        content=b'like',
+        status_code=206,
+    )
+    resp = await client.get(f'/v2/dataset/download/{jwt_token}', headers={'Range': 'bytes=5-8'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 5-8/16'
+    assert resp.headers['ETag'] == '"fake_etag"'
+    assert resp.headers['Last-Modified'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert resp.text == 'like'
+
+
+async def test_v2_dataset_download_should_return_error_msg_when_async_stat_fails(
+    client, jwt_token, httpx_mock, presigned_minio
+):
+    httpx_mock.add_response(method='HEAD', url='http://minio/bucket/obj/path?signature=HEAD', status_code=404)
+    resp = await client.get(f'/v2/dataset/download/{jwt_token}')
+    assert resp.status_code == 200
+    assert 'Error getting file from minio' in resp.json()['error_msg']
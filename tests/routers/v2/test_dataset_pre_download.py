@@ -18,6 +18,14 @@
 # permissions and limitations under the Licence.
 # 
 
+from unittest import mock
+
+from app.commons.data_providers.redis import SrvRedisSingleton
+from app.commons.download_manager import DownloadClient
+from app.commons.job_queue import QUEUE_KEY
+from app.config import ConfigClass
+
+
 async def test_v2_dataset_download_pre_return_500_when_query_not_found(
     client,
     httpx_mock,
@@ -121,3 +129,77 @@ async def test_v2_dataset_download_pre_return_200_when_success(
     assert result['operator'] == 'me'
     assert result['progress'] == 0
     assert result['payload']['hash_code']
+
+
+async def test_v2_dataset_download_pre_should_queue_job_when_job_queue_enabled(
+    client,
+    httpx_mock,
+    monkeypatch,
+):
+    monkeypatch.setattr(ConfigClass, 'JOB_QUEUE_ENABLED', True)
+    dataset_geid = 'fake_dataset_geid'
+    httpx_mock.add_response(
+        method='POST',
+        url='http://neo4j_service/v2/neo4j/relations/query',
+        json={
+            'results': [
+                {
+                    'code': 'any_code',
+                    'labels': 'File',
+                    'location': 'http://anything.com/bucket/obj/path',
+                    'global_entity_id': 'fake_geid',
+                    'project_code': '',
+                    'operator': 'me',
+                    'parent_folder': '',
+                    'dataset_code': 'fake_dataset_code',
+                }
+            ]
+        },
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url=f'http://neo4j_service/v1/neo4j/nodes/geid/{dataset_geid}',
+        json=[
+            {
+                'code': 'any_code',
+                'labels': ['Folder'],
+                'location': 'http://anything.com/bucket/obj/path',
+                'global_entity_id': 'fake_geid',
+                'project_code': '',
+                'operator': 'me',
+                'parent_folder': '',
+                'dataset_code': 'fake_dataset_code',
+            }
+        ],
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://neo4j_service/v1/neo4j/nodes/geid/fake_geid',
+        json=[
+            {
+                'code': 'any_code',
+                'labels': ['File'],
+                'location': 'http://anything.com/bucket/obj/path',
+                'global_entity_id': 'fake_geid',
+                'project_code': '',
+                'operator': 'me',
+                'parent_folder': '',
+                'dataset_code': 'fake_dataset_code',
+            }
+        ],
+    )
+
+    httpx_mock.add_response(
+        method='POST',
+        url='http://queue_service/v1/broker/pub',
+        json={},
+    )
+    with mock.patch.object(DownloadClient, 'zip_worker') as fake_zip:
+        resp = await client.post(
+            '/v2/dataset/download/pre', json={'session_id': 1234, 'operator': 'me', 'dataset_geid': dataset_geid}
+        )
+
+    assert resp.status_code == 200
+    assert resp.json()['result']['status'] == 'ZIPPING'
+    fake_zip.assert_not_called()
+    assert SrvRedisSingleton().get_sorted_set_size(QUEUE_KEY) == 1
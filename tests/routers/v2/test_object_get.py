@@ -18,11 +18,15 @@
 # permissions and limitations under the Licence.
 # 
 
+import io
+import zipfile
 from unittest import mock
 
 import minio
 import pytest
 
+from app.routers.v2.api_object_get import _iter_object_chunks
+
 
 async def test_v2_get_object_File_should_return_200_when_success(client, httpx_mock, mock_minio):
     httpx_mock.add_response(
@@ -68,9 +72,47 @@ async def test_v2_get_object_File_should_return_200_and_error_msg_when_minio_fai
     assert 'Error getting file from minio:' in resp.json()['error_msg']
 
 
+@mock.patch('time.time')
+@pytest.mark.parametrize('archived,expected_files', [(True, {}), (False, {'obj/path': b'File like object'})])
+async def test_v2_get_object_Folder_should_stream_zip_when_success(
+    mock_time, client, httpx_mock, mock_minio, archived, expected_files
+):
+    httpx_mock.add_response(method='POST', url='http://neo4j_service/v1/neo4j/nodes/File/query', json=[])
+    httpx_mock.add_response(
+        method='POST',
+        url='http://neo4j_service/v2/neo4j/relations/query',
+        json={
+            'results': [
+                {
+                    'code': 'any_code',
+                    'labels': 'File',
+                    'location': 'http://anything.com/bucket/obj/path',
+                    'global_entity_id': 'fake_geid',
+                    'project_code': '',
+                    'operator': 'me',
+                    'parent_folder': '',
+                    'dataset_code': 'fake_dataset_code',
+                    'archived': archived,
+                }
+            ]
+        },
+    )
+    mock_time.return_value = 1
+    resp = await client.get('/v2/object/any_id', headers={'Authorization': 'token', 'refresh_token': 'refresh_token'})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(resp.content))
+    assert {name: archive.read(name) for name in archive.namelist()} == expected_files
+
+
 @mock.patch('time.time')
 @pytest.mark.parametrize('archived', [(True), (False)])
-async def test_v2_get_object_Folder_should_return_200_when_success(mock_time, client, httpx_mock, mock_minio, archived):
+async def test_v2_get_object_Folder_should_return_200_when_success(
+    mock_time, client, httpx_mock, mock_minio, monkeypatch, archived
+):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'OBJECT_ZIP_STREAMING', False)
     httpx_mock.add_response(method='POST', url='http://neo4j_service/v1/neo4j/nodes/File/query', json=[])
     httpx_mock.add_response(
         method='POST',
@@ -107,8 +149,11 @@ async def test_v2_get_object_Folder_should_return_200_when_success(mock_time, cl
     ],
 )
 async def test_v2_get_object_Folder_should_return_correct_status_code_when_minio_exception_raised(
-    mock_minio, mock_time, client, httpx_mock, status_code, exception_code
+    mock_minio, mock_time, client, httpx_mock, monkeypatch, status_code, exception_code
 ):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'OBJECT_ZIP_STREAMING', False)
     httpx_mock.add_response(method='POST', url='http://neo4j_service/v1/neo4j/nodes/File/query', json=[])
     httpx_mock.add_response(
         method='POST',
@@ -124,6 +169,7 @@ async def test_v2_get_object_Folder_should_return_correct_status_code_when_minio
                     'operator': 'me',
                     'parent_folder': '',
                     'dataset_code': 'fake_dataset_code',
+                    'file_size': 16,
                 }
             ]
         },
@@ -135,3 +181,53 @@ async def test_v2_get_object_Folder_should_return_correct_status_code_when_minio
     mock_minio().fget_object.side_effect = [minio_exception]
     resp = await client.get('/v2/object/any_id', headers={'Authorization': 'token', 'refresh_token': 'refresh_token'})
     assert resp.status_code == status_code
+
+
+@mock.patch('app.commons.service_connection.minio_client.Minio')
+@pytest.mark.parametrize(
+    'status_code,exception_code',
+    [
+        (500, 'any'),
+        (200, 'NoSuchKey'),
+    ],
+)
+async def test_v2_get_object_Folder_stream_should_return_correct_status_code_when_minio_exception_raised(
+    mock_minio, client, httpx_mock, status_code, exception_code
+):
+    httpx_mock.add_response(method='POST', url='http://neo4j_service/v1/neo4j/nodes/File/query', json=[])
+    httpx_mock.add_response(
+        method='POST',
+        url='http://neo4j_service/v2/neo4j/relations/query',
+        json={
+            'results': [
+                {
+                    'code': 'any_code',
+                    'labels': 'File',
+                    'location': 'http://anything.com/bucket/obj/path',
+                    'global_entity_id': 'fake_geid',
+                    'project_code': '',
+                    'operator': 'me',
+                    'parent_folder': '',
+                    'dataset_code': 'fake_dataset_code',
+                }
+            ]
+        },
+    )
+    minio_exception = minio.error.S3Error(
+        code=exception_code, message='any msg', resource='any', request_id='any', host_id='any', response='error'
+    )
+    mock_minio().get_object.side_effect = [minio_exception]
+    resp = await client.get('/v2/object/any_id', headers={'Authorization': 'token', 'refresh_token': 'refresh_token'})
+    assert resp.status_code == status_code
+
+
+def test_iter_object_chunks_should_release_connection_when_stream_is_closed_early():
+    response = mock.MagicMock()
+    response.stream.return_value = iter([b'first', b'second'])
+    chunks = _iter_object_chunks(response, 5)
+
+    assert next(chunks) == b'first'
+    chunks.close()
+    response.stream.assert_called_once_with(5)
+    response.close.assert_called_once()
+    response.release_conn.assert_called_once()
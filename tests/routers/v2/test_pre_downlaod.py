@@ -22,6 +22,8 @@ import json
 import uuid
 from unittest import mock
 
+import minio
+
 
 async def test_v2_download_pre_return_400_when_project_code_and_dataset_geid_are_missing(client):
     resp = await client.post('/v2/download/pre/', json={'session_id': '123', 'operator': 'me', 'files': [{}]})
@@ -107,7 +109,11 @@ async def test_v2_download_pre_return_200_when_approval_request_id(
     fake_approval,
     client,
     httpx_mock,
+    monkeypatch,
 ):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'DIRECT_SINGLE_FILE_DOWNLOAD', False)
     httpx_mock.add_response(
         method='GET',
         url='http://neo4j_service/v1/neo4j/nodes/geid/fake_geid',
@@ -155,6 +161,7 @@ async def test_v2_download_pre_return_200_when_approval_request_id(
 async def test_v2_download_pre_return_200_when_label_is_not_Folder(
     client,
     httpx_mock,
+    mock_minio,
 ):
     httpx_mock.add_response(
         method='GET',
@@ -191,13 +198,53 @@ async def test_v2_download_pre_return_200_when_label_is_not_Folder(
     assert result['geid'] == 'fake_geid'
     assert 'obj/path' in result['source']
     assert result['action'] == 'data_download'
-    assert result['status'] == 'ZIPPING'
+    assert result['status'] == 'READY_FOR_DOWNLOADING'
     assert result['project_code'] == 'any_project_code'
     assert result['operator'] == 'me'
     assert result['progress'] == 0
     assert result['payload']['hash_code']
 
 
+async def test_v2_download_pre_return_403_when_user_can_not_read_single_file(
+    client,
+    httpx_mock,
+    mock_minio,
+    monkeypatch,
+):
+    from app.commons.service_connection.minio_client import Minio
+
+    def stat_object(self, bucket, object_name):
+        raise minio.error.S3Error(
+            code='AccessDenied', message='any msg', resource='any', request_id='any', host_id='any', response='error'
+        )
+
+    monkeypatch.setattr(Minio, 'stat_object', stat_object)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://neo4j_service/v1/neo4j/nodes/geid/fake_geid',
+        json=[
+            {
+                'labels': 'any_label',
+                'location': 'http://anything.com/bucket/obj/path',
+                'global_entity_id': 'fake_geid',
+            }
+        ],
+    )
+
+    resp = await client.post(
+        '/v2/download/pre/',
+        json={
+            'session_id': '123',
+            'operator': 'me',
+            'project_code': 'any_project_code',
+            'files': [{'geid': 'fake_geid'}],
+        },
+    )
+
+    assert resp.status_code == 403
+    assert resp.json()['result'] == ''
+
+
 async def test_v2_download_pre_return_200_when_label_is_Folder(
     client,
     httpx_mock,
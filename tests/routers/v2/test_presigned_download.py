@@ -0,0 +1,163 @@
+# Copyright 2022 Indoc Research
+# 
+# Licensed under the EUPL, Version 1.2 or – as soon they
+# will be approved by the European Commission - subsequent
+# versions of the EUPL (the "Licence");
+# You may not use this work except in compliance with the
+# Licence.
+# You may obtain a copy of the Licence at:
+# 
+# https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# 
+# Unless required by applicable law or agreed to in
+# writing, software distributed under the Licence is
+# distributed on an "AS IS" basis,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# express or implied.
+# See the Licence for the specific language governing
+# permissions and limitations under the Licence.
+# 
+
+import base64
+import json
+import time
+from datetime import datetime
+from datetime import timedelta
+
+import minio
+import pytest
+
+
+def _user_token(sub, issued_at):
+    def encode(part):
+        return base64.urlsafe_b64encode(part).decode().rstrip('=')
+
+    header = json.dumps({'alg': 'RS256', 'typ': 'JWT'}).encode()
+    claims = json.dumps({'sub': sub, 'iat': issued_at, 'exp': int(time.time()) + 300}).encode()
+    return 'Bearer ' + '.'.join([encode(header), encode(claims), encode(b'signature')])
+
+
+@pytest.fixture
+def presigned_cache(monkeypatch):
+    from app.commons.data_providers.redis import SrvRedisSingleton
+
+    cache = {}
+    ttls = cache.setdefault('ttls', {})
+    monkeypatch.setattr(SrvRedisSingleton, 'mget_by_keys', lambda x, keys: [cache.get(key) for key in keys])
+
+    def mset_with_expire(x, mapping, expire):
+        cache.update(mapping)
+        ttls.update({key: expire for key in mapping})
+
+    monkeypatch.setattr(SrvRedisSingleton, 'mset_with_expire', mset_with_expire)
+    return cache
+
+
+@pytest.fixture
+def presign(monkeypatch, mock_minio):
+    from app.commons.service_connection.minio_client import Minio
+
+    calls = []
+
+    def presigned_get_object(self, bucket, object_name, expires):
+        calls.append((bucket, object_name))
+        return f'http://minio/{bucket}/{object_name}?X-Amz-Expires={int(expires.total_seconds())}'
+
+    monkeypatch.setattr(Minio, 'presigned_get_object', presigned_get_object)
+    return calls
+
+
+async def test_v2_presigned_download_should_return_url_when_success(client, presign, presigned_cache):
+    headers = {'Authorization': 'token', 'Refresh-Token': 'refresh_token'}
+    resp = await client.post('/v2/object/presigned', json={'object_path': 'bucket/obj/path'}, headers=headers)
+    assert resp.status_code == 200
+    result = resp.json()['result']
+    assert result['object_path'] == 'bucket/obj/path'
+    assert result['url'] == 'http://minio/bucket/obj/path?X-Amz-Expires=3600'
+
+    resp = await client.post('/v2/object/presigned', json={'object_path': 'bucket/obj/path'}, headers=headers)
+    assert resp.json()['result'] == result
+    assert presign == [('bucket', 'obj/path')]
+
+
+@pytest.mark.parametrize('exception_code,status_code', [('NoSuchKey', 404), ('AccessDenied', 403)])
+async def test_v2_presigned_download_should_return_error_when_object_not_readable(
+    client, presign, presigned_cache, monkeypatch, exception_code, status_code
+):
+    from app.commons.service_connection.minio_client import Minio
+
+    def stat_object(self, bucket, object_name):
+        raise minio.error.S3Error(
+            code=exception_code, message='any', resource='any', request_id='any', host_id='any', response='error'
+        )
+
+    monkeypatch.setattr(Minio, 'stat_object', stat_object)
+    resp = await client.post(
+        '/v2/object/presigned', json={'object_path': 'bucket/obj/path'}, headers={'Authorization': 'token'}
+    )
+    assert resp.status_code == status_code
+    assert presign == []
+
+
+async def test_v2_presigned_download_should_return_400_when_object_path_invalid(client, presign, presigned_cache):
+    resp = await client.post('/v2/object/presigned', json={'object_path': 'bucket'}, headers={'Authorization': 'token'})
+    assert resp.status_code == 400
+
+
+async def test_v2_presigned_batch_download_should_only_presign_objects_not_cached(client, presign, presigned_cache):
+    headers = {'Authorization': 'token', 'Refresh-Token': 'refresh_token'}
+    await client.post('/v2/object/presigned/batch', json={'object_path': ['bucket/a']}, headers=headers)
+    resp = await client.post(
+        '/v2/object/presigned/batch', json={'object_path': ['bucket/a', 'bucket/b', 'bucket/a']}, headers=headers
+    )
+    assert resp.status_code == 200
+    assert resp.json()['total'] == 2
+    assert [url['object_path'] for url in resp.json()['result']] == ['bucket/a', 'bucket/b']
+    assert presign == [('bucket', 'a'), ('bucket', 'b')]
+
+
+async def test_v2_presigned_batch_download_should_return_400_when_too_many_objects(
+    client, presign, presigned_cache, monkeypatch
+):
+    from app.config import ConfigClass
+
+    monkeypatch.setattr(ConfigClass, 'PRESIGNED_URL_BATCH_LIMIT', 1)
+    resp = await client.post(
+        '/v2/object/presigned/batch', json={'object_path': ['bucket/a', 'bucket/b']}, headers={'Authorization': 'token'}
+    )
+    assert resp.status_code == 400
+
+
+async def test_v2_presigned_download_should_reuse_cached_url_after_token_refresh(client, presign, presigned_cache):
+    for issued_at in (1, 2):
+        resp = await client.post(
+            '/v2/object/presigned',
+            json={'object_path': 'bucket/obj/path'},
+            headers={'Authorization': _user_token('user-1', issued_at), 'Refresh-Token': 'refresh_token'},
+        )
+        assert resp.status_code == 200
+    assert presign == [('bucket', 'obj/path')]
+
+    resp = await client.post(
+        '/v2/object/presigned',
+        json={'object_path': 'bucket/obj/path'},
+        headers={'Authorization': _user_token('user-2', 1), 'Refresh-Token': 'refresh_token'},
+    )
+    assert presign == [('bucket', 'obj/path'), ('bucket', 'obj/path')]
+
+
+async def test_v2_presigned_download_should_cap_expiry_at_credentials_expiration(
+    client, presign, presigned_cache, monkeypatch
+):
+    from app.commons.service_connection.minio_client import Minio_Client_
+
+    monkeypatch.setattr(Minio_Client_, 'credentials_expiration', lambda x: datetime.utcnow() + timedelta(seconds=600))
+    resp = await client.post(
+        '/v2/object/presigned', json={'object_path': 'bucket/obj/path'}, headers={'Authorization': 'token'}
+    )
+
+    result = resp.json()['result']
+    assert result['expires_at'] <= int(time.time()) + 600
+    url_ttls = [ttl for key, ttl in presigned_cache['ttls'].items() if ':token:' not in key]
+    assert len(url_ttls) == 1
+    assert 290 <= url_ttls[0] <= 300